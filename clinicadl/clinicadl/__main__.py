@@ -0,0 +1,6 @@
+# coding: utf8
+
+from .main import main
+
+if __name__ == "__main__":
+    main()
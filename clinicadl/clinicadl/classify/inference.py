@@ -2,11 +2,17 @@
 
 import errno
 import pathlib
+from functools import partial
 from os import listdir, makedirs, strerror
-from os.path import exists, join
+from os.path import exists, join, splitext
 
 from torch.utils.data import DataLoader
 
+from clinicadl.classify.prediction_cache import (
+    CACHE_FILENAME,
+    PredictionCache,
+    merge_cached_predictions,
+)
 from clinicadl.tools.deep_learning import (
     commandline_to_json,
     create_model,
@@ -14,11 +20,14 @@ from clinicadl.tools.deep_learning import (
     read_json,
 )
 from clinicadl.tools.deep_learning.cnn_utils import (
+    concat_multi_cnn_results,
+    evaluate_prediction,
     get_criterion,
     mode_level_to_tsvs,
     soft_voting_to_tsvs,
     test,
 )
+from clinicadl.tools.deep_learning.columnar import find_table, read_table
 from clinicadl.tools.deep_learning.data import (
     compute_num_cnn,
     get_transforms,
@@ -26,6 +35,9 @@ from clinicadl.tools.deep_learning.data import (
     return_dataset,
 )
 from clinicadl.tools.deep_learning.iotools import return_logger, translate_parameters
+from clinicadl.tools.deep_learning.models import load_exported_model
+from clinicadl.tools.deep_learning.models.iotools import EXPORT_FILENAME
+from clinicadl.tools.deep_learning.models.quantization import quantize_linear_layers
 
 
 def classify(
@@ -42,6 +54,11 @@ def classify(
     diagnoses=None,
     verbose=0,
     multi_cohort=False,
+    use_cache=False,
+    cache_fingerprint="mtime",
+    shard=None,
+    prediction_format=None,
+    quantize=None,
 ):
     """
     This function verifies the input folders, and the existence of the json file
@@ -64,6 +81,17 @@ def classify(
         diagnoses: list of diagnoses to be tested if tsv_path is a folder.
         verbose: level of verbosity.
         multi_cohort (bool): If True caps_directory is the path to a TSV file linking cohort names and paths.
+        use_cache (bool): If True predictions are stored in
+            <model_path>/prediction_cache.db and only new or modified sessions
+            are given to the network.
+        cache_fingerprint (str): how images are identified in the cache
+            ("mtime" or "hash").
+        shard (str): "i/n" to only classify the i-th of n partitions of the subjects
+            (0 <= i < n). Partial results are gathered with merge_shards.
+        prediction_format (str): format of the sub-level prediction files ("tsv" or
+            "npz"). Default uses the format chosen for training.
+        quantize (str): if "int8" the fully connected layers are quantized before
+            inference on CPU.
 
     """
     logger = return_logger(verbose, "classify")
@@ -91,6 +119,11 @@ def classify(
         diagnoses,
         logger,
         multi_cohort,
+        use_cache,
+        cache_fingerprint,
+        parse_shard(shard) if shard is not None else None,
+        prediction_format,
+        quantize,
     )
 
 
@@ -109,6 +142,11 @@ def inference_from_model(
     diagnoses=None,
     logger=None,
     multi_cohort=False,
+    use_cache=False,
+    cache_fingerprint="mtime",
+    shard=None,
+    prediction_format=None,
+    quantize=None,
 ):
     """
     Inference from previously trained model.
@@ -137,6 +175,17 @@ def inference_from_model(
         diagnoses: list of diagnoses to be tested if tsv_path is a folder.
         logger: Logger instance.
         multi_cohort (bool): If True caps_directory is the path to a TSV file linking cohort names and paths.
+        use_cache (bool): If True predictions are stored in
+            <model_path>/prediction_cache.db and only new or modified sessions
+            are given to the network.
+        cache_fingerprint (str): how images are identified in the cache
+            ("mtime" or "hash").
+        shard (tuple): (index, number of shards) to only classify a partition of the
+            subjects. Soft voting is then left to merge_shards.
+        prediction_format (str): format of the sub-level prediction files ("tsv" or
+            "npz"). Default uses the format chosen for training.
+        quantize (str): if "int8" the fully connected layers are quantized before
+            inference on CPU.
 
     Returns:
         Files written in the output folder with prediction results and metrics. By
@@ -169,6 +218,13 @@ def inference_from_model(
     options.batch_size = batch_size
     if diagnoses is not None:
         options.diagnoses = diagnoses
+    if prediction_format is not None:
+        options.prediction_format = prediction_format
+    if quantize not in [None, "int8"]:
+        raise ValueError("Quantization %s is not implemented." % quantize)
+    if quantize is not None and gpu:
+        raise ValueError("Quantized models can only be run on CPU.")
+    options.quantize = quantize
 
     options = translate_parameters(options)
 
@@ -176,6 +232,14 @@ def inference_from_model(
         num_cnn = compute_num_cnn(caps_dir, tsv_path, options, "test")
     else:
         num_cnn = None
+    if shard is not None:
+        prefix = shard_prefix(prefix, *shard)
+
+    if use_cache:
+        cache = PredictionCache(join(model_path, CACHE_FILENAME), cache_fingerprint)
+    else:
+        cache = None
+
     # Define the path
     currentDirectory = pathlib.Path(model_path)
     # Search for 'fold-*' pattern
@@ -250,6 +314,8 @@ def inference_from_model(
                 logger=logger,
                 multi_cohort=multi_cohort,
                 prepare_dl=prepare_dl,
+                cache=cache,
+                shard=shard,
             )
 
             # Soft voting
@@ -260,7 +326,7 @@ def inference_from_model(
 
             # Write files at the image level (for patch, roi and slice).
             # It assumes the existance of validation files to perform soft-voting
-            if options.mode in ["patch", "roi", "slice"]:
+            if options.mode in ["patch", "roi", "slice"] and shard is None:
                 soft_voting_to_tsvs(
                     currentDirectory,
                     fold,
@@ -278,6 +344,9 @@ def inference_from_model(
                 "following folder: %s" % performance_dir
             )
 
+    if cache is not None:
+        cache.close()
+
 
 def inference_from_model_generic(
     caps_dir,
@@ -293,6 +362,8 @@ def inference_from_model_generic(
     logger=None,
     multi_cohort=False,
     prepare_dl=True,
+    cache=None,
+    shard=None,
 ):
     import logging
     from os.path import join
@@ -300,8 +371,6 @@ def inference_from_model_generic(
     if logger is None:
         logger = logging
 
-    gpu = not model_options.use_cpu
-
     _, all_transforms = get_transforms(
         model_options.mode, model_options.minmaxnormalization
     )
@@ -309,6 +378,11 @@ def inference_from_model_generic(
     test_df = load_data_test(
         tsv_path, model_options.diagnoses, multi_cohort=multi_cohort
     )
+    if shard is not None:
+        test_df = select_shard(test_df, *shard)
+        if len(test_df) == 0:
+            logger.warning("No subject was assigned to shard %i/%i." % shard)
+            return
 
     # Define loss and optimizer
     criterion = get_criterion(model_options.loss)
@@ -317,11 +391,11 @@ def inference_from_model_generic(
 
         for n in range(num_cnn):
 
-            test_dataset = return_dataset(
+            make_dataset = partial(
+                return_dataset,
                 model_options.mode,
                 caps_dir,
-                test_df,
-                model_options.preprocessing,
+                preprocessing=model_options.preprocessing,
                 train_transformations=None,
                 all_transformations=all_transforms,
                 params=model_options,
@@ -331,30 +405,16 @@ def inference_from_model_generic(
                 multi_cohort=multi_cohort,
             )
 
-            test_loader = DataLoader(
-                test_dataset,
-                batch_size=model_options.batch_size,
-                shuffle=False,
-                num_workers=model_options.nproc,
-                pin_memory=True,
-            )
-
             # load the best trained model during the training
-            model = create_model(model_options, test_dataset.size)
-            model, best_epoch = load_model(
-                model,
+            cnn_df, cnn_metrics = _predict(
+                make_dataset,
+                test_df,
                 join(model_path, "cnn-%i" % n, selection),
-                gpu,
-                filename="model_best.pth.tar",
-            )
-
-            cnn_df, cnn_metrics = test(
-                model,
-                test_loader,
-                gpu,
+                model_options,
                 criterion,
-                mode=model_options.mode,
-                use_labels=labels,
+                labels=labels,
+                cache=cache,
+                logger=logger,
             )
 
             if labels:
@@ -378,16 +438,23 @@ def inference_from_model_generic(
                 model_options.mode,
                 dataset=prefix,
                 cnn_index=n,
+                file_format=model_options.prediction_format,
+            )
+
+        # Partial results are merged later, hence the concatenation is done here
+        if shard is not None and model_options.mode != "image":
+            concat_multi_cnn_results(
+                output_dir, fold, selection, model_options.mode, prefix, num_cnn
             )
 
     else:
 
         # Read/localize the data
-        test_dataset = return_dataset(
+        make_dataset = partial(
+            return_dataset,
             model_options.mode,
             caps_dir,
-            test_df,
-            model_options.preprocessing,
+            preprocessing=model_options.preprocessing,
             train_transformations=None,
             all_transformations=all_transforms,
             params=model_options,
@@ -396,29 +463,16 @@ def inference_from_model_generic(
             multi_cohort=multi_cohort,
         )
 
-        # Load the data
-        test_loader = DataLoader(
-            test_dataset,
-            batch_size=model_options.batch_size,
-            shuffle=False,
-            num_workers=model_options.nproc,
-            pin_memory=True,
-        )
-
-        # Load model from path
-        model = create_model(model_options, test_dataset.size)
-        best_model, best_epoch = load_model(
-            model, join(model_path, selection), gpu, filename="model_best.pth.tar"
-        )
-
-        # Run the model on the data
-        predictions_df, metrics = test(
-            best_model,
-            test_loader,
-            gpu,
+        # Run the best model on the data
+        predictions_df, metrics = _predict(
+            make_dataset,
+            test_df,
+            join(model_path, selection),
+            model_options,
             criterion,
-            mode=model_options.mode,
-            use_labels=labels,
+            labels=labels,
+            cache=cache,
+            logger=logger,
         )
 
         if labels:
@@ -435,4 +489,391 @@ def inference_from_model_generic(
             selection,
             model_options.mode,
             dataset=prefix,
+            file_format=model_options.prediction_format,
         )
+
+
+def _predict(
+    make_dataset,
+    test_df,
+    model_dir,
+    model_options,
+    criterion,
+    labels=True,
+    cache=None,
+    logger=None,
+):
+    """
+    Runs the model stored in model_dir on the sessions of test_df.
+
+    If a PredictionCache is given, only the sessions unknown to the cache are
+    given to the network and the cached predictions are merged with the new ones.
+    The network is loaded by _load_best_model, and cached predictions are only
+    reused if they were made from the same file with the same precision.
+
+    Args:
+        make_dataset: (callable) builds the MRIDataset of a DataFrame of sessions.
+        test_df: (DataFrame) list of the sessions to classify.
+        model_dir: (str) folder containing model_best.pth.tar.
+        model_options: (Namespace) options of the model.
+        criterion: (loss) function to calculate the loss.
+        labels: (bool) If True the metrics are computed.
+        cache: (PredictionCache) cache of the previous predictions (optional).
+        logger: Logger instance.
+    Returns:
+        (DataFrame) results of each input.
+        (dict) ensemble of metrics.
+    """
+    import logging
+
+    if logger is None:
+        logger = logging
+
+    gpu = not model_options.use_cpu
+    mode = model_options.mode
+    test_dataset = make_dataset(test_df)
+    input_size = test_dataset.size
+
+    best_model, model_file, precision = _load_best_model(
+        model_dir, model_options, input_size, logger
+    )
+
+    if cache is not None:
+        # The key identifies the network which actually runs
+        model_key, image_keys = cache.keys(test_dataset, test_df, model_file, precision)
+        cached_df, missing_df, missing_keys = cache.split(
+            test_df, image_keys, model_key, mode, labels=labels
+        )
+        logger.info(
+            "%i/%i sessions found in the prediction cache"
+            % (len(test_df) - len(missing_df), len(test_df))
+        )
+        if len(missing_df) == 0:
+            return merge_cached_predictions(
+                test_df, cached_df, None, None, mode, labels=labels
+            )
+        elif len(cached_df) > 0:
+            test_dataset = make_dataset(missing_df)
+
+    test_loader = DataLoader(
+        test_dataset,
+        batch_size=model_options.batch_size,
+        shuffle=False,
+        num_workers=model_options.nproc,
+        pin_memory=True,
+    )
+
+    results_df, metrics = test(
+        best_model, test_loader, gpu, criterion, mode=mode, use_labels=labels
+    )
+
+    if cache is not None:
+        cache.store(results_df, missing_df, missing_keys, model_key, mode)
+        results_df, metrics = merge_cached_predictions(
+            test_df, cached_df, results_df, metrics, mode, labels=labels
+        )
+
+    return results_df, metrics
+
+
+def _load_best_model(model_dir, model_options, input_size, logger):
+    """
+    Loads the network used by _predict.
+
+    On CPU, the TorchScript module written by clinicadl export is used if it exists
+    and was exported from the current checkpoint. Otherwise the checkpoint is loaded
+    and its fully connected layers are quantized if model_options.quantize is set.
+
+    Args:
+        model_dir: (str) folder containing model_best.pth.tar.
+        model_options: (Namespace) options of the model.
+        input_size: (tuple) shape of one input of the model.
+        logger: Logger instance.
+    Returns:
+        (Module) the model.
+        (str) path to the file from which the model was loaded.
+        (str) precision of the model ("float32" or the quantization applied).
+    """
+    gpu = not model_options.use_cpu
+    quantize = getattr(model_options, "quantize", None)
+
+    best_model = None
+    if not gpu and exists(join(model_dir, EXPORT_FILENAME)):
+        logger.debug("Load the TorchScript module exported in %s" % model_dir)
+        best_model, export_shape = load_exported_model(model_dir)
+    if best_model is not None:
+        if export_shape != tuple(input_size):
+            raise ValueError(
+                "The exported model expects inputs of shape %s, whereas inputs of "
+                "shape %s were found." % (export_shape, tuple(input_size))
+            )
+        if quantize is not None and best_model.quantization is None:
+            logger.warning(
+                "The module exported in %s is not quantized: export it again with "
+                "--quantize to run it in int8." % model_dir
+            )
+        elif quantize is None and best_model.quantization is not None:
+            logger.warning(
+                "The module exported in %s is quantized (%s) although --quantize "
+                "was not given: export it again without --quantize to run it in "
+                "float32." % (model_dir, best_model.quantization)
+            )
+        model_file = join(model_dir, EXPORT_FILENAME)
+        precision = best_model.quantization or "float32"
+    else:
+        model = create_model(model_options, input_size)
+        best_model, best_epoch = load_model(
+            model, model_dir, gpu, filename="model_best.pth.tar"
+        )
+        if quantize is not None:
+            best_model = quantize_linear_layers(best_model)
+        model_file = join(model_dir, "model_best.pth.tar")
+        precision = "int8-dynamic" if quantize is not None else "float32"
+    logger.info("Model of %s run in %s precision" % (model_dir, precision))
+
+    return best_model, model_file, precision
+
+
+def parse_shard(shard):
+    """
+    Reads a shard given as "i/n" on the command line.
+
+    Args:
+        shard: (str) index of the shard and number of shards separated by a slash.
+    Returns:
+        (tuple) index of the shard, number of shards.
+    """
+    try:
+        shard_index, n_shards = [int(value) for value in shard.split("/")]
+    except ValueError:
+        raise ValueError(
+            "Shard %s should be given as i/n, i and n being integers." % shard
+        )
+    if n_shards < 1 or not 0 <= shard_index < n_shards:
+        raise ValueError(
+            "Shard index %i should be between 0 and %i." % (shard_index, n_shards - 1)
+        )
+
+    return shard_index, n_shards
+
+
+def shard_prefix(prefix, shard_index, n_shards):
+    """Prefix of the partial outputs written by a shard."""
+    return "%s_shard-%iof%i" % (prefix, shard_index, n_shards)
+
+
+def select_shard(data_df, shard_index, n_shards):
+    """
+    Keeps the sessions of the subjects assigned to a shard.
+
+    Subjects are assigned according to a checksum of their participant_id, so that
+    all the sessions of a subject belong to the same shard whatever the order
+    of the TSV file.
+
+    Args:
+        data_df: (DataFrame) list of sessions to classify.
+        shard_index: (int) index of the shard.
+        n_shards: (int) number of shards.
+    Returns:
+        (DataFrame) sessions of the shard.
+    """
+    from zlib import crc32
+
+    shard_mask = [
+        crc32(participant.encode()) % n_shards == shard_index
+        for participant in data_df.participant_id.values
+    ]
+    return data_df[shard_mask].reset_index(drop=True)
+
+
+def merge_shards(model_path, prefix, selection_metrics=None, labels=True, verbose=0):
+    """
+    Gathers the partial outputs of a sharded classification.
+
+    The predictions of all the shards are concatenated, then metrics and
+    soft voting are computed on the whole set as if classify was run once.
+
+    Args:
+        model_path: (str) folder of the model used by the shards.
+        prefix: (str) prefix given to classify by all the shards.
+        selection_metrics: (list) metrics used to select the best models.
+        labels: (bool) If False no metrics tsv files will be written.
+        verbose: level of verbosity.
+    """
+    import argparse
+    from glob import glob
+
+    import pandas as pd
+
+    logger = return_logger(verbose, "classify merge")
+
+    if selection_metrics is None:
+        selection_metrics = ["balanced_accuracy"]
+
+    json_file = join(model_path, "commandline.json")
+    if not exists(json_file):
+        logger.error("Json file doesn't exist")
+        raise FileNotFoundError(errno.ENOENT, strerror(errno.ENOENT), json_file)
+
+    options = argparse.Namespace(model_path=model_path)
+    options = read_json(options, json_path=json_file)
+    options = translate_parameters(options)
+    mode = options.mode
+    if hasattr(options, "selection_threshold"):
+        selection_thresh = options.selection_threshold
+    else:
+        selection_thresh = 0.8
+
+    currentDirectory = pathlib.Path(model_path)
+    for fold_dir in currentDirectory.glob("fold-*"):
+        fold = int(str(fold_dir).split("-")[-1])
+
+        for selection_metric in selection_metrics:
+            selection = "best_%s" % selection_metric
+            performance_dir = join(fold_dir, "cnn_classification", selection)
+            shard_pattern = join(
+                performance_dir, "%s_shard-*_%s_level_prediction.*" % (prefix, mode)
+            )
+            shard_roots = sorted(
+                set(splitext(shard_path)[0] for shard_path in glob(shard_pattern))
+            )
+            if len(shard_roots) == 0:
+                raise FileNotFoundError(
+                    errno.ENOENT, strerror(errno.ENOENT), shard_pattern
+                )
+            shard_roots = check_shards(shard_roots, prefix, mode)
+            logger.info(
+                "Merging %i shards for fold %i and model selected on %s"
+                % (len(shard_roots), fold, selection)
+            )
+
+            shard_paths = [find_table(shard_root) for shard_root in shard_roots]
+            prediction_df = pd.concat(
+                [read_table(shard_path) for shard_path in shard_paths]
+            )
+            prediction_df.reset_index(drop=True, inplace=True)
+            # The merged file keeps the format of the partial files
+            file_format = splitext(shard_paths[0])[1][1:]
+
+            metrics = None
+            if labels:
+                shard_metrics_df = pd.concat(
+                    [
+                        pd.read_csv(
+                            shard_root.replace("_level_prediction", "_level_metrics")
+                            + ".tsv",
+                            sep="\t",
+                        )
+                        for shard_root in shard_roots
+                    ]
+                )
+                metrics = _merge_shard_metrics(
+                    prediction_df, shard_metrics_df, mode, options.mode_task
+                )
+
+            mode_level_to_tsvs(
+                currentDirectory,
+                prediction_df,
+                metrics,
+                fold,
+                selection,
+                mode,
+                dataset=prefix,
+                file_format=file_format,
+            )
+
+            if mode in ["patch", "roi", "slice"]:
+                soft_voting_to_tsvs(
+                    currentDirectory,
+                    fold,
+                    selection,
+                    mode,
+                    prefix,
+                    selection_threshold=selection_thresh,
+                    use_labels=labels,
+                    logger=logger,
+                )
+
+            logger.info(
+                "Prediction results and metrics are written in the "
+                "following folder: %s" % performance_dir
+            )
+
+
+def check_shards(shard_roots, prefix, mode):
+    """
+    Checks that partial outputs come from one complete sharded classification.
+
+    Args:
+        shard_roots: (list of str) paths to the prediction files of the shards
+            without their extension.
+        prefix: (str) prefix given to classify by all the shards.
+        mode: (str) input used by the network.
+    Returns:
+        (list of str) the paths ordered by shard index.
+    Raises:
+        ValueError: if the shards were run with different numbers of shards, or if
+            a shard is missing.
+    """
+    import re
+    from os.path import basename
+
+    shard_regex = re.compile(
+        r"^%s_shard-(\d+)of(\d+)_%s_level_prediction$"
+        % (re.escape(prefix), re.escape(mode))
+    )
+    shards = dict()
+    for shard_root in shard_roots:
+        match = shard_regex.match(basename(shard_root))
+        if match is None:
+            raise ValueError("Cannot read the shard index of %s." % shard_root)
+        shards[(int(match.group(1)), int(match.group(2)))] = shard_root
+
+    n_shards_set = set(n_shards for _, n_shards in shards)
+    if len(n_shards_set) > 1:
+        raise ValueError(
+            "Outputs of classifications run with different numbers of shards %s "
+            "were found. Please remove the outputs of the previous runs."
+            % sorted(n_shards_set)
+        )
+    n_shards = n_shards_set.pop()
+    missing_shards = [i for i in range(n_shards) if (i, n_shards) not in shards]
+    if len(missing_shards) > 0:
+        raise ValueError("Shards %s of %i are missing." % (missing_shards, n_shards))
+
+    return [shards[(i, n_shards)] for i in range(n_shards)]
+
+
+def _merge_shard_metrics(prediction_df, shard_metrics_df, mode, mode_task):
+    """
+    Computes the metrics of the concatenated predictions of several shards.
+
+    Losses are summed over the shards. In a multi-CNN framework one row is
+    computed per CNN, as done by concat_multi_cnn_results.
+    """
+    import pandas as pd
+
+    # In each shard file the metrics of the i-th CNN are written at row i
+    losses_df = (
+        shard_metrics_df[["total_loss", "total_kl_loss", "total_atlas_loss"]]
+        .groupby(level=0)
+        .sum()
+    )
+
+    if mode_task == "multicnn":
+        groups = prediction_df.groupby("%s_id" % mode)
+    else:
+        groups = [(0, prediction_df)]
+
+    rows = list()
+    for cnn_index, group_df in groups:
+        metrics = evaluate_prediction(
+            group_df.true_label.values.astype(int),
+            group_df.predicted_label.values.astype(int),
+        )
+        metrics.update(losses_df.loc[cnn_index].to_dict())
+        rows.append(metrics)
+
+    if mode_task == "multicnn":
+        return pd.DataFrame(rows)
+    return rows[0]
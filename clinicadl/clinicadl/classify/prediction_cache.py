@@ -0,0 +1,290 @@
+# coding: utf8
+
+import sqlite3
+from os import path, stat
+
+import pandas as pd
+
+from clinicadl.tools.deep_learning.models.iotools import file_digest
+
+CACHE_FILENAME = "prediction_cache.db"
+
+
+class PredictionCache:
+    """
+    Persistent store of the predictions made by classify.
+
+    Each row is keyed by the fingerprint of the input image, the hash of the
+    file from which the model was loaded and its precision, the mode and the index of the element (patch, roi or slice)
+    so that only new or modified sessions are given to the network again.
+    The fingerprint used is written in the cache, so that readers which do not
+    choose one compute the same image keys as the last writer.
+    """
+
+    def __init__(self, db_path, fingerprint=None):
+        """
+        Args:
+            db_path: (str) path to the SQLite file (created if needed).
+            fingerprint: (str) how images are identified. "mtime" uses the path,
+                size and modification time of the file, "hash" its SHA-256 digest.
+                If None, the fingerprint written in the cache is used ("mtime" for
+                a new cache).
+        """
+        if fingerprint not in [None, "mtime", "hash"]:
+            raise ValueError(
+                "Fingerprint %s is not implemented. Please choose in ['mtime', 'hash']."
+                % fingerprint
+            )
+        self.db_path = db_path
+        self.connection = sqlite3.connect(db_path)
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS settings ("
+            "name TEXT PRIMARY KEY, "
+            "value TEXT NOT NULL)"
+        )
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS predictions ("
+            "image_key TEXT NOT NULL, "
+            "model_key TEXT NOT NULL, "
+            "mode TEXT NOT NULL, "
+            "elem_id INTEGER NOT NULL, "
+            "predicted_label INTEGER NOT NULL, "
+            "proba0 REAL, "
+            "proba1 REAL, "
+            "PRIMARY KEY (image_key, model_key, mode, elem_id))"
+        )
+        if fingerprint is None:
+            row = self.connection.execute(
+                "SELECT value FROM settings WHERE name = 'fingerprint'"
+            ).fetchone()
+            fingerprint = "mtime" if row is None else row[0]
+        else:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO settings VALUES ('fingerprint', ?)",
+                (fingerprint,),
+            )
+        self.fingerprint = fingerprint
+        self.connection.commit()
+
+    def close(self):
+        self.connection.close()
+
+    file_digest = staticmethod(file_digest)
+
+    def model_key(self, model_path, precision="float32"):
+        """
+        Identifies the network which runs by the hash of the file from which it was
+        loaded (checkpoint or exported module) and its precision.
+        """
+        return "%s:%s" % (self.file_digest(model_path), precision)
+
+    def image_key(self, image_path):
+        if self.fingerprint == "hash":
+            return self.file_digest(image_path)
+        image_stat = stat(image_path)
+        return "%s:%i:%i" % (
+            path.abspath(image_path),
+            image_stat.st_size,
+            image_stat.st_mtime_ns,
+        )
+
+    def image_keys(self, dataset, data_df):
+        """
+        Fingerprints the image read for each session of data_df.
+
+        Args:
+            dataset: (MRIDataset) dataset used to locate the images in the CAPS.
+            data_df: (DataFrame) list of participants, sessions and cohorts.
+        Returns:
+            (list) the image key of each row of data_df.
+        """
+        from clinicadl.tools.data.utils import find_image_path
+
+        keys = list()
+        for idx in data_df.index.values:
+            participant = data_df.loc[idx, "participant_id"]
+            session = data_df.loc[idx, "session_id"]
+            cohort = data_df.loc[idx, "cohort"]
+            image_path = dataset._get_path(participant, session, cohort, mode="image")
+            if not path.exists(image_path):
+                image_path = find_image_path(
+                    dataset.caps_dict,
+                    participant,
+                    session,
+                    cohort,
+                    dataset.preprocessing,
+                )
+            keys.append(self.image_key(image_path))
+
+        return keys
+
+    def keys(self, dataset, data_df, model_path, precision="float32"):
+        """
+        Computes the keys of the predictions of a model on the sessions of data_df.
+
+        Args:
+            dataset: (MRIDataset) dataset used to locate the images in the CAPS.
+            data_df: (DataFrame) list of participants, sessions and cohorts.
+            model_path: (str) path to the file from which the model was loaded.
+            precision: (str) precision of the model ("float32" or the quantization).
+        Returns:
+            (str) the model key.
+            (list) the image key of each row of data_df.
+        """
+        return (
+            self.model_key(model_path, precision),
+            self.image_keys(dataset, data_df),
+        )
+
+    def split(self, data_df, image_keys, model_key, mode, labels=True):
+        """
+        Separates the sessions already predicted by the model from the others.
+
+        Args:
+            data_df: (DataFrame) list of sessions to classify.
+            image_keys: (list) fingerprints of the images of data_df.
+            model_key: (str) hash and precision of the model used.
+            mode: (str) input used by the network.
+            labels: (bool) If True the true_label column is restored from the diagnosis.
+        Returns:
+            (DataFrame) cached predictions formatted as the output of cnn_utils.test.
+            (DataFrame) sessions which must be given to the network.
+            (list) fingerprints of the images of these sessions.
+        """
+        from clinicadl.tools.deep_learning.data import MRIDataset
+
+        cached_rows = list()
+        missing_idx = list()
+        missing_keys = list()
+        for idx, image_key in zip(data_df.index.values, image_keys):
+            rows = self.connection.execute(
+                "SELECT elem_id, predicted_label, proba0, proba1 FROM predictions "
+                "WHERE image_key = ? AND model_key = ? AND mode = ? ORDER BY elem_id",
+                (image_key, model_key, mode),
+            ).fetchall()
+            if len(rows) == 0:
+                missing_idx.append(idx)
+                missing_keys.append(image_key)
+                continue
+
+            participant = data_df.loc[idx, "participant_id"]
+            session = data_df.loc[idx, "session_id"]
+            if labels:
+                true_label = MRIDataset.diagnosis_code[data_df.loc[idx, "diagnosis"]]
+            for elem_id, predicted_label, proba0, proba1 in rows:
+                row = {"participant_id": participant, "session_id": session}
+                if mode != "image":
+                    row["%s_id" % mode] = elem_id
+                if labels:
+                    row["true_label"] = true_label
+                row["predicted_label"] = predicted_label
+                if mode != "image":
+                    row["proba0"] = proba0
+                    row["proba1"] = proba1
+                cached_rows.append(row)
+
+        cached_df = pd.DataFrame(cached_rows)
+        missing_df = data_df.loc[missing_idx].reset_index(drop=True)
+
+        return cached_df, missing_df, missing_keys
+
+    def store(self, results_df, data_df, image_keys, model_key, mode):
+        """
+        Saves the predictions computed by cnn_utils.test.
+
+        Args:
+            results_df: (DataFrame) output of cnn_utils.test.
+            data_df: (DataFrame) sessions given to the network.
+            image_keys: (list) fingerprints of the images of data_df.
+            model_key: (str) hash and precision of the model used.
+            mode: (str) input used by the network.
+        """
+        keys_dict = {
+            (participant, session): image_key
+            for participant, session, image_key in zip(
+                data_df.participant_id.values, data_df.session_id.values, image_keys
+            )
+        }
+        values = list()
+        for _, row in results_df.iterrows():
+            image_key = keys_dict[(row.participant_id, row.session_id)]
+            if mode == "image":
+                elem_id, proba0, proba1 = 0, None, None
+            else:
+                elem_id = int(row["%s_id" % mode])
+                proba0, proba1 = float(row.proba0), float(row.proba1)
+            values.append(
+                (
+                    image_key,
+                    model_key,
+                    mode,
+                    elem_id,
+                    int(row.predicted_label),
+                    proba0,
+                    proba1,
+                )
+            )
+
+        with self.connection:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO predictions VALUES (?, ?, ?, ?, ?, ?, ?)",
+                values,
+            )
+
+
+def merge_cached_predictions(
+    data_df, cached_df, results_df, metrics, mode, labels=True
+):
+    """
+    Concatenates cached and new predictions in the order of data_df and updates
+    the metrics.
+
+    The losses included in the metrics only account for the inputs given to the network.
+
+    Args:
+        data_df: (DataFrame) list of all the sessions classified.
+        cached_df: (DataFrame) predictions restored from the cache.
+        results_df: (DataFrame) predictions computed by the network (may be None).
+        metrics: (dict) metrics computed by the network (may be None).
+        mode: (str) input used by the network.
+        labels: (bool) If True the metrics are computed.
+    Returns:
+        (DataFrame) all the predictions.
+        (dict) metrics computed on all the predictions.
+    """
+    from clinicadl.tools.deep_learning.cnn_utils import evaluate_prediction
+
+    if len(cached_df) == 0:
+        return results_df, metrics
+    elif results_df is None:
+        results_df = cached_df
+    else:
+        results_df = pd.concat([cached_df, results_df[cached_df.columns]])
+
+    order = {
+        (participant, session): i
+        for i, (participant, session) in enumerate(
+            zip(data_df.participant_id.values, data_df.session_id.values)
+        )
+    }
+    results_df["order"] = [
+        order[(participant, session)]
+        for participant, session in zip(
+            results_df.participant_id.values, results_df.session_id.values
+        )
+    ]
+    sort_columns = ["order"] if mode == "image" else ["order", "%s_id" % mode]
+    results_df = results_df.sort_values(sort_columns).drop("order", axis=1)
+    results_df.reset_index(inplace=True, drop=True)
+
+    if not labels:
+        return results_df, None
+
+    merged_metrics = evaluate_prediction(
+        results_df.true_label.values.astype(int),
+        results_df.predicted_label.values.astype(int),
+    )
+    for key in ["total_loss", "total_kl_loss", "total_atlas_loss"]:
+        merged_metrics[key] = 0 if metrics is None else metrics[key]
+
+    return results_df, merged_metrics
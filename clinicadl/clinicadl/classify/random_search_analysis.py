@@ -1,17 +1,42 @@
 """
 Produces a tsv file to analyze the performance of one launch of the random search.
 """
-import os
+from contextlib import closing
 from os import path
-from warnings import warn
 
 import numpy as np
-import pandas as pd
 
 from clinicadl.tools.deep_learning import read_json
+from clinicadl.train.random_search_index import (
+    DB_FILENAME,
+    best_jobs,
+    connect,
+    job_scores,
+    marginals,
+    rebuild_index,
+    threshold_table,
+    update_index,
+)
 
 
-def random_search_analysis(launch_dir):
+def random_search_analysis(launch_dir, top_k=10, rebuild=False):
+    """
+    Writes the analysis of the jobs of a random search, computed with its index.
+
+    For each selection metric, three tables are written in launch_dir:
+        - analysis_<selection>.tsv counts the jobs whose validation balanced
+          accuracy is greater than a series of thresholds,
+        - analysis_best_<selection>.tsv lists the top_k best jobs with their
+          hyperparameters,
+        - analysis_marginals_<selection>.tsv gives the performance of the jobs
+          according to the value of each hyperparameter.
+
+    Args:
+        launch_dir: (str) folder containing random_search.json.
+        top_k: (int) number of jobs in the list of the best jobs.
+        rebuild: (bool) if True the index is rebuilt from the folders of the jobs.
+            Otherwise the job folders missing from the index are added to it.
+    """
 
     rs_options = read_json(json_path=path.join(launch_dir, "random_search.json"))
 
@@ -23,72 +48,45 @@ def random_search_analysis(launch_dir):
     else:
         fold_iterator = rs_options.split
 
-    jobs_list = [
-        job
-        for job in os.listdir(launch_dir)
-        if path.exists(path.join(launch_dir, job, "commandline.json"))
-    ]
-
-    for selection in ["balanced_accuracy", "loss"]:
-
-        columns = [
-            "run",
-            ">0.5",
-            ">0.55",
-            ">0.6",
-            ">0.65",
-            ">0.7",
-            ">0.75",
-            ">0.8",
-            ">0.85",
-            ">0.9",
-            ">0.95",
-            "folds",
-        ]
-        output_df = pd.DataFrame(columns=columns)
-        thresholds = np.arange(0.5, 1, 0.05)
-        thresholds = np.insert(thresholds, 0, 0)
+    if rebuild or not path.exists(path.join(launch_dir, DB_FILENAME)):
+        rebuild_index(launch_dir)
+    else:
+        update_index(launch_dir)
 
-        for job in jobs_list:
+    with closing(connect(launch_dir)) as connection:
+        for selection in ["balanced_accuracy", "loss"]:
 
-            valid_accuracies = []
-            for fold in fold_iterator:
-                performance_path = path.join(
-                    launch_dir,
-                    job,
-                    f"fold-{fold}",
-                    "cnn_classification",
-                    f"best_{selection}",
-                )
-                if path.exists(performance_path):
-                    valid_df = pd.read_csv(
-                        path.join(
-                            performance_path, "validation_image_level_metrics.tsv"
-                        ),
-                        sep="\t",
-                    )
-                    valid_accuracies.append(
-                        valid_df.loc[0, "balanced_accuracy"].astype(float)
-                    )
-                else:
-                    warn(f"The fold {fold} doesn't exist for job {job}")
+            columns = [
+                "run",
+                ">0.5",
+                ">0.55",
+                ">0.6",
+                ">0.65",
+                ">0.7",
+                ">0.75",
+                ">0.8",
+                ">0.85",
+                ">0.9",
+                ">0.95",
+                "folds",
+            ]
+            thresholds = np.arange(0.5, 1, 0.05)
+            thresholds = np.insert(thresholds, 0, 0)
 
-            # Find the mean value of all existing folds
-            if len(valid_accuracies) > 0:
-                bac_valid = np.mean(valid_accuracies)
-                row = (bac_valid > thresholds).astype(int)
-            else:
-                row = np.zeros(len(thresholds), dtype=int)
-            row = np.concatenate([row, [len(valid_accuracies)]])
-            row_df = pd.DataFrame(index=[job], data=row.reshape(1, -1), columns=columns)
-            output_df = pd.concat([output_df, row_df])
+            scores = job_scores(connection, selection, folds=fold_iterator)
+            output_df = threshold_table(scores, thresholds, columns)
+            output_df.to_csv(
+                path.join(launch_dir, "analysis_" + selection + ".tsv"), sep="\t"
+            )
 
-        total_df = pd.DataFrame(
-            np.array(output_df.sum()).reshape(1, -1), columns=columns, index=["total"]
-        )
-        output_df = pd.concat([output_df, total_df])
-        output_df.sort_index(inplace=True)
+            best_df = best_jobs(connection, selection, k=top_k, folds=fold_iterator)
+            best_df.to_csv(
+                path.join(launch_dir, "analysis_best_" + selection + ".tsv"), sep="\t"
+            )
 
-        output_df.to_csv(
-            path.join(launch_dir, "analysis_" + selection + ".tsv"), sep="\t"
-        )
+            marginals_df = marginals(connection, selection, folds=fold_iterator)
+            marginals_df.to_csv(
+                path.join(launch_dir, "analysis_marginals_" + selection + ".tsv"),
+                sep="\t",
+                index=False,
+            )
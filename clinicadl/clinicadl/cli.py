@@ -60,9 +60,10 @@ def qc_func(args):
             batch_size=args.batch_size,
             num_workers=args.nproc,
             gpu=not args.use_cpu,
+            use_extracted_tensors=args.use_extracted_tensors,
         )
     elif args.preprocessing == "t1-volume":
-        volume_qc(args.caps_dir, args.output_dir, args.group_label)
+        volume_qc(args.caps_dir, args.output_dir, args.group_label, n_proc=args.nproc)
 
 
 def generate_data_func(args):
@@ -81,6 +82,9 @@ def generate_data_func(args):
             mean=args.mean,
             sigma=args.sigma,
             preprocessing=args.preprocessing,
+            n_proc=args.nproc,
+            seed=args.seed,
+            extract_tensors=args.extract_tensors,
         )
     elif args.mode == "trivial":
         generate_trivial_dataset(
@@ -91,6 +95,9 @@ def generate_data_func(args):
             preprocessing=args.preprocessing,
             mask_path=args.mask_path,
             atrophy_percent=args.atrophy_percent,
+            n_proc=args.nproc,
+            seed=args.seed,
+            extract_tensors=args.extract_tensors,
         )
     else:
         labels_distribution = {
@@ -103,18 +110,26 @@ def generate_data_func(args):
             labels_distribution=labels_distribution,
             samples=args.n_subjects,
             smoothing=args.smoothing,
+            batch_size=args.batch_size,
+            individual_files=args.individual_files,
+            seed=args.seed,
         )
 
 
 def rs_func(args):
     from .classify.random_search_analysis import random_search_analysis
     from .train.random_search import launch_search
+    from .train.random_search_queue import launch_queue
 
     if args.random_task == "generate":
         launch_search(args)
+    elif args.random_task == "run":
+        launch_queue(args)
     elif args.random_task == "analysis":
         random_search_analysis(
             args.launch_dir,
+            top_k=args.top_k,
+            rebuild=args.rebuild,
         )
     else:
         raise ValueError("This task was not implemented in random-search.")
@@ -126,6 +141,12 @@ def retrain_func(args):
     retrain(args.json_path, args.output_dir, verbose=args.verbose)
 
 
+def sweep_func(args):
+    from .train.train_sweep import train_sweep_from_json
+
+    train_sweep_from_json(args.json_paths, args.output_dir, verbose=args.verbose)
+
+
 def resume_func(args):
     from .resume.automatic_resume import automatic_resume
 
@@ -184,6 +205,57 @@ def classify_func(args):
         diagnoses=args.diagnoses,
         verbose=args.verbose,
         multi_cohort=args.multi_cohort,
+        use_cache=args.use_cache,
+        cache_fingerprint=args.cache_fingerprint,
+        shard=args.shard,
+        prediction_format=args.prediction_format,
+        quantize=args.quantize,
+    )
+
+
+def classify_merge_func(args):
+    from .classify.inference import merge_shards
+
+    merge_shards(
+        args.model_path,
+        args.prefix_output,
+        selection_metrics=args.selection_metrics,
+        labels=not args.no_labels,
+        verbose=args.verbose,
+    )
+
+
+def export_func(args):
+    from .export.torchscript import export_torchscript
+
+    export_torchscript(
+        args.model_path,
+        selection_metrics=args.selection_metrics,
+        caps_dir=args.caps_dir,
+        tsv_path=args.tsv_path,
+        quantize=args.quantize,
+        quantize_convolutions=args.quantize_convolutions,
+        n_calibration=args.n_calibration,
+        verbose=args.verbose,
+    )
+
+
+def encode_func(args):
+    from .encode.latents import encode
+
+    encode(
+        args.caps_directory,
+        args.tsv_path,
+        args.model_path,
+        args.prefix_output,
+        labels=not args.no_labels,
+        gpu=not args.use_cpu,
+        num_workers=args.nproc,
+        batch_size=args.batch_size,
+        prepare_dl=args.use_extracted_features,
+        diagnoses=args.diagnoses,
+        multi_cohort=args.multi_cohort,
+        verbose=args.verbose,
     )
 
 
@@ -255,6 +327,19 @@ def tsv_analysis_func(args):
     )
 
 
+def tsv_convert_func(args):
+    from .tools.deep_learning.columnar import columnar_to_tsv, find_columnar
+
+    for input_path in args.input_paths:
+        file_paths = find_columnar(input_path)
+        if len(file_paths) == 0:
+            print("No columnar file found at %s." % input_path)
+        for file_path in file_paths:
+            tsv_path = columnar_to_tsv(file_path)
+            if args.verbose > 0:
+                print("%s exported to %s." % (file_path, tsv_path))
+
+
 def interpret_func(args):
     from .interpret.group_backprop import group_backprop
     from .interpret.individual_backprop import individual_backprop
@@ -344,6 +429,26 @@ def parse_command_line():
         default=300,
         help="Number of subjects in each class of the synthetic dataset.",
     )
+    generate_rs_parent_parser.add_argument(
+        "-np",
+        "--nproc",
+        type=int,
+        default=2,
+        help="Number of processes generating the images. (default=2)",
+    )
+    generate_rs_parent_parser.add_argument(
+        "--seed",
+        type=int,
+        default=None,
+        help="Seed of the random generators. Default draws a random seed.",
+    )
+    generate_rs_parent_parser.add_argument(
+        "--extract_tensors",
+        action="store_true",
+        default=False,
+        help="Also writes the tensors of deeplearning-prepare-data (image mode), "
+        "so that the synthetic dataset can be used for training without extraction.",
+    )
 
     generate_random_parser = generate_subparser.add_parser(
         "random",
@@ -425,6 +530,24 @@ def parse_command_line():
         default=False,
         help="Adds random smoothing to generated data.",
     )
+    generate_shepplogan_parser.add_argument(
+        "--batch_size",
+        type=int,
+        default=256,
+        help="Number of images generated at once. (default=256)",
+    )
+    generate_shepplogan_parser.add_argument(
+        "--individual_files",
+        action="store_true",
+        default=False,
+        help="Writes one tensor file per image instead of a single packed file.",
+    )
+    generate_shepplogan_parser.add_argument(
+        "--seed",
+        type=int,
+        default=None,
+        help="Seed of the random generator. Default draws a random seed.",
+    )
     generate_shepplogan_parser.set_defaults(func=generate_data_func)
 
     # Preprocessing
@@ -633,8 +756,8 @@ def parse_command_line():
     )
     qc_linear_parser.add_argument(
         "--batch_size",
-        help="Batch size used in DataLoader (default=1).",
-        default=1,
+        help="Batch size used in DataLoader (default=8).",
+        default=8,
         type=int,
     )
     qc_linear_parser.add_argument(
@@ -651,6 +774,13 @@ def parse_command_line():
         help="If provided, will use CPU instead of GPU.",
         default=False,
     )
+    qc_linear_parser.add_argument(
+        "--use_extracted_tensors",
+        action="store_true",
+        help="If provided, the tensors extracted by deeplearning-prepare-data "
+        "are used instead of the NIfTI images.",
+        default=False,
+    )
     qc_linear_parser.set_defaults(func=qc_func)
 
     qc_volume_parser = qc_subparsers.add_parser(
@@ -669,6 +799,13 @@ def parse_command_line():
         help="Identifier for the group of subjects used to create the DARTEL template.",
         type=str,
     )
+    qc_volume_parser.add_argument(
+        "-np",
+        "--nproc",
+        help="Number of processes computing the QC metrics. (default=2)",
+        type=int,
+        default=2,
+    )
     qc_volume_parser.set_defaults(func=qc_func)
 
     # random search parsers
@@ -731,6 +868,124 @@ def parse_command_line():
 
     rs_generate_parser.set_defaults(func=rs_func)
 
+    rs_run_parser = rs_subparsers.add_parser(
+        "run",
+        parents=[parent_parser],
+        help="""Sample new networks in a queue and train the queued networks with
+                local workers.""",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    rs_run_pos_group = rs_run_parser.add_argument_group(TRAIN_CATEGORIES["POSITIONAL"])
+    rs_run_pos_group.add_argument(
+        "launch_dir", type=str, help="Directory containing the random_search.json file."
+    )
+
+    rs_run_comp_group = rs_run_parser.add_argument_group(
+        TRAIN_CATEGORIES["COMPUTATIONAL"]
+    )
+    rs_run_comp_group.add_argument(
+        "-cpu",
+        "--use_cpu",
+        action="store_true",
+        help="If provided, will use CPU instead of GPU.",
+        default=False,
+    )
+    rs_run_comp_group.add_argument(
+        "-np",
+        "--nproc",
+        help="Number of workers loading the data of each job.",
+        type=int,
+        default=2,
+    )
+    rs_run_comp_group.add_argument(
+        "--batch_size", default=2, type=int, help="Batch size for training."
+    )
+    rs_run_comp_group.add_argument(
+        "--evaluation_steps",
+        "-esteps",
+        default=0,
+        type=int,
+        help="Fix the number of iterations to perform before computing an evaluation. Default will only "
+        "perform one evaluation at the end of each epoch.",
+    )
+
+    rs_run_queue_group = rs_run_parser.add_argument_group(
+        "%sJob queue%s" % (Fore.BLUE, Fore.RESET)
+    )
+    rs_run_queue_group.add_argument(
+        "--n_jobs",
+        help="""Number of networks sampled and added to the queue before training.
+                With 0, only the jobs already queued are trained.""",
+        type=int,
+        default=0,
+    )
+    rs_run_queue_group.add_argument(
+        "--workers",
+        help="Number of jobs trained at the same time.",
+        type=int,
+        default=1,
+    )
+    rs_run_queue_group.add_argument(
+        "--threads_per_worker",
+        help="Maximum number of threads used by the computations of each job.",
+        type=int,
+        default=1,
+    )
+    rs_run_queue_group.add_argument(
+        "--group_size",
+        help="""Maximum number of queued CNNs using the same data which are trained
+                together by a worker, with one input pipeline.""",
+        type=int,
+        default=1,
+    )
+    rs_run_queue_group.add_argument(
+        "--job_prefix",
+        help="Prefix of the names of the jobs sampled.",
+        type=str,
+        default="job",
+    )
+
+    rs_run_halving_group = rs_run_parser.add_argument_group(
+        "%sSuccessive halving%s" % (Fore.BLUE, Fore.RESET)
+    )
+    rs_run_halving_group.add_argument(
+        "--halving",
+        help="""If provided, the worst jobs are stopped early at rungs (asynchronous
+                successive halving) to free their slot for the next jobs.""",
+        action="store_true",
+        default=False,
+    )
+    rs_run_halving_group.add_argument(
+        "--min_epochs",
+        help="Number of epochs of the first rung.",
+        type=int,
+        default=1,
+    )
+    rs_run_halving_group.add_argument(
+        "--reduction_factor",
+        help="""Ratio between the number of epochs of two consecutive rungs. Only the
+                best 1 / reduction_factor of the jobs continue after each rung.""",
+        type=int,
+        default=3,
+    )
+    rs_run_halving_group.add_argument(
+        "--halving_metric",
+        help="""Validation metric compared at the rungs. Autoencoders are always
+                compared with their loss.""",
+        choices=["loss", "balanced_accuracy"],
+        type=str,
+        default="balanced_accuracy",
+    )
+    rs_run_halving_group.add_argument(
+        "--n_replacements",
+        help="""Maximum number of networks sampled and added to the queue to replace
+                the jobs stopped early.""",
+        type=int,
+        default=0,
+    )
+
+    rs_run_parser.set_defaults(func=rs_func)
+
     rs_analysis_parser = rs_subparsers.add_parser(
         "analysis",
         help="Performs the analysis of all jobs in launch_dir",
@@ -740,6 +995,19 @@ def parse_command_line():
     rs_analysis_parser.add_argument(
         "launch_dir", type=str, help="Directory containing the random_search.json file."
     )
+    rs_analysis_parser.add_argument(
+        "--top_k",
+        help="Number of jobs in the list of the best jobs.",
+        type=int,
+        default=10,
+    )
+    rs_analysis_parser.add_argument(
+        "--rebuild",
+        help="""If provided, the index of the jobs is rebuilt from their folders
+                before the analysis.""",
+        action="store_true",
+        default=False,
+    )
 
     rs_analysis_parser.set_defaults(func=rs_func)
 
@@ -768,6 +1036,29 @@ def parse_command_line():
         type=str,
         default=None,
     )
+    transfer_learning_group.add_argument(
+        "--fix_first_layers",
+        help="""Number of blocks of the convolutional part of the CNN whose
+                parameters are not trained (ignored for autoencoders). A block ends
+                with a pooling layer.""",
+        type=int,
+        default=0,
+    )
+    transfer_learning_group.add_argument(
+        "--frozen_cache",
+        help="""Computes the outputs of the frozen first blocks once per input and
+                keeps them in RAM or on disk (ignored for autoencoders).""",
+        type=str,
+        default=None,
+        choices=["ram", "disk"],
+    )
+    transfer_learning_group.add_argument(
+        "--frozen_cache_size",
+        help="""Maximum number of inputs whose activations are cached. The least
+                recently used are evicted first.""",
+        type=int,
+        default=1000,
+    )
 
     # Autoencoder
     autoencoder_parent = argparse.ArgumentParser(add_help=False)
@@ -780,6 +1071,25 @@ def parse_command_line():
         action="store_true",
         default=False,
     )
+    autoencoder_group.add_argument(
+        "--unpooling",
+        help="""How the decoder inverts the 3D max pooling layers of the encoder.
+                'indices' keeps the positions of the maxima (int64), 'compact' keeps
+                their offsets in the pooling window (8 bits) and 'upsampling' learns
+                the upsampling without keeping any position. 'compact' only saves
+                memory during evaluation: the gradient of the pooling still needs
+                the int64 positions during training.""",
+        type=str,
+        default="indices",
+        choices=["indices", "compact", "upsampling"],
+    )
+    autoencoder_group.add_argument(
+        "--train_evaluation_size",
+        help="""Number of training inputs (randomly chosen once) used to evaluate
+                the training loss. Default uses the whole training set.""",
+        type=int,
+        default=0,
+    )
 
     ######################
     # IMAGE
@@ -1198,6 +1508,34 @@ def parse_command_line():
 
     train_json_parser.set_defaults(func=retrain_func)
 
+    #########################
+    # SWEEP
+    #########################
+    train_sweep_parser = train_subparser.add_parser(
+        "sweep",
+        parents=[parent_parser],
+        help="""Train several CNNs defined in JSON files with the same input
+                pipeline (the data is loaded once for all the CNNs).""",
+    )
+    train_sweep_group = train_sweep_parser.add_argument_group(
+        TRAIN_CATEGORIES["POSITIONAL"]
+    )
+    train_sweep_group.add_argument(
+        "output_dir",
+        type=str,
+        help="""Directory in which the jobs are stored, in a folder named after
+                their JSON file.""",
+    )
+    train_sweep_group.add_argument(
+        "json_paths",
+        type=str,
+        nargs="+",
+        help="""Paths to the JSON files. All the jobs must be single CNNs using
+                the same data.""",
+    )
+
+    train_sweep_parser.set_defaults(func=sweep_func)
+
     #########################
     # RESUME
     #########################
@@ -1354,9 +1692,240 @@ def parse_command_line():
         action="store_true",
         default=False,
     )
+    classify_specific_group.add_argument(
+        "--use_cache",
+        help="""Stores the predictions in a cache in model_path and only classifies
+                the sessions which are new or were modified since the last call.""",
+        action="store_true",
+        default=False,
+    )
+    classify_specific_group.add_argument(
+        "--cache_fingerprint",
+        help="""How images are identified in the prediction cache: 'mtime' uses the path,
+                size and modification time of the file, 'hash' its content. (default=mtime)""",
+        choices=["mtime", "hash"],
+        default="mtime",
+        type=str,
+    )
+    classify_specific_group.add_argument(
+        "--shard",
+        help="""Only classifies the subjects of the i-th of n partitions, given as i/n
+                with 0 <= i < n. Partial results are gathered with classify-merge.""",
+        default=None,
+        type=str,
+    )
+
+    classify_specific_group.add_argument(
+        "--prediction_format",
+        help="""Format of the files storing the predictions at the patch, roi or slice
+                level. Default uses the format chosen for training.""",
+        default=None,
+        type=str,
+        choices=["tsv", "npz"],
+    )
+    classify_specific_group.add_argument(
+        "--quantize",
+        help="""Quantize the fully connected layers of the model to speed up
+                inference on CPU (needs --use_cpu).""",
+        default=None,
+        type=str,
+        choices=["int8"],
+    )
 
     classify_parser.set_defaults(func=classify_func)
 
+    classify_merge_parser = subparser.add_parser(
+        "classify-merge",
+        parents=[parent_parser],
+        help="""Gather the partial results of classify obtained with --shard and
+                compute metrics and soft voting on the whole set.""",
+    )
+    classify_merge_pos_group = classify_merge_parser.add_argument_group(
+        TRAIN_CATEGORIES["POSITIONAL"]
+    )
+    classify_merge_pos_group.add_argument(
+        "model_path",
+        help="""Path to the folder where the model is stored.""",
+        default=None,
+    )
+    classify_merge_pos_group.add_argument(
+        "prefix_output",
+        help="Prefix given to all the shards of the classify task.",
+        type=str,
+    )
+    classify_merge_specific_group = classify_merge_parser.add_argument_group(
+        TRAIN_CATEGORIES["OPTIONAL"]
+    )
+    classify_merge_specific_group.add_argument(
+        "-nl",
+        "--no_labels",
+        action="store_true",
+        help="Add this flag if your dataset does not contain a ground truth.",
+        default=False,
+    )
+    classify_merge_specific_group.add_argument(
+        "--selection_metrics",
+        help="""List of metrics used to find the best models which were evaluated.""",
+        choices=["loss", "balanced_accuracy"],
+        default=["balanced_accuracy"],
+        nargs="+",
+    )
+
+    classify_merge_parser.set_defaults(func=classify_merge_func)
+
+    export_parser = subparser.add_parser(
+        "export",
+        parents=[parent_parser],
+        help="""Export the best models of each fold as frozen TorchScript modules
+                used by classify on CPU.""",
+    )
+    export_pos_group = export_parser.add_argument_group(TRAIN_CATEGORIES["POSITIONAL"])
+    export_pos_group.add_argument(
+        "model_path",
+        help="""Path to the folder where the model is stored. Folder structure
+                should be the same obtained during the training.""",
+        default=None,
+    )
+    export_specific_group = export_parser.add_argument_group(
+        TRAIN_CATEGORIES["OPTIONAL"]
+    )
+    export_specific_group.add_argument(
+        "--selection_metrics",
+        help="""List of metrics to find the best models to export. Default will
+        export the best model based on balanced accuracy.""",
+        choices=["loss", "balanced_accuracy"],
+        default=["balanced_accuracy"],
+        nargs="+",
+    )
+    export_specific_group.add_argument(
+        "--caps_dir",
+        help="""Data using CAPS structure used to find the shape of the inputs.
+                Default will use the CAPS used for training.""",
+        default=None,
+        type=str,
+    )
+    export_specific_group.add_argument(
+        "--tsv_path",
+        help="""Path to the file with subjects/sessions of caps_dir.
+                Default will use the validation set of each fold.""",
+        default=None,
+        type=str,
+    )
+    export_quantize_group = export_parser.add_argument_group(
+        "%sQuantization arguments%s" % (Fore.BLUE, Fore.RESET)
+    )
+    export_quantize_group.add_argument(
+        "--quantize",
+        help="""Quantize the fully connected layers of the exported models.
+                The accuracy drift on the validation set is written in
+                quantization_report.tsv.""",
+        choices=["int8"],
+        default=None,
+        type=str,
+    )
+    export_quantize_group.add_argument(
+        "--quantize_convolutions",
+        help="""Also quantize the 3D convolutions after a calibration on the
+                training set (only with --quantize).""",
+        default=False,
+        action="store_true",
+    )
+    export_quantize_group.add_argument(
+        "--n_calibration",
+        help="Number of training inputs used to calibrate the convolutions.",
+        default=32,
+        type=int,
+    )
+
+    export_parser.set_defaults(func=export_func)
+
+    encode_parser = subparser.add_parser(
+        "encode",
+        parents=[parent_parser],
+        help="""Write the latent representations computed by the encoder of a
+                trained autoencoder.""",
+    )
+    encode_pos_group = encode_parser.add_argument_group(TRAIN_CATEGORIES["POSITIONAL"])
+    encode_pos_group.add_argument(
+        "caps_directory", help="Data using CAPS structure.", default=None
+    )
+    encode_pos_group.add_argument(
+        "tsv_path",
+        help="""Path to the file with subjects/sessions to process.
+        If it includes the filename will load the tsv file directly.
+        Else will load the baseline tsv files of wanted diagnoses produced by tsvtool.""",
+        default=None,
+    )
+    encode_pos_group.add_argument(
+        "model_path",
+        help="""Path to the folder where the autoencoder is stored. Folder structure
+                should be the same obtained during the training.""",
+        default=None,
+    )
+    encode_pos_group.add_argument(
+        "prefix_output",
+        help="Name of the folder in which the latent representations are written.",
+        type=str,
+    )
+
+    encode_comput_group = encode_parser.add_argument_group(
+        TRAIN_CATEGORIES["COMPUTATIONAL"]
+    )
+    encode_comput_group.add_argument(
+        "-cpu",
+        "--use_cpu",
+        action="store_true",
+        help="Uses CPU instead of GPU.",
+        default=False,
+    )
+    encode_comput_group.add_argument(
+        "-np",
+        "--nproc",
+        help="Number of cores used during the task.",
+        type=int,
+        default=2,
+    )
+    encode_comput_group.add_argument(
+        "--batch_size",
+        default=2,
+        type=int,
+        help="Batch size for data loading. (default=2)",
+    )
+
+    encode_specific_group = encode_parser.add_argument_group(
+        TRAIN_CATEGORIES["OPTIONAL"]
+    )
+    encode_specific_group.add_argument(
+        "-nl",
+        "--no_labels",
+        action="store_true",
+        help="Add this flag if your dataset does not contain a ground truth.",
+        default=False,
+    )
+    encode_specific_group.add_argument(
+        "--use_extracted_features",
+        help="""If True the extract slices or patche are used, otherwise the they
+                will be extracted on the fly (if necessary).""",
+        default=False,
+        action="store_true",
+    )
+    encode_specific_group.add_argument(
+        "--diagnoses",
+        help="List of participants that will be encoded.",
+        nargs="+",
+        type=str,
+        choices=["AD", "CN", "MCI", "sMCI", "pMCI"],
+        default=None,
+    )
+    encode_specific_group.add_argument(
+        "--multi_cohort",
+        help="Performs multi-cohort encoding. In this case, caps_dir and tsv_path must be paths to TSV files.",
+        action="store_true",
+        default=False,
+    )
+
+    encode_parser.set_defaults(func=encode_func)
+
     tsv_parser = subparser.add_parser(
         "tsvtool", help="""Handle tsv files for metadata processing and data splits."""
     )
@@ -1364,7 +1933,7 @@ def parse_command_line():
     tsv_subparser = tsv_parser.add_subparsers(
         title="""Task to execute with tsv tool:""",
         description="""What kind of task do you want to use with tsv tool?
-                (restrict, getlabels, split, kfold, analysis).""",
+                (restrict, getlabels, split, kfold, analysis, convert).""",
         dest="tsv_task",
         help="""****** Tasks proposed by clinicadl tsv tool ******""",
     )
@@ -1596,6 +2165,22 @@ def parse_command_line():
 
     tsv_analysis_subparser.set_defaults(func=tsv_analysis_func)
 
+    tsv_convert_subparser = tsv_subparser.add_parser(
+        "convert",
+        parents=[parent_parser],
+        help="Exports the npz columnar files written with --prediction_format npz to TSV.",
+    )
+
+    tsv_convert_subparser.add_argument(
+        "input_paths",
+        help="""Paths to npz files, or to folders (for example a model folder) in which
+                all the npz columnar files are converted.""",
+        nargs="+",
+        type=str,
+    )
+
+    tsv_convert_subparser.set_defaults(func=tsv_convert_func)
+
     interpret_parser = subparser.add_parser(
         "interpret",
         help="""Interpret classification performed by a CNN with saliency maps.""",
@@ -1644,6 +2229,14 @@ def parse_command_line():
         type=int,
         help="the number of batches being loaded in parallel.",
     )
+    interpret_comput_group.add_argument(
+        "--chunk_size",
+        default=None,
+        type=int,
+        help="""Maximum number of images given to one backward pass. Batches are split
+                in chunks to bound memory. Default will use the whole batch, or
+                for occlusion the number of occluded copies filling 1 GiB.""",
+    )
 
     interpret_model_group = interpret_parent_parser.add_argument_group(
         TRAIN_CATEGORIES["MODEL"]
@@ -1710,6 +2303,43 @@ def parse_command_line():
         help="Path to a nifti template to retrieve affine values.",
     )
 
+    interpret_method_group = interpret_parent_parser.add_argument_group(
+        "%sInterpretation method%s" % (Fore.BLUE, Fore.RESET)
+    )
+    interpret_method_group.add_argument(
+        "--method",
+        default="gradients",
+        type=str,
+        choices=["gradients", "smooth_grad", "integrated_gradients", "occlusion"],
+        help="Method used to compute the saliency maps.",
+    )
+    interpret_method_group.add_argument(
+        "--n_samples",
+        default=25,
+        type=int,
+        help="""Number of noisy copies (smooth_grad) or of interpolation steps
+                (integrated_gradients) computed for each image.""",
+    )
+    interpret_method_group.add_argument(
+        "--noise_level",
+        default=0.1,
+        type=float,
+        help="""Standard deviation of the noise of smooth_grad relative to the
+                intensity range of each image.""",
+    )
+    interpret_method_group.add_argument(
+        "--occlusion_size",
+        default=50,
+        type=int,
+        help="Size of the patches occluded by the occlusion method.",
+    )
+    interpret_method_group.add_argument(
+        "--occlusion_stride",
+        default=50,
+        type=int,
+        help="Length between the corners of two patches occluded by the occlusion method.",
+    )
+
     interpret_display_group = interpret_parent_parser.add_argument_group(
         TRAIN_CATEGORIES["DISPLAY"]
     )
@@ -1725,6 +2355,12 @@ def parse_command_line():
         parents=[parent_parser, interpret_parent_parser],
         help="Mean saliency map over a list of sessions",
     )
+    interpret_group_parser.add_argument(
+        "--save_variance",
+        action="store_true",
+        default=False,
+        help="Also writes the voxel-wise variance of the saliency maps.",
+    )
 
     interpret_group_parser.set_defaults(func=interpret_func)
 
@@ -1733,6 +2369,19 @@ def parse_command_line():
         parents=[parent_parser, interpret_parent_parser],
         help="Individual saliency maps for each session in the input TSV file.",
     )
+    interpret_individual_parser.add_argument(
+        "--n_writers",
+        default=2,
+        type=int,
+        help="Number of threads writing the maps while the next gradients are computed.",
+    )
+    interpret_individual_parser.add_argument(
+        "--consolidated",
+        action="store_true",
+        default=False,
+        help="""Writes all the maps in one memory-mapped array (maps.npy) indexed by
+                maps.tsv instead of one folder per session.""",
+    )
 
     interpret_individual_parser.set_defaults(func=interpret_func)
 
@@ -1792,6 +2441,14 @@ def return_train_parent_parser():
         help="Fix the number of iterations to perform before computing an evaluation. Default will only "
         "perform one evaluation at the end of each epoch.",
     )
+    train_comput_group.add_argument(
+        "--prediction_format",
+        help="Format of the files storing the predictions at the patch, roi or slice level. "
+        "npz files are binary columnar files which are faster to read and write. (default=tsv)",
+        default="tsv",
+        type=str,
+        choices=["tsv", "npz"],
+    )
 
     train_data_group = train_parent_parser.add_argument_group(TRAIN_CATEGORIES["DATA"])
     train_data_group.add_argument(
@@ -0,0 +1,192 @@
+# coding: utf8
+
+import argparse
+import errno
+import pathlib
+from os import makedirs, strerror
+from os.path import exists, join
+
+import numpy as np
+import pandas as pd
+import torch
+from torch.utils.data import DataLoader
+
+from clinicadl.tools.deep_learning import commandline_to_json, read_json
+from clinicadl.tools.deep_learning.data import (
+    get_transforms,
+    load_data_test,
+    return_dataset,
+)
+from clinicadl.tools.deep_learning.iotools import return_logger, translate_parameters
+from clinicadl.tools.deep_learning.models import init_model, load_model
+
+LATENTS_FILENAME = "latents.npy"
+INDEX_FILENAME = "latents.tsv"
+
+
+def encode(
+    caps_dir,
+    tsv_path,
+    model_path,
+    prefix_output,
+    labels=True,
+    gpu=True,
+    num_workers=0,
+    batch_size=1,
+    prepare_dl=False,
+    diagnoses=None,
+    multi_cohort=False,
+    verbose=0,
+):
+    """
+    Runs the encoder of a trained autoencoder on a list of sessions and writes the
+    latent representations of all the inputs.
+
+    For each fold the latents are written in
+    <model_path>/fold-<fold>/autoencoder_latents/<prefix_output>:
+        - latents.npy, a memory-mapped array with one row per input,
+        - latents.tsv, the participant, session (and element index) of each row.
+    These files can be loaded with LatentDataset.
+
+    Args:
+        caps_dir: (str) folder containing the tensor files (.pt version of MRI).
+        tsv_path: (str) file with the name of the MRIs to process (single or multiple).
+        model_path: (str) folder of the trained autoencoder.
+        prefix_output: (str) name of the folder of the outputs.
+        labels: (bool) if True the labels of the sessions are also written.
+        gpu: (bool) if True a GPU is used.
+        num_workers: (int) number of workers of the DataLoader.
+        batch_size: (int) batch size of the DataLoader.
+        prepare_dl: (bool) if True the extracted patches/slices/regions are used.
+        diagnoses: (list) diagnoses encoded if tsv_path is a folder.
+        multi_cohort: (bool) if True caps_dir is the path to a TSV file linking
+            cohort names and paths.
+        verbose: level of verbosity.
+    """
+    logger = return_logger(verbose, "encode")
+
+    json_file = join(model_path, "commandline.json")
+    if not exists(json_file):
+        logger.error("Json file doesn't exist")
+        raise FileNotFoundError(errno.ENOENT, strerror(errno.ENOENT), json_file)
+
+    options = argparse.Namespace(model_path=model_path)
+    options = read_json(options, json_path=json_file)
+    if options.network_type != "autoencoder":
+        raise ValueError(
+            "Only autoencoders can be used to encode images. The model at path %s "
+            "is a %s." % (model_path, options.network_type)
+        )
+    options.use_cpu = not gpu
+    options.nproc = num_workers
+    options.batch_size = batch_size
+    if diagnoses is not None:
+        options.diagnoses = diagnoses
+    options = translate_parameters(options)
+
+    _, all_transforms = get_transforms(options.mode, options.minmaxnormalization)
+    data_df = load_data_test(tsv_path, options.diagnoses, multi_cohort=multi_cohort)
+    dataset = return_dataset(
+        options.mode,
+        caps_dir,
+        data_df,
+        options.preprocessing,
+        all_transformations=all_transforms,
+        params=options,
+        labels=labels,
+        multi_cohort=multi_cohort,
+        prepare_dl=prepare_dl,
+    )
+    dataloader = DataLoader(
+        dataset,
+        batch_size=options.batch_size,
+        shuffle=False,
+        num_workers=options.num_workers,
+        pin_memory=True,
+    )
+
+    for fold_dir in pathlib.Path(model_path).glob("fold-*"):
+        checkpoint_dir = join(fold_dir, "models", "best_loss")
+        if not exists(join(checkpoint_dir, "model_best.pth.tar")):
+            raise FileNotFoundError(
+                errno.ENOENT,
+                strerror(errno.ENOENT),
+                join(checkpoint_dir, "model_best.pth.tar"),
+            )
+        decoder = init_model(options, initial_shape=dataset.size, autoencoder=True)
+        decoder, _ = load_model(
+            decoder, checkpoint_dir, options.gpu, filename="model_best.pth.tar"
+        )
+
+        output_dir = join(fold_dir, "autoencoder_latents", prefix_output)
+        encode_dataset(decoder, dataloader, output_dir, options.gpu, labels=labels)
+        logger.info("Latent representations written in %s" % output_dir)
+
+    commandline_to_json(
+        {
+            "output_dir": model_path,
+            "caps_dir": caps_dir,
+            "tsv_path": tsv_path,
+            "prefix": prefix_output,
+            "labels": labels,
+        },
+        filename=f"commandline_encode-{prefix_output}",
+    )
+
+
+def encode_dataset(decoder, dataloader, output_dir, gpu, labels=True):
+    """
+    Writes the outputs of the encoder for all the inputs of dataloader.
+
+    Args:
+        decoder: (AutoEncoder) trained autoencoder.
+        dataloader: (DataLoader) wrapper of the dataset, must not be shuffled.
+        output_dir: (str) folder in which latents.npy and latents.tsv are written.
+        gpu: (bool) if True a GPU is used.
+        labels: (bool) if True the labels of the inputs are written in the index.
+    Returns:
+        (DataFrame) index of the rows of the latent array.
+    Raises:
+        ValueError: if the dataset is empty.
+    """
+    if len(dataloader.dataset) == 0:
+        raise ValueError("No input was found in the dataset to encode.")
+    makedirs(output_dir, exist_ok=True)
+    mode = dataloader.dataset.mode
+    decoder.eval()
+    dataloader.dataset.eval()
+
+    latents = None
+    rows = list()
+    with torch.no_grad():
+        for data in dataloader:
+            inputs = data["image"].cuda() if gpu else data["image"]
+            outputs = decoder.encode(inputs).cpu().numpy()
+            if latents is None:
+                # The shape of the latents is only known after the first batch
+                latents = np.lib.format.open_memmap(
+                    join(output_dir, LATENTS_FILENAME),
+                    mode="w+",
+                    dtype=np.float32,
+                    shape=(len(dataloader.dataset),) + outputs.shape[1:],
+                )
+            latents[len(rows) : len(rows) + len(outputs)] = outputs
+
+            for idx, participant_id in enumerate(data["participant_id"]):
+                row = {
+                    "latent_index": len(rows),
+                    "participant_id": participant_id,
+                    "session_id": data["session_id"][idx],
+                }
+                if mode != "image":
+                    row["%s_id" % mode] = int(data["%s_id" % mode][idx])
+                if labels:
+                    row["label"] = int(data["label"][idx])
+                rows.append(row)
+
+    latents.flush()
+    del latents
+    index_df = pd.DataFrame(rows)
+    index_df.to_csv(join(output_dir, INDEX_FILENAME), sep="\t", index=False)
+
+    return index_df
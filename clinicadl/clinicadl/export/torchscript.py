@@ -0,0 +1,237 @@
+# coding: utf8
+
+import argparse
+import errno
+import pathlib
+from os import listdir, strerror
+from os.path import exists, join
+
+import pandas as pd
+from torch.utils.data import DataLoader
+
+from clinicadl.tools.deep_learning.cnn_utils import get_criterion, test
+from clinicadl.tools.deep_learning.data import (
+    get_transforms,
+    load_data,
+    load_data_test,
+    return_dataset,
+)
+from clinicadl.tools.deep_learning.iotools import (
+    read_json,
+    return_logger,
+    translate_parameters,
+)
+from clinicadl.tools.deep_learning.models import create_model, export_model, load_model
+from clinicadl.tools.deep_learning.models.quantization import (
+    quantize_convolutions as quantize_convolutions_fn,
+)
+from clinicadl.tools.deep_learning.models.quantization import quantize_linear_layers
+
+
+def export_torchscript(
+    model_path,
+    selection_metrics=None,
+    caps_dir=None,
+    tsv_path=None,
+    quantize=None,
+    quantize_convolutions=False,
+    n_calibration=32,
+    verbose=0,
+):
+    """
+    Writes the best models of each fold as frozen TorchScript modules.
+
+    The modules are written next to the corresponding model_best.pth.tar and are
+    then used by classify when it runs on CPU.
+
+    Args:
+        model_path: (str) path to the folder of the trained model.
+        selection_metrics: (list) metrics used to select the best models to export.
+        caps_dir: (str) CAPS used to find the input shape. Default uses the training CAPS.
+        tsv_path: (str) TSV file or folder listing sessions of caps_dir.
+            Default uses the validation set of each fold.
+        quantize: (str) if "int8" the fully connected layers are quantized and the
+            accuracy drift on the validation set is written in quantization_report.tsv.
+        quantize_convolutions: (bool) if True the 3D convolutions are also quantized
+            after a calibration on the training set.
+        n_calibration: (int) number of training inputs used for calibration.
+        verbose: level of verbosity.
+    """
+    logger = return_logger(verbose, "export")
+
+    if selection_metrics is None:
+        selection_metrics = ["balanced_accuracy"]
+
+    json_file = join(model_path, "commandline.json")
+    if not exists(json_file):
+        logger.error("Json file doesn't exist")
+        raise FileNotFoundError(errno.ENOENT, strerror(errno.ENOENT), json_file)
+
+    options = argparse.Namespace(model_path=model_path)
+    options = read_json(options, json_path=json_file)
+    options.use_cpu = True
+    options = translate_parameters(options)
+
+    if options.mode_task == "autoencoder":
+        raise NotImplementedError("The export of autoencoders is not implemented.")
+    if caps_dir is None:
+        caps_dir = options.input_dir
+    if quantize not in [None, "int8"]:
+        raise ValueError("Quantization %s is not implemented." % quantize)
+    if quantize_convolutions and quantize is None:
+        raise ValueError("Convolutions can only be quantized with quantize='int8'.")
+    if quantize is not None:
+        quantization = "int8-static" if quantize_convolutions else "int8-dynamic"
+    else:
+        quantization = None
+    report_rows = list()
+
+    _, all_transforms = get_transforms(options.mode, options.minmaxnormalization)
+
+    for fold_dir in pathlib.Path(model_path).glob("fold-*"):
+        fold = int(str(fold_dir).split("-")[-1])
+        models_dir = join(fold_dir, "models")
+
+        if tsv_path is None or quantize_convolutions:
+            train_df, valid_df = load_data(
+                options.tsv_path,
+                options.diagnoses,
+                fold,
+                n_splits=options.n_splits,
+                baseline=options.baseline,
+                logger=logger,
+                multi_cohort=options.multi_cohort,
+            )
+        if tsv_path is None:
+            data_df = valid_df
+        else:
+            data_df = load_data_test(
+                tsv_path, options.diagnoses, multi_cohort=options.multi_cohort
+            )
+
+        if options.mode_task == "multicnn":
+            cnn_dirs = sorted(
+                cnn_dir for cnn_dir in listdir(models_dir) if cnn_dir.startswith("cnn-")
+            )
+        else:
+            cnn_dirs = [""]
+
+        for cnn_dir in cnn_dirs:
+            cnn_index = int(cnn_dir.split("-")[-1]) if cnn_dir else None
+            dataset = return_dataset(
+                options.mode,
+                caps_dir,
+                data_df,
+                options.preprocessing,
+                all_transformations=all_transforms,
+                params=options,
+                cnn_index=cnn_index,
+                multi_cohort=options.multi_cohort,
+                prepare_dl=options.prepare_dl,
+            )
+            model = create_model(options, dataset.size)
+            if quantize_convolutions:
+                calibration_loader = DataLoader(
+                    return_dataset(
+                        options.mode,
+                        caps_dir,
+                        train_df,
+                        options.preprocessing,
+                        all_transformations=all_transforms,
+                        params=options,
+                        cnn_index=cnn_index,
+                        multi_cohort=options.multi_cohort,
+                        prepare_dl=options.prepare_dl,
+                    ),
+                    batch_size=options.batch_size,
+                    shuffle=True,
+                    num_workers=options.num_workers,
+                )
+
+            for selection_metric in selection_metrics:
+                checkpoint_dir = join(models_dir, cnn_dir, "best_%s" % selection_metric)
+                if not exists(join(checkpoint_dir, "model_best.pth.tar")):
+                    raise FileNotFoundError(
+                        errno.ENOENT,
+                        strerror(errno.ENOENT),
+                        join(checkpoint_dir, "model_best.pth.tar"),
+                    )
+                best_model, _ = load_model(
+                    model, checkpoint_dir, gpu=False, filename="model_best.pth.tar"
+                )
+                if quantize is not None:
+                    quantized_model = quantize_linear_layers(best_model)
+                    if quantize_convolutions:
+                        quantized_model = quantize_convolutions_fn(
+                            quantized_model, calibration_loader, n_calibration
+                        )
+                    report_row = quantization_report(
+                        best_model,
+                        quantized_model,
+                        DataLoader(
+                            dataset,
+                            batch_size=options.batch_size,
+                            shuffle=False,
+                            num_workers=options.num_workers,
+                        ),
+                        get_criterion(options.loss),
+                        options.mode,
+                    )
+                    report_row.update(
+                        {
+                            "fold": fold,
+                            "selection": "best_%s" % selection_metric,
+                            "cnn_index": cnn_index,
+                        }
+                    )
+                    report_rows.append(report_row)
+                    best_model = quantized_model
+
+                export_path = export_model(
+                    best_model, dataset.size, checkpoint_dir, quantization=quantization
+                )
+                logger.info("Model exported at path %s" % export_path)
+
+    if quantize is not None:
+        report_df = pd.DataFrame(report_rows)
+        columns = ["fold", "selection", "cnn_index"]
+        report_df = report_df[
+            columns + [col for col in report_df.columns if col not in columns]
+        ]
+        report_path = join(model_path, "quantization_report.tsv")
+        report_df.to_csv(report_path, index=False, sep="\t")
+        logger.info("Accuracy drift due to quantization written at %s" % report_path)
+
+
+def quantization_report(float_model, quantized_model, dataloader, criterion, mode):
+    """
+    Compares the predictions of a model before and after quantization.
+
+    Args:
+        float_model: (Module) original model.
+        quantized_model: (Module) quantized version of float_model.
+        dataloader: (DataLoader) wrapper of a labelled dataset.
+        criterion: (loss) function to calculate the loss.
+        mode: (str) input used by the network.
+    Returns:
+        (dict) balanced accuracies of both models, their difference and the
+        proportion of identical predictions.
+    """
+    float_df, float_metrics = test(
+        float_model.cpu(), dataloader, False, criterion, mode=mode
+    )
+    quantized_df, quantized_metrics = test(
+        quantized_model, dataloader, False, criterion, mode=mode
+    )
+    agreement = (
+        float_df.predicted_label.values.astype(int)
+        == quantized_df.predicted_label.values.astype(int)
+    ).mean()
+
+    return {
+        "balanced_accuracy_float": float_metrics["balanced_accuracy"],
+        "balanced_accuracy_quantized": quantized_metrics["balanced_accuracy"],
+        "balanced_accuracy_drift": quantized_metrics["balanced_accuracy"]
+        - float_metrics["balanced_accuracy"],
+        "agreement": agreement,
+    }
@@ -4,11 +4,15 @@ import torch
 class VanillaBackProp:
     """
     Produces gradients generated with vanilla back propagation from the image
+
+    After each call to compute_gradients, the labels predicted by the model for
+    the batch are available in predicted_labels.
     """
 
     def __init__(self, model, gpu=False):
         self.model = model
         self.gradients = None
+        self.predicted_labels = None
         self.model.eval()
         self.gpu = gpu
 
@@ -16,19 +20,244 @@ class VanillaBackProp:
             self.model = self.model.cuda()
 
     def generate_gradients(self, input_batch, target_class):
-        # Forward
-        input_batch.requires_grad = True
+        # Convert Pytorch variable to numpy array
+        return self.compute_gradients(input_batch, target_class).cpu().numpy()
+
+    def compute_gradients(self, input_batch, target_class, chunk_size=None):
+        """
+        Computes the gradients of the target class with respect to the inputs.
+
+        Args:
+            input_batch: (Tensor) batch of inputs on the device of the model.
+            target_class: (int) index of the class explained.
+            chunk_size: (int) maximum number of inputs given to one backward pass.
+                Default uses the whole batch.
+        Returns:
+            (Tensor) gradients, on the device of input_batch.
+        """
+        if chunk_size is None:
+            chunk_size = len(input_batch)
+
+        gradients, outputs = zip(
+            *[
+                self._backward(chunk, target_class)
+                for chunk in torch.split(input_batch, chunk_size)
+            ]
+        )
+        # The forward pass of the gradients gives the predictions for free
+        self.predicted_labels = torch.cat(outputs).argmax(dim=1)
+        return torch.cat(gradients)
+
+    def _forward(self, input_batch):
         if hasattr(self.model, "variational") and self.model.variational:
             _, _, _, model_output = self.model(input_batch)
         else:
             model_output = self.model(input_batch)
+        return model_output
+
+    def _backward(self, input_batch, target_class):
+        # Forward
+        input_batch = input_batch.detach().requires_grad_(True)
+        model_output = self._forward(input_batch)
         # Target for backprop
         one_hot_output = torch.zeros_like(model_output)
         one_hot_output[:, target_class] = 1
-        if self.gpu:
-            one_hot_output = one_hot_output.cuda()
-        # Backward pass
-        model_output.backward(gradient=one_hot_output)
-        # Convert Pytorch variable to numpy array
-        gradients_as_arr = input_batch.grad.cpu().numpy()
-        return gradients_as_arr
+        # Backward pass, only the gradients with respect to the inputs are computed
+        # so that the parameters of the model are left untouched
+        (gradients,) = torch.autograd.grad(
+            model_output, input_batch, grad_outputs=one_hot_output
+        )
+        return gradients, model_output.detach()
+
+
+class RunningMapStatistics:
+    """
+    Accumulates the mean and variance of saliency maps on the device they are
+    computed on, so that only the final maps are copied to the host.
+
+    Batches are merged with the parallel variant of Welford's algorithm.
+    """
+
+    def __init__(self, compute_variance=False):
+        self.compute_variance = compute_variance
+        self.n_samples = 0
+        self.mean = None
+        self.m2 = None
+
+    def update(self, maps):
+        """
+        Args:
+            maps: (Tensor) batch of saliency maps (first dimension is the batch).
+        """
+        maps = maps.double()
+        n_batch = len(maps)
+        batch_mean = maps.mean(dim=0)
+        if self.mean is None:
+            self.mean = batch_mean
+            if self.compute_variance:
+                self.m2 = ((maps - batch_mean) ** 2).sum(dim=0)
+            self.n_samples = n_batch
+            return
+
+        n_total = self.n_samples + n_batch
+        delta = batch_mean - self.mean
+        self.mean += delta * (n_batch / n_total)
+        if self.compute_variance:
+            self.m2 += ((maps - batch_mean) ** 2).sum(dim=0)
+            self.m2 += delta ** 2 * (self.n_samples * n_batch / n_total)
+        self.n_samples = n_total
+
+    def mean_map(self):
+        """Returns the mean map as a float32 numpy array."""
+        return self.mean.float().cpu().numpy()
+
+    def variance_map(self):
+        """Returns the unbiased variance map as a float32 numpy array."""
+        if not self.compute_variance:
+            raise ValueError("The variance was not accumulated.")
+        if self.n_samples < 2:
+            return (self.m2 * 0).float().cpu().numpy()
+        return (self.m2 / (self.n_samples - 1)).float().cpu().numpy()
+
+
+class ExpandedBackProp(VanillaBackProp):
+    """
+    Base class of the methods averaging gradients over several modified copies
+    of each input.
+
+    The copies of all the inputs of a batch are generated chunk by chunk, so that
+    the number of volumes given to one backward pass never exceeds chunk_size.
+    """
+
+    def __init__(self, model, gpu=False, n_samples=25):
+        super().__init__(model, gpu=gpu)
+        self.n_samples = n_samples
+
+    def compute_gradients(self, input_batch, target_class, chunk_size=None):
+        if chunk_size is None:
+            chunk_size = len(input_batch) * self.n_samples
+
+        input_batch = input_batch.detach()
+        with torch.no_grad():
+            self.predicted_labels = self._forward(input_batch).argmax(dim=1)
+        self.prepare(input_batch)
+        sum_gradients = torch.zeros_like(input_batch)
+        n_copies = len(input_batch) * self.n_samples
+        for start in range(0, n_copies, chunk_size):
+            copy_indices = torch.arange(
+                start, min(start + chunk_size, n_copies), device=input_batch.device
+            )
+            input_indices = copy_indices // self.n_samples
+            sample_indices = copy_indices % self.n_samples
+            gradients, _ = self._backward(
+                self.modified_inputs(input_batch, input_indices, sample_indices),
+                target_class,
+            )
+            sum_gradients.index_add_(0, input_indices, gradients)
+
+        return self.attribution(input_batch, sum_gradients / self.n_samples)
+
+    def prepare(self, input_batch):
+        """Computes the quantities shared by all the copies of the batch."""
+        pass
+
+    def modified_inputs(self, input_batch, input_indices, sample_indices):
+        """Returns the copies of the inputs given to the network."""
+        raise NotImplementedError
+
+    def attribution(self, input_batch, mean_gradients):
+        """Converts the mean gradients in the final attribution maps."""
+        return mean_gradients
+
+
+class SmoothGrad(ExpandedBackProp):
+    """
+    Averages the gradients of noisy copies of the image (Smilkov et al., 2017).
+    """
+
+    def __init__(self, model, gpu=False, n_samples=25, noise_level=0.1):
+        """
+        Args:
+            model: (Module) CNN to interpret.
+            gpu: (bool) if True a gpu is used.
+            n_samples: (int) number of noisy copies of each image.
+            noise_level: (float) standard deviation of the gaussian noise relative
+                to the intensity range of each image.
+        """
+        super().__init__(model, gpu=gpu, n_samples=n_samples)
+        self.noise_level = noise_level
+        self.sigma = None
+
+    def prepare(self, input_batch):
+        flat_batch = input_batch.view(len(input_batch), -1)
+        intensity_range = flat_batch.max(dim=1)[0] - flat_batch.min(dim=1)[0]
+        self.sigma = self.noise_level * intensity_range
+
+    def modified_inputs(self, input_batch, input_indices, sample_indices):
+        inputs = input_batch[input_indices]
+        sigma = self.sigma[input_indices].view((-1,) + (1,) * (inputs.dim() - 1))
+        return inputs + sigma * torch.randn_like(inputs)
+
+
+class IntegratedGradients(ExpandedBackProp):
+    """
+    Integrates the gradients along the straight path from a baseline image to the
+    image (Sundararajan et al., 2017), with the midpoint rule.
+    """
+
+    def __init__(self, model, gpu=False, n_samples=25, baseline_value=0.0):
+        """
+        Args:
+            model: (Module) CNN to interpret.
+            gpu: (bool) if True a gpu is used.
+            n_samples: (int) number of interpolation steps.
+            baseline_value: (float) intensity of the uniform baseline image.
+        """
+        super().__init__(model, gpu=gpu, n_samples=n_samples)
+        self.baseline_value = baseline_value
+
+    def modified_inputs(self, input_batch, input_indices, sample_indices):
+        inputs = input_batch[input_indices]
+        alphas = (sample_indices.to(inputs.dtype) + 0.5) / self.n_samples
+        alphas = alphas.view((-1,) + (1,) * (inputs.dim() - 1))
+        return self.baseline_value + alphas * (inputs - self.baseline_value)
+
+    def attribution(self, input_batch, mean_gradients):
+        return (input_batch - self.baseline_value) * mean_gradients
+
+
+def create_interpreter(options, model):
+    """
+    Builds the interpreter chosen by options.method.
+
+    Args:
+        options: (Namespace) options of the interpret task.
+        model: (Module) CNN to interpret.
+    Returns:
+        (VanillaBackProp) the interpreter.
+    """
+    method = getattr(options, "method", "gradients")
+    if method == "gradients":
+        return VanillaBackProp(model, gpu=options.gpu)
+    elif method == "smooth_grad":
+        return SmoothGrad(
+            model,
+            gpu=options.gpu,
+            n_samples=options.n_samples,
+            noise_level=options.noise_level,
+        )
+    elif method == "integrated_gradients":
+        return IntegratedGradients(model, gpu=options.gpu, n_samples=options.n_samples)
+    elif method == "occlusion":
+        from .occlusion import OcclusionSensitivity
+
+        return OcclusionSensitivity(
+            model,
+            gpu=options.gpu,
+            occlusion_size=options.occlusion_size,
+            occlusion_stride=options.occlusion_stride,
+        )
+    else:
+        raise NotImplementedError(
+            "The interpretation method %s is not implemented." % method
+        )
@@ -2,6 +2,7 @@ import argparse
 import os
 import warnings
 from os import path
+from time import time
 
 import matplotlib.pyplot as plt
 import nibabel as nib
@@ -22,7 +23,9 @@ from clinicadl.tools.deep_learning.iotools import (
 )
 from clinicadl.tools.deep_learning.models import create_model, load_model
 
-from .gradients import VanillaBackProp
+from .gradients import RunningMapStatistics, create_interpreter
+from .predictions import find_image_predictions, keep_sessions, selection_mask
+from .writers import write_benchmark
 
 
 def group_backprop(options):
@@ -105,36 +108,49 @@ def group_backprop(options):
             commandline_to_json(options, logger=main_logger)
 
             # Keep only subjects who were correctly / wrongly predicted by the network
-            training_df = sort_predicted(
-                model,
-                training_df,
-                options.input_dir,
-                model_options,
-                criterion,
-                options.keep_true,
-                batch_size=options.batch_size,
-                num_workers=options.num_workers,
-                gpu=options.gpu,
-            )
-
-            if len(training_df) > 0:
-
-                # Save the tsv files used for the saliency maps
-                training_df.to_csv(path.join("data.tsv"), sep="\t", index=False)
-
-                with warnings.catch_warnings():
-                    warnings.simplefilter("ignore")
-                    data_train = return_dataset(
-                        model_options.mode,
-                        options.input_dir,
+            data_train = data_example
+            fused_selection = False
+            if options.keep_true is not None:
+                predictions_df = find_image_predictions(
+                    options.model_path,
+                    fold,
+                    selection,
+                    training_df,
+                    data_example,
+                    main_logger,
+                )
+                if predictions_df is None and model_options.mode == "image":
+                    # Sessions are selected with the forward pass of the interpreter
+                    fused_selection = True
+                else:
+                    training_df = sort_predicted(
+                        model,
                         training_df,
-                        model_options.preprocessing,
-                        train_transformations=None,
-                        all_transformations=all_transforms,
-                        prepare_dl=options.prepare_dl,
-                        multi_cohort=options.multi_cohort,
-                        params=model_options,
+                        options.input_dir,
+                        model_options,
+                        criterion,
+                        options.keep_true,
+                        batch_size=options.batch_size,
+                        num_workers=options.num_workers,
+                        gpu=options.gpu,
+                        predictions_df=predictions_df,
                     )
+                    if len(training_df) > 0:
+                        with warnings.catch_warnings():
+                            warnings.simplefilter("ignore")
+                            data_train = return_dataset(
+                                model_options.mode,
+                                options.input_dir,
+                                training_df,
+                                model_options.preprocessing,
+                                train_transformations=None,
+                                all_transformations=all_transforms,
+                                prepare_dl=options.prepare_dl,
+                                multi_cohort=options.multi_cohort,
+                                params=model_options,
+                            )
+
+            if len(training_df) > 0:
 
                 train_loader = DataLoader(
                     data_train,
@@ -144,21 +160,54 @@ def group_backprop(options):
                     pin_memory=True,
                 )
 
-                interpreter = VanillaBackProp(model, gpu=options.gpu)
+                interpreter = create_interpreter(options, model)
+                start_time = time()
+                statistics = RunningMapStatistics(
+                    compute_variance=options.save_variance
+                )
+                kept_sessions = list()
+                # Sessions are not filtered again if they were sorted beforehand
+                keep_true = options.keep_true if fused_selection else None
 
-                cum_map = 0
                 for data in train_loader:
                     if options.gpu:
-                        input_batch = data["image"].cuda()
+                        input_batch = data["image"].cuda(non_blocking=True)
                     else:
                         input_batch = data["image"]
 
-                    maps = interpreter.generate_gradients(
-                        input_batch, data_train.diagnosis_code[options.target_diagnosis]
+                    maps = interpreter.compute_gradients(
+                        input_batch,
+                        data_train.diagnosis_code[options.target_diagnosis],
+                        chunk_size=options.chunk_size,
                     )
-                    cum_map += maps.sum(axis=0)
+                    mask = selection_mask(
+                        data["label"], interpreter.predicted_labels, keep_true
+                    )
+                    if mask.any():
+                        statistics.update(maps[mask.to(maps.device)])
+                    kept_sessions += [
+                        (data["participant_id"][i], data["session_id"][i])
+                        for i in mask.nonzero().flatten().tolist()
+                    ]
+
+                sessions_per_second = write_benchmark(
+                    results_path, options.method, len(data_train), time() - start_time
+                )
+                main_logger.info(
+                    "%i saliency maps computed with %s (%.2f sessions/s)"
+                    % (len(data_train), options.method, sessions_per_second)
+                )
+                if statistics.n_samples == 0:
+                    main_logger.warn("There are no subjects for the given options")
+                    continue
 
-                mean_map = cum_map / len(data_train)
+                # Save the tsv files used for the saliency maps
+                training_df = keep_sessions(training_df, kept_sessions)
+                training_df.to_csv(
+                    path.join(results_path, "data.tsv"), sep="\t", index=False
+                )
+
+                mean_map = statistics.mean_map()
 
                 if len(data_train.size) == 4:
                     if options.nifti_template_path is not None:
@@ -181,5 +230,14 @@ def group_backprop(options):
                     plt.savefig(jpg_path)
                     plt.close()
                 np.save(path.join(results_path, "map.npy"), mean_map[0])
+
+                if options.save_variance:
+                    variance_map = statistics.variance_map()
+                    if len(data_train.size) == 4:
+                        variance_map_nii = nib.Nifti1Image(variance_map[0], affine)
+                        nib.save(
+                            variance_map_nii, path.join(results_path, "variance.nii.gz")
+                        )
+                    np.save(path.join(results_path, "variance.npy"), variance_map[0])
             else:
                 main_logger.warn("There are no subjects for the given options")
@@ -2,10 +2,8 @@ import argparse
 import os
 import warnings
 from os import path
+from time import time
 
-import matplotlib.pyplot as plt
-import nibabel as nib
-import numpy as np
 from torch.utils.data import DataLoader
 
 from clinicadl.tools.deep_learning.cnn_utils import get_criterion, sort_predicted
@@ -22,7 +20,9 @@ from clinicadl.tools.deep_learning.iotools import (
 )
 from clinicadl.tools.deep_learning.models import create_model, load_model
 
-from .gradients import VanillaBackProp
+from .gradients import create_interpreter
+from .predictions import find_image_predictions, keep_sessions, selection_mask
+from .writers import ConsolidatedMapWriter, MapWriter, write_benchmark
 
 
 def individual_backprop(options):
@@ -106,82 +106,116 @@ def individual_backprop(options):
             commandline_to_json(options, logger=main_logger)
 
             # Keep only subjects who were correctly / wrongly predicted by the network
-            training_df = sort_predicted(
-                model,
-                training_df,
-                options.input_dir,
-                model_options,
-                criterion,
-                options.keep_true,
-                batch_size=options.batch_size,
-                num_workers=options.num_workers,
-                gpu=options.gpu,
-            )
-
-            if len(training_df) > 0:
-
-                # Save the tsv files used for the saliency maps
-                training_df.to_csv(path.join("data.tsv"), sep="\t", index=False)
-
-                with warnings.catch_warnings():
-                    warnings.simplefilter("ignore")
-                    data_train = return_dataset(
-                        model_options.mode,
-                        options.input_dir,
+            data_train = data_example
+            fused_selection = False
+            if options.keep_true is not None:
+                predictions_df = find_image_predictions(
+                    options.model_path,
+                    fold,
+                    selection,
+                    training_df,
+                    data_example,
+                    main_logger,
+                )
+                if predictions_df is None and model_options.mode == "image":
+                    # Sessions are selected with the forward pass of the interpreter
+                    fused_selection = True
+                else:
+                    training_df = sort_predicted(
+                        model,
                         training_df,
-                        model_options.preprocessing,
-                        train_transformations=None,
-                        all_transformations=all_transforms,
-                        prepare_dl=options.prepare_dl,
-                        multi_cohort=options.multi_cohort,
-                        params=model_options,
+                        options.input_dir,
+                        model_options,
+                        criterion,
+                        options.keep_true,
+                        batch_size=options.batch_size,
+                        num_workers=options.num_workers,
+                        gpu=options.gpu,
+                        predictions_df=predictions_df,
                     )
+                    if len(training_df) > 0:
+                        with warnings.catch_warnings():
+                            warnings.simplefilter("ignore")
+                            data_train = return_dataset(
+                                model_options.mode,
+                                options.input_dir,
+                                training_df,
+                                model_options.preprocessing,
+                                train_transformations=None,
+                                all_transformations=all_transforms,
+                                prepare_dl=options.prepare_dl,
+                                multi_cohort=options.multi_cohort,
+                                params=model_options,
+                            )
+
+            if len(training_df) > 0:
 
                 train_loader = DataLoader(
                     data_train,
                     batch_size=options.batch_size,
-                    shuffle=True,
+                    shuffle=False,
                     num_workers=options.num_workers,
                     pin_memory=True,
                 )
 
-                interpreter = VanillaBackProp(model, gpu=options.gpu)
+                interpreter = create_interpreter(options, model)
+                start_time = time()
+                if options.consolidated:
+                    writer = ConsolidatedMapWriter(
+                        results_path, len(data_train), data_train.size
+                    )
+                else:
+                    writer = MapWriter(
+                        results_path,
+                        nifti_template_path=options.nifti_template_path,
+                        vmax=options.vmax,
+                        n_writers=options.n_writers,
+                    )
+
+                kept_sessions = list()
+                # Sessions are not filtered again if they were sorted beforehand
+                keep_true = options.keep_true if fused_selection else None
 
                 for data in train_loader:
                     if options.gpu:
-                        input_batch = data["image"].cuda()
+                        input_batch = data["image"].cuda(non_blocking=True)
                     else:
                         input_batch = data["image"]
 
-                    map_np = interpreter.generate_gradients(
-                        input_batch, data_train.diagnosis_code[options.target_diagnosis]
+                    maps = interpreter.compute_gradients(
+                        input_batch,
+                        data_train.diagnosis_code[options.target_diagnosis],
+                        chunk_size=options.chunk_size,
+                    )
+                    mask = selection_mask(
+                        data["label"], interpreter.predicted_labels, keep_true
                     )
-                    for i in range(options.batch_size):
-                        single_path = path.join(
-                            results_path,
-                            data["participant_id"][i],
-                            data["session_id"][i],
+                    map_np = maps[mask.to(maps.device)].cpu().numpy()
+                    kept_indices = mask.nonzero().flatten().tolist()
+                    for i, map_index in enumerate(kept_indices):
+                        session = (
+                            data["participant_id"][map_index],
+                            data["session_id"][map_index],
                         )
-                        os.makedirs(single_path, exist_ok=True)
-
-                        if len(data_train.size) == 4:
-                            if options.nifti_template_path is not None:
-                                image_nii = nib.load(options.nifti_template_path)
-                                affine = image_nii.affine
-                            else:
-                                affine = np.eye(4)
-
-                            map_nii = nib.Nifti1Image(map_np[i, 0, :, :, :], affine)
-                            nib.save(map_nii, path.join(single_path, "map.nii.gz"))
-                        else:
-                            jpg_path = path.join(single_path, "map.jpg")
-                            plt.imshow(
-                                map_np[i, 0, :, :],
-                                cmap="coolwarm",
-                                vmin=-options.vmax,
-                                vmax=options.vmax,
-                            )
-                            plt.colorbar()
-                            plt.savefig(jpg_path)
-                            plt.close()
-                        np.save(path.join(single_path, "map.npy"), map_np[i])
+                        writer.submit(*session, map_np[i])
+                        kept_sessions.append(session)
+
+                writer.close()
+                sessions_per_second = write_benchmark(
+                    results_path, options.method, len(data_train), time() - start_time
+                )
+                main_logger.info(
+                    "%i saliency maps computed with %s (%.2f sessions/s)"
+                    % (len(data_train), options.method, sessions_per_second)
+                )
+                if len(kept_sessions) == 0:
+                    main_logger.warn("There are no subjects for the given options")
+                    continue
+
+                # Save the tsv files used for the saliency maps
+                training_df = keep_sessions(training_df, kept_sessions)
+                training_df.to_csv(
+                    path.join(results_path, "data.tsv"), sep="\t", index=False
+                )
+            else:
+                main_logger.warn("There are no subjects for the given options")
@@ -0,0 +1,131 @@
+import torch
+
+from clinicadl.tools.deep_learning.data import patch_corners
+
+from .gradients import VanillaBackProp
+
+# Default number of bytes of the occluded copies given to the network at once
+CHUNK_MEMORY = 2 ** 30
+
+
+class OcclusionSensitivity(VanillaBackProp):
+    """
+    Measures the drop of the probability of the target class when regions of the
+    image are occluded (Zeiler and Fergus, 2014).
+
+    Regions are the cubic (or square) patches of the grid defined by MRIDatasetPatch.
+    The occluded copies of all the images of a batch are generated chunk by chunk
+    with broadcast masks and given to the network in large inference batches
+    without gradients.
+    """
+
+    def __init__(
+        self, model, gpu=False, occlusion_size=50, occlusion_stride=50, value=0.0
+    ):
+        """
+        Args:
+            model: (Module) CNN to interpret.
+            gpu: (bool) if True a gpu is used.
+            occlusion_size: (int) size of the occluded patches.
+            occlusion_stride: (int) length between the corners of two patches.
+            value: (float) intensity given to the occluded voxels.
+        """
+        super().__init__(model, gpu=gpu)
+        self.occlusion_size = occlusion_size
+        self.occlusion_stride = occlusion_stride
+        self.value = value
+
+    def _probabilities(self, input_batch, target_class):
+        return torch.softmax(self._forward(input_batch), dim=1)[:, target_class]
+
+    def compute_gradients(self, input_batch, target_class, chunk_size=None):
+        """
+        Computes the occlusion sensitivity maps of a batch.
+
+        Each voxel is given the mean drop of probability caused by the occlusion of
+        the patches it belongs to (0 for voxels which are never occluded).
+
+        Args:
+            input_batch: (Tensor) batch of inputs on the device of the model.
+            target_class: (int) index of the class explained.
+            chunk_size: (int) maximum number of occluded copies given to the network
+                at once. Default fills CHUNK_MEMORY bytes with copies.
+        Returns:
+            (Tensor) sensitivity maps, on the device of input_batch.
+        """
+        spatial_shape = input_batch.shape[2:]
+        corners = torch.tensor(
+            patch_corners(spatial_shape, self.occlusion_size, self.occlusion_stride),
+            dtype=torch.long,
+            device=input_batch.device,
+        )
+        if len(corners) == 0:
+            raise ValueError(
+                "Occlusion patches of size %i are larger than the inputs of shape %s."
+                % (self.occlusion_size, tuple(spatial_shape))
+            )
+
+        n_corners = len(corners)
+        n_copies = len(input_batch) * n_corners
+        if chunk_size is None:
+            copy_bytes = input_batch[0].numel() * input_batch.element_size()
+            chunk_size = max(1, CHUNK_MEMORY // copy_bytes)
+        chunk_size = min(chunk_size, n_copies)
+
+        sensitivity = torch.zeros_like(input_batch)
+        coverage = torch.zeros(
+            spatial_shape, dtype=input_batch.dtype, device=input_batch.device
+        )
+        for start in range(0, n_corners, chunk_size):
+            masks = self._masks(corners[start : start + chunk_size], spatial_shape)
+            coverage += masks.sum(dim=0, dtype=input_batch.dtype)
+
+        with torch.no_grad():
+            # The unoccluded output is computed once per image
+            reference_output = self._forward(input_batch)
+            self.predicted_labels = reference_output.argmax(dim=1)
+            reference = torch.softmax(reference_output, dim=1)[:, target_class]
+            for start in range(0, n_copies, chunk_size):
+                copy_indices = torch.arange(
+                    start, min(start + chunk_size, n_copies), device=input_batch.device
+                )
+                input_indices = copy_indices // n_corners
+                # Occluded regions of the copies, broadcast over the channels
+                masks = self._masks(corners[copy_indices % n_corners], spatial_shape)
+                masks = masks.unsqueeze(1)
+                occluded = input_batch[input_indices].masked_fill(masks, self.value)
+
+                drops = reference[input_indices] - self._probabilities(
+                    occluded, target_class
+                )
+                drops = drops.view((-1,) + (1,) * (input_batch.dim() - 1))
+                sensitivity.index_add_(
+                    0, input_indices, (masks * drops).expand_as(occluded)
+                )
+
+        return sensitivity / coverage.clamp(min=1)
+
+    def _masks(self, corners, spatial_shape):
+        """
+        Computes the occluded regions of a set of patches.
+
+        Args:
+            corners: (LongTensor) first voxel of each patch, of shape (n_patches, n_dims).
+            spatial_shape: (tuple) spatial dimensions of the inputs.
+        Returns:
+            (BoolTensor) of shape (n_patches, *spatial_shape), True in the patches.
+        """
+        n_dims = len(spatial_shape)
+        masks = torch.ones(
+            (len(corners),) + (1,) * n_dims, dtype=torch.bool, device=corners.device
+        )
+        for dim, length in enumerate(spatial_shape):
+            positions = torch.arange(length, device=corners.device).view(1, -1)
+            corner = corners[:, dim : dim + 1]
+            end = corner + self.occlusion_size
+            in_patch = (positions >= corner) & (positions < end)
+            # Broadcast the condition on this dimension over the others
+            shape = [len(corners)] + [1] * n_dims
+            shape[dim + 1] = length
+            masks = masks & in_patch.view(shape)
+        return masks
@@ -0,0 +1,121 @@
+from glob import glob
+from os import path
+
+import pandas as pd
+import torch
+
+from clinicadl.classify.prediction_cache import CACHE_FILENAME, PredictionCache
+
+
+def find_image_predictions(model_path, fold, selection, data_df, dataset, logger):
+    """
+    Finds predictions of the model already computed for all the sessions of data_df.
+
+    Predictions are searched in the image-level TSV files written by classify (and
+    train) in cnn_classification, then in the prediction cache of classify, where
+    only the predictions of the checkpoint run in float32 are used.
+    TSV files older than the checkpoint of the model are ignored.
+
+    Args:
+        model_path: (str) path to the folder of the trained model.
+        fold: (str) name of the fold folder.
+        selection: (str) name of the folder of the selected model (best_<metric>).
+        data_df: (DataFrame) sessions to interpret.
+        dataset: (MRIDataset) dataset built on data_df.
+        logger: Logger instance.
+    Returns:
+        (DataFrame) participant_id, session_id, true_label and predicted_label of
+        the sessions of data_df, None if no predictions were found.
+    """
+    checkpoint_path = path.join(
+        model_path, fold, "models", selection, "model_best.pth.tar"
+    )
+    sessions_df = data_df[["participant_id", "session_id"]]
+    true_labels = data_df.diagnosis.apply(lambda x: dataset.diagnosis_code[x]).values
+
+    prediction_paths = glob(
+        path.join(
+            model_path,
+            fold,
+            "cnn_classification",
+            selection,
+            "*_image_level_prediction.tsv",
+        )
+    )
+    prediction_paths = [
+        prediction_path
+        for prediction_path in prediction_paths
+        if path.getmtime(prediction_path) >= path.getmtime(checkpoint_path)
+    ]
+    for prediction_path in sorted(prediction_paths, key=path.getmtime, reverse=True):
+        prediction_df = pd.read_csv(prediction_path, sep="\t")
+        if "true_label" not in prediction_df.columns:
+            continue
+        predictions_df = sessions_df.merge(
+            prediction_df[
+                ["participant_id", "session_id", "true_label", "predicted_label"]
+            ].drop_duplicates(["participant_id", "session_id"]),
+            on=["participant_id", "session_id"],
+            how="left",
+        )
+        if predictions_df.predicted_label.isnull().any():
+            continue
+        if (predictions_df.true_label.values != true_labels).any():
+            continue
+        logger.info("Predictions of the model are read in %s" % prediction_path)
+        return predictions_df
+
+    cache_path = path.join(model_path, CACHE_FILENAME)
+    if dataset.mode == "image" and path.exists(cache_path):
+        cache = PredictionCache(cache_path)
+        try:
+            model_key, image_keys = cache.keys(dataset, data_df, checkpoint_path)
+            cached_df, missing_df, _ = cache.split(
+                data_df, image_keys, model_key, dataset.mode
+            )
+        finally:
+            cache.close()
+        if len(missing_df) == 0:
+            logger.info("Predictions of the model are read in %s" % cache_path)
+            return cached_df
+
+    return None
+
+
+def selection_mask(labels, predicted_labels, keep_true):
+    """
+    Finds the inputs of a batch kept by the selection on the predictions.
+
+    Args:
+        labels: (Tensor) true labels of the batch.
+        predicted_labels: (Tensor) labels predicted by the model.
+        keep_true: (bool) if True the inputs correctly classified are kept, else
+            the inputs wrongly classified. If None all the inputs are kept.
+    Returns:
+        (Tensor) boolean mask of the inputs kept (on CPU).
+    """
+    if keep_true is None:
+        return torch.ones(len(labels), dtype=torch.bool)
+
+    correct = predicted_labels.cpu() == labels.cpu()
+    return correct if keep_true else ~correct
+
+
+def keep_sessions(data_df, sessions):
+    """
+    Restricts data_df to a list of sessions.
+
+    Args:
+        data_df: (DataFrame) list of participants, sessions and diagnoses.
+        sessions: (list of tuples) participant_id and session_id of the sessions kept.
+    Returns:
+        (DataFrame) the sessions kept, sorted by participant and session.
+    """
+    sessions_df = pd.DataFrame(
+        sessions, columns=["participant_id", "session_id"]
+    ).drop_duplicates()
+    return (
+        data_df.merge(sessions_df, on=["participant_id", "session_id"])
+        .sort_values(["participant_id", "session_id"])
+        .reset_index(drop=True)
+    )
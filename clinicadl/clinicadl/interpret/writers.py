@@ -0,0 +1,178 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from os import path
+
+import nibabel as nib
+import numpy as np
+import pandas as pd
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+
+
+class MapWriter:
+    """
+    Writes individual saliency maps in background threads.
+
+    At most max_pending maps wait to be written, so that the computation of the
+    gradients only blocks when the writers are late.
+    """
+
+    def __init__(
+        self,
+        results_path,
+        nifti_template_path=None,
+        vmax=0.5,
+        n_writers=2,
+        max_pending=8,
+    ):
+        """
+        Args:
+            results_path: (str) folder in which the maps are written.
+            nifti_template_path: (str) nifti file used to retrieve the affine of 3D maps.
+            vmax: (float) maximum value used in 2D image display.
+            n_writers: (int) number of threads writing the maps.
+            max_pending: (int) maximum number of maps waiting to be written.
+        """
+        self.results_path = results_path
+        self.vmax = vmax
+        if nifti_template_path is not None:
+            self.affine = nib.load(nifti_template_path).affine
+        else:
+            self.affine = np.eye(4)
+        self.executor = ThreadPoolExecutor(max_workers=n_writers)
+        self.slots = threading.BoundedSemaphore(max_pending)
+        self.futures = list()
+
+    def submit(self, participant_id, session_id, map_np):
+        """
+        Queues the map of one session (blocks if too many maps are pending).
+
+        Args:
+            participant_id: (str) participant of the session.
+            session_id: (str) session.
+            map_np: (array) saliency map with a channel dimension.
+        """
+        self.slots.acquire()
+        future = self.executor.submit(self._write, participant_id, session_id, map_np)
+        future.add_done_callback(lambda _: self.slots.release())
+        self.futures.append(future)
+
+    def _write(self, participant_id, session_id, map_np):
+        single_path = path.join(self.results_path, participant_id, session_id)
+        os.makedirs(single_path, exist_ok=True)
+
+        if map_np.ndim == 4:
+            map_nii = nib.Nifti1Image(map_np[0], self.affine)
+            nib.save(map_nii, path.join(single_path, "map.nii.gz"))
+        else:
+            # pyplot is not thread-safe, figures are built with the object API
+            figure = Figure()
+            FigureCanvasAgg(figure)
+            axes = figure.add_subplot()
+            image = axes.imshow(
+                map_np[0], cmap="coolwarm", vmin=-self.vmax, vmax=self.vmax
+            )
+            figure.colorbar(image)
+            figure.savefig(path.join(single_path, "map.jpg"))
+        np.save(path.join(single_path, "map.npy"), map_np)
+
+    def close(self):
+        """Waits for all the maps to be written and raises the errors encountered."""
+        self.executor.shutdown(wait=True)
+        for future in self.futures:
+            future.result()
+        self.futures = list()
+
+
+class ConsolidatedMapWriter:
+    """
+    Writes all the individual saliency maps in one memory-mapped array.
+
+    The array is saved in maps.npy and its rows are described in maps.tsv.
+    """
+
+    def __init__(self, results_path, n_maps, map_shape):
+        """
+        Args:
+            results_path: (str) folder in which the maps are written.
+            n_maps: (int) maximum number of maps written. If fewer maps are given, the
+                array is trimmed when the writer is closed.
+            map_shape: (tuple) shape of one map, channel dimension included.
+        """
+        os.makedirs(results_path, exist_ok=True)
+        self.results_path = results_path
+        self.maps = np.lib.format.open_memmap(
+            path.join(results_path, "maps.npy"),
+            mode="w+",
+            dtype=np.float32,
+            shape=(n_maps,) + tuple(map_shape),
+        )
+        self.index = list()
+
+    def submit(self, participant_id, session_id, map_np):
+        position = len(self.index)
+        self.maps[position] = map_np
+        self.index.append(
+            {
+                "map_index": position,
+                "participant_id": participant_id,
+                "session_id": session_id,
+            }
+        )
+
+    def close(self):
+        n_written = len(self.index)
+        maps_path = path.join(self.results_path, "maps.npy")
+        if n_written == 0:
+            del self.maps
+            os.remove(maps_path)
+            return
+        elif n_written < len(self.maps):
+            # Some sessions were not kept, the array is rewritten without empty rows
+            tmp_path = path.join(self.results_path, "maps.tmp.npy")
+            trimmed_maps = np.lib.format.open_memmap(
+                tmp_path,
+                mode="w+",
+                dtype=self.maps.dtype,
+                shape=(n_written,) + self.maps.shape[1:],
+            )
+            for position in range(n_written):
+                trimmed_maps[position] = self.maps[position]
+            trimmed_maps.flush()
+            del trimmed_maps
+            del self.maps
+            os.replace(tmp_path, maps_path)
+        else:
+            self.maps.flush()
+            del self.maps
+        pd.DataFrame(
+            self.index, columns=["map_index", "participant_id", "session_id"]
+        ).to_csv(path.join(self.results_path, "maps.tsv"), sep="\t", index=False)
+
+
+def write_benchmark(results_path, method, n_sessions, duration):
+    """
+    Writes the throughput of the interpretation in benchmark.tsv.
+
+    Args:
+        results_path: (str) folder of the interpretation task.
+        method: (str) interpretation method.
+        n_sessions: (int) number of sessions interpreted.
+        duration: (float) time spent computing and writing the maps (in seconds).
+    Returns:
+        (float) number of sessions interpreted per second.
+    """
+    sessions_per_second = n_sessions / duration if duration > 0 else float("inf")
+    pd.DataFrame(
+        [
+            {
+                "method": method,
+                "n_sessions": n_sessions,
+                "duration": duration,
+                "sessions_per_second": sessions_per_second,
+            }
+        ]
+    ).to_csv(path.join(results_path, "benchmark.tsv"), sep="\t", index=False)
+
+    return sessions_per_second
@@ -12,7 +12,8 @@ from torch.utils.data import DataLoader
 
 from ...tools.data.utils import load_and_check_tsv
 from ...tools.deep_learning.data import MRIDataset
-from .utils import QCDataset, resnet_qc_18
+from ..utils import QCStore, store_path
+from .utils import VIEWS, QCDataset, qc_image_path, resnet_qc_18, transform_batch
 
 
 def quality_check(
@@ -20,10 +21,34 @@ def quality_check(
     output_path,
     tsv_path=None,
     threshold=0.5,
-    batch_size=1,
+    batch_size=8,
     num_workers=0,
     gpu=True,
+    use_extracted_tensors=False,
 ):
+    """
+    Computes the probability that the t1-linear registration of each image passed.
+
+    The three mid-slices of the images are extracted in the workers of the DataLoader
+    and resized by batch on the device of the model.
+
+    The pass probabilities are kept in a store next to the output file
+    (the output filename suffixed by _store): only the sessions whose image changed
+    since the last run, or which were not checked by the current QC model, are
+    processed.
+
+    Args:
+        caps_dir: (str) CAPS folder containing the outputs of t1-linear.
+        output_path: (str) path to the output TSV file.
+        tsv_path: (str) TSV file with the sessions to check. Default checks all the
+            sessions of caps_dir.
+        threshold: (float) threshold on the pass probability.
+        batch_size: (int) batch size of the DataLoader.
+        num_workers: (int) number of workers of the DataLoader.
+        gpu: (bool) if True a GPU is used.
+        use_extracted_tensors: (bool) if True the tensors extracted by
+            deeplearning-prepare-data are read instead of the NIfTI images.
+    """
 
     if splitext(output_path)[1] != ".tsv":
         raise ValueError("Please provide an output path to a tsv file")
@@ -48,46 +73,64 @@ def quality_check(
         except IOError as err:
             print("Unable to download required model for QC process:", err)
 
-    # Load QC model
-    model = resnet_qc_18()
-    model.load_state_dict(torch.load(model_file))
-    model.eval()
-    if gpu:
-        model.cuda()
-
     # Transform caps_dir in dict
     caps_dict = MRIDataset.create_caps_dict(caps_dir, multi_cohort=False)
 
     # Load DataFrame
     df = load_and_check_tsv(tsv_path, caps_dict, dirname(abspath(output_path)))
-
-    dataset = QCDataset(caps_dir, df)
-    dataloader = DataLoader(
-        dataset, num_workers=num_workers, batch_size=batch_size, pin_memory=True
+    all_sessions = [
+        (
+            subject,
+            session,
+            qc_image_path(caps_dir, subject, session, use_extracted_tensors),
+        )
+        for subject, session in zip(df.participant_id, df.session_id)
+    ]
+
+    # Only the sessions which are not up-to-date in the store are processed
+    store = QCStore(store_path(output_path), ["pass_probability"], FILE1.checksum)
+    pending_sessions = store.pending(all_sessions)
+    print(
+        "Number of sessions already checked: %i"
+        % (len(all_sessions) - len(pending_sessions))
     )
 
-    columns = ["participant_id", "session_id", "pass_probability", "pass"]
-    qc_df = pd.DataFrame(columns=columns)
-    softmax = torch.nn.Softmax(dim=1)
-
-    for data in dataloader:
-        inputs = data["image"]
+    if len(pending_sessions) > 0:
+        # Load QC model
+        model = resnet_qc_18()
+        model.load_state_dict(torch.load(model_file))
+        model.eval()
         if gpu:
-            inputs = inputs.cuda()
-        outputs = softmax.forward(model(inputs))
-
-        for idx, sub in enumerate(data["participant_id"]):
-            pass_probability = outputs[idx, 1].item()
-            row = [
-                [
-                    sub,
-                    data["session_id"][idx],
-                    pass_probability,
-                    pass_probability > threshold,
-                ]
-            ]
-            row_df = pd.DataFrame(row, columns=columns)
-            qc_df = qc_df.append(row_df)
-
+            model.cuda()
+
+        pending_df = pd.DataFrame(
+            [session[:2] for session in pending_sessions],
+            columns=["participant_id", "session_id"],
+        )
+        dataset = QCDataset(
+            caps_dir, pending_df, use_extracted_tensors=use_extracted_tensors
+        )
+        dataloader = DataLoader(
+            dataset, num_workers=num_workers, batch_size=batch_size, pin_memory=True
+        )
+        softmax = torch.nn.Softmax(dim=1)
+
+        with torch.no_grad():
+            for data in dataloader:
+                if gpu:
+                    for view in VIEWS:
+                        data[view] = data[view].cuda(non_blocking=True)
+                outputs = softmax.forward(model(transform_batch(data)))
+                pass_probabilities = outputs[:, 1].cpu().numpy()
+
+                for idx, pass_probability in enumerate(pass_probabilities):
+                    store.add(
+                        data["participant_id"][idx],
+                        data["session_id"][idx],
+                        [pass_probability],
+                    )
+
+    qc_df = store.results(all_sessions)
+    qc_df["pass"] = qc_df.pass_probability > threshold
     qc_df.sort_values("pass_probability", ascending=False, inplace=True)
     qc_df.to_csv(output_path, sep="\t", index=False)
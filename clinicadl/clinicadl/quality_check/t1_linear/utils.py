@@ -5,6 +5,7 @@ Copied from https://github.com/vfonov/deep-qc/blob/master/python/model/resnet_qc
 from os import path
 
 import nibabel as nib
+import numpy as np
 import torch
 import torch.nn as nn
 from torch.utils.data import Dataset
@@ -161,18 +162,65 @@ def resnet_qc_18(**kwargs):
     return model
 
 
+# Names of the mid-slices extracted from each image, in the order expected by the model
+VIEWS = ("axial", "sagittal", "coronal")
+# Size of the slices before and after cropping
+PADDED_SIZE = 256
+INPUT_SIZE = 224
+
+
+def qc_image_path(caps_dir, subject, session, use_extracted_tensors=False):
+    """
+    Path to the image of a session checked by the QC model.
+
+    Args:
+        caps_dir (str): CAPS folder containing the outputs of t1-linear.
+        subject (str): participant of the session.
+        session (str): session.
+        use_extracted_tensors (bool): If True the path to the tensor extracted by
+            deeplearning-prepare-data is returned instead of the NIfTI image.
+    Returns:
+        (str) path to the image.
+    """
+    if use_extracted_tensors:
+        return path.join(
+            caps_dir,
+            "subjects",
+            subject,
+            session,
+            "deeplearning_prepare_data",
+            "image_based",
+            "t1_linear",
+            "%s_%s%s.pt" % (subject, session, FILENAME_TYPE["full"]),
+        )
+    return path.join(
+        caps_dir,
+        "subjects",
+        subject,
+        session,
+        "t1_linear",
+        "%s_%s%s.nii.gz" % (subject, session, FILENAME_TYPE["full"]),
+    )
+
+
 class QCDataset(Dataset):
-    """Dataset of MRI organized in a CAPS folder."""
+    """
+    Dataset of MRI organized in a CAPS folder.
+
+    Only the three mid-slices of each image are returned, after normalization of the
+    intensities of the whole image. Images are decoded in the workers of the
+    DataLoader, the resizing of the slices is done on batches by transform_batch.
+    """
 
     def __init__(self, img_dir, data_df, use_extracted_tensors=False):
         """
         Args:
             img_dir (string): Directory of all the images.
             data_df (DataFrame): Subject and session list.
+            use_extracted_tensors (bool): If True the tensors extracted by
+                deeplearning-prepare-data are read instead of the NIfTI images.
 
         """
-        from clinicadl.tools.deep_learning.data import MinMaxNormalization
-
         self.img_dir = img_dir
         self.df = data_df
         self.use_extracted_tensors = use_extracted_tensors
@@ -185,8 +233,6 @@ class QCDataset(Dataset):
                 "Columns should include ['participant_id', 'session_id']"
             )
 
-        self.normalization = MinMaxNormalization()
-
     def __len__(self):
         return len(self.df)
 
@@ -194,160 +240,101 @@ class QCDataset(Dataset):
         subject = self.df.loc[idx, "participant_id"]
         session = self.df.loc[idx, "session_id"]
 
+        image_path = qc_image_path(
+            self.img_dir, subject, session, self.use_extracted_tensors
+        )
         if self.use_extracted_tensors:
-            image_path = path.join(
-                self.img_dir,
-                "subjects",
-                subject,
-                session,
-                "deeplearning_prepare_data",
-                "image_based",
-                "t1_linear",
-                "%s_%s%s.pt" % (subject, session, FILENAME_TYPE["full"]),
-            )
-
-            image = torch.load(image_path)
-            image = self.pt_transform(image)
+            image = torch.load(image_path)[0].float()
         else:
-            image_path = path.join(
-                self.img_dir,
-                "subjects",
-                subject,
-                session,
-                "t1_linear",
-                "%s_%s%s.nii.gz" % (subject, session, FILENAME_TYPE["full"]),
-            )
-
-            image = nib.load(image_path)
-            image = self.nii_transform(image)
+            image = nib.load(image_path).get_fdata(dtype=np.float32)
+            image = torch.from_numpy(np.squeeze(image))
 
-        sample = {"image": image, "participant_id": subject, "session_id": session}
+        sample = self.extract_slices(image)
+        sample.update({"participant_id": subject, "session_id": session})
 
         return sample
 
     @staticmethod
-    def nii_transform(image):
-        import numpy as np
-        import torch
-        from skimage import transform
-
-        sample = np.array(image.get_data())
-
-        # normalize input
-        _min = np.min(sample)
-        _max = np.max(sample)
-        sample = (sample - _min) * (1.0 / (_max - _min)) - 0.5
-        sz = sample.shape
-        input_images = [
-            sample[:, :, int(sz[2] / 2)],
-            sample[int(sz[0] / 2), :, :],
-            sample[:, int(sz[1] / 2), :],
-        ]
-
-        output_images = [
-            np.zeros(
-                (224, 224),
-            ),
-            np.zeros((224, 224)),
-            np.zeros((224, 224)),
-        ]
-
-        # flip, resize and crop
-        for i in range(3):
-            # try the dimension of input_image[i]
-            # rotate the slice with 90 degree, I don't know why, but read from
-            # nifti file, the img has been rotated, thus we do not have the same
-            # direction with the pretrained model
-
-            if len(input_images[i].shape) == 3:
-                slice = np.reshape(
-                    input_images[i],
-                    (input_images[i].shape[0], input_images[i].shape[1]),
-                )
-            else:
-                slice = input_images[i]
-
-            _scale = min(256.0 / slice.shape[0], 256.0 / slice.shape[1])
-            # slice[::-1, :] is to flip the first axis of image
-            slice = transform.rescale(
-                slice[::-1, :], _scale, mode="constant", clip=False
-            )
-
-            sz = slice.shape
-            # pad image
-            dummy = np.zeros(
-                (256, 256),
-            )
-            dummy[
-                int((256 - sz[0]) / 2) : int((256 - sz[0]) / 2) + sz[0],
-                int((256 - sz[1]) / 2) : int((256 - sz[1]) / 2) + sz[1],
-            ] = slice
-
-            # rotate and flip the image back to the right direction for each view, if the MRI was read by nibabel
-            # it seems that this will rotate the image 90 degree with
-            # counter-clockwise direction and then flip it horizontally
-            output_images[i] = np.flip(np.rot90(dummy[16:240, 16:240]), axis=1).copy()
-
-        return torch.cat(
-            [torch.from_numpy(i).float().unsqueeze_(0) for i in output_images]
-        ).unsqueeze_(0)
-
-    def pt_transform(self, image):
-        from torch.nn.functional import interpolate, pad
+    def extract_slices(image):
+        """
+        Normalizes the intensities of an image and extracts its three mid-slices.
 
-        image = self.normalization(image) - 0.5
-        image = image[0, :, :, :]
+        Args:
+            image (Tensor): 3D image.
+        Returns:
+            (dict) the slices of the image, keys are the names in VIEWS.
+        """
+        _min = image.min()
+        _max = image.max()
         sz = image.shape
-        input_images = [
-            image[:, :, int(sz[2] / 2)],
-            image[int(sz[0] / 2), :, :],
-            image[:, int(sz[1] / 2), :],
+        slices = [
+            image[:, :, sz[2] // 2],
+            image[sz[0] // 2, :, :],
+            image[:, sz[1] // 2, :],
         ]
+        return {
+            view: ((image_slice - _min) / (_max - _min) - 0.5).unsqueeze(0)
+            for view, image_slice in zip(VIEWS, slices)
+        }
+
+
+def transform_slices(slices):
+    """
+    Flips, resizes, pads and crops a batch of slices of the same view.
+
+    The resizing reproduces skimage.transform.rescale(order=1, mode="constant")
+    used to train the QC model: bilinear interpolation at the centers of the output
+    pixels, the pixels outside of the slice being 0. Slices are always upscaled
+    for t1-linear images, hence no anti-aliasing is needed.
+
+    Args:
+        slices (Tensor): batch of slices of size (batch_size, 1, H, W).
+    Returns:
+        (Tensor) batch of slices of size (batch_size, 224, 224).
+    """
+    from torch.nn.functional import affine_grid, grid_sample, pad
+
+    height, width = slices.shape[-2:]
+    scale = min(PADDED_SIZE / height, PADDED_SIZE / width)
+    size = (int(round(height * scale)), int(round(width * scale)))
+    # The identity grid samples the centers of the output pixels
+    theta = torch.eye(2, 3, dtype=slices.dtype, device=slices.device)
+    grid = affine_grid(
+        theta.expand(len(slices), 2, 3),
+        (len(slices), 1) + size,
+        align_corners=False,
+    )
+    # Flip the first axis of the slices
+    slices = grid_sample(
+        torch.flip(slices, (2,)),
+        grid,
+        mode="bilinear",
+        padding_mode="zeros",
+        align_corners=False,
+    )
 
-        output_images = list()
-
-        # flip, resize and crop
-        for slice in input_images:
-
-            scale = min(256.0 / slice.shape[0], 256.0 / slice.shape[1])
-            # slice[::-1, :] is to flip the first axis of image
-            slice = interpolate(
-                torch.flip(slice, (0,)).unsqueeze(0).unsqueeze(0), scale_factor=scale
-            )
-            slice = slice[0, 0, :, :]
-
-            padding = self.get_padding(slice)
-            slice = pad(slice, padding)
-
-            # rotate and flip the image back to the right direction for each view, if the MRI was read by nibabel
-            # it seems that this will rotate the image 90 degree with
-            # counter-clockwise direction and then flip it horizontally
-            output_images.append(
-                torch.flip(
-                    torch.rot90(slice[16:240, 16:240], 1, [0, 1]),
-                    [
-                        1,
-                    ],
-                ).clone()
-            )
-
-        return torch.cat(
-            [image.float().unsqueeze_(0) for image in output_images]
-        ).unsqueeze_(0)
+    top = (PADDED_SIZE - size[0]) // 2
+    left = (PADDED_SIZE - size[1]) // 2
+    slices = pad(
+        slices,
+        (left, PADDED_SIZE - size[1] - left, top, PADDED_SIZE - size[0] - top),
+    )
+    margin = (PADDED_SIZE - INPUT_SIZE) // 2
+    slices = slices[:, 0, margin : margin + INPUT_SIZE, margin : margin + INPUT_SIZE]
 
-    @staticmethod
-    def get_padding(image):
-        max_w = 256
-        max_h = 256
+    # rotate and flip the image back to the right direction for each view, if the MRI was read by nibabel
+    # it seems that this will rotate the image 90 degree with
+    # counter-clockwise direction and then flip it horizontally
+    return torch.flip(torch.rot90(slices, 1, [1, 2]), [2])
 
-        imsize = image.shape
-        h_padding = (max_w - imsize[1]) / 2
-        v_padding = (max_h - imsize[0]) / 2
-        l_pad = h_padding if h_padding % 1 == 0 else h_padding + 0.5
-        t_pad = v_padding if v_padding % 1 == 0 else v_padding + 0.5
-        r_pad = h_padding if h_padding % 1 == 0 else h_padding - 0.5
-        b_pad = v_padding if v_padding % 1 == 0 else v_padding - 0.5
 
-        padding = (int(l_pad), int(r_pad), int(t_pad), int(b_pad))
+def transform_batch(data):
+    """
+    Builds the inputs of the QC model from a batch of QCDataset.
 
-        return padding
+    Args:
+        data (dict): batch of QCDataset, the slices may already be on the GPU.
+    Returns:
+        (Tensor) inputs of size (batch_size, 3, 224, 224).
+    """
+    return torch.stack([transform_slices(data[view]) for view in VIEWS], dim=1)
@@ -8,12 +8,17 @@ from os import path
 
 import pandas as pd
 
-from .utils import extract_metrics
+from .utils import METRICS_FILENAME, extract_metrics
 
 
-def quality_check(caps_dir, output_dir, group_label):
-    extract_metrics(caps_dir=caps_dir, output_dir=output_dir, group_label=group_label)
-    qc_df = pd.read_csv(path.join(output_dir, "QC_metrics.tsv"), sep="\t")
+def quality_check(caps_dir, output_dir, group_label, n_proc=1):
+    extract_metrics(
+        caps_dir=caps_dir,
+        output_dir=output_dir,
+        group_label=group_label,
+        n_proc=n_proc,
+    )
+    qc_df = pd.read_csv(path.join(output_dir, METRICS_FILENAME), sep="\t")
 
     rejection1_df = qc_df[qc_df.max_intensity > 0.95]
     rejection1_df.to_csv(
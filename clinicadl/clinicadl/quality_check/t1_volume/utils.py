@@ -2,16 +2,46 @@
 Produces a tsv file to study all the nii files and perform the quality check.
 """
 import os
+from multiprocessing import Pool
 from os import path
 from pathlib import Path
 
 import nibabel as nib
 import numpy as np
-import pandas as pd
 from clinica.utils.inputs import RemoteFileStructure, fetch_file
 
-
-def extract_metrics(caps_dir, output_dir, group_label):
+from ..utils import QCStore, file_checksum, store_path
+
+METRICS_FILENAME = "QC_metrics.tsv"
+COLUMNS = [
+    "participant_id",
+    "session_id",
+    "max_intensity",
+    "non_zero_percentage",
+    "frontal_similarity",
+]
+# Number of bins of the histograms used to compute the normalized mutual information
+N_BINS = 10
+
+# Template data shared by the processes computing the metrics, set by _init_worker
+_worker_data = dict()
+
+
+def extract_metrics(caps_dir, output_dir, group_label, n_proc=1):
+    """
+    Computes the QC metrics of all the grey matter maps of caps_dir.
+
+    Metrics are kept in a store (QC_metrics_store.tsv) as soon as they are computed:
+    only the sessions whose grey matter map changed since the last run, or which were
+    checked with another template, are processed. QC_metrics.tsv is then written
+    from the store, sorted by increasing maximum intensity.
+
+    Args:
+        caps_dir: (str) CAPS folder containing the outputs of t1-volume.
+        output_dir: (str) folder in which QC_metrics.tsv is written.
+        group_label: (str) group of the DARTEL template.
+        n_proc: (int) number of processes computing the metrics.
+    """
     if not path.exists(output_dir):
         os.makedirs(output_dir)
 
@@ -36,9 +66,6 @@ def extract_metrics(caps_dir, output_dir, group_label):
         except IOError as err:
             raise IOError("Unable to download required eyes segmentation for QC:", err)
 
-    segmentation_nii = nib.load(segmentation_file)
-    segmentation_np = segmentation_nii.get_fdata()
-
     # Get the GM template
     template_path = path.join(
         caps_dir,
@@ -47,29 +74,54 @@ def extract_metrics(caps_dir, output_dir, group_label):
         "t1",
         f"group-{group_label}_template.nii.gz",
     )
-    template_nii = nib.load(template_path)
-    template_np = template_nii.get_fdata()
-    template_np = np.sum(template_np, axis=3)
-    template_segmentation_np = template_np * segmentation_np
 
     # Get the data
-    filename = path.join(output_dir, "QC_metrics.tsv")
-    columns = [
-        "participant_id",
-        "session_id",
-        "max_intensity",
-        "non_zero_percentage",
-        "frontal_similarity",
-    ]
-    results_df = pd.DataFrame()
+    filename = path.join(output_dir, METRICS_FILENAME)
+    # The metrics depend on the eyes segmentation and on the DARTEL template
+    checksum = "%s-%s" % (FILE1.checksum[:16], file_checksum(template_path)[:16])
+    store = QCStore(store_path(filename), COLUMNS[2:], checksum)
+    gm_maps = find_gm_maps(caps_dir)
+    tasks = store.pending(gm_maps)
+    print("Number of sessions already checked: %i" % (len(gm_maps) - len(tasks)))
+
+    if len(tasks) > 0:
+        segmentation_np = nib.load(segmentation_file).get_fdata(dtype=np.float32)
+        template_np = nib.load(template_path).get_fdata(dtype=np.float32)
+        template_np = np.sum(template_np, axis=3)
+
+        # The histogram bins of the masked template are computed only once
+        initargs = (_prepare_template(segmentation_np, template_np),)
+        if n_proc > 1:
+            with Pool(n_proc, initializer=_init_worker, initargs=initargs) as pool:
+                for row in pool.imap_unordered(_session_metrics, tasks):
+                    store.add(row[0], row[1], row[2:])
+        else:
+            _init_worker(*initargs)
+            for row in map(_session_metrics, tasks):
+                store.add(row[0], row[1], row[2:])
+
+    results_df = store.results(gm_maps)
+    results_df.sort_values("max_intensity", inplace=True, ascending=True)
+    results_df.to_csv(filename, sep="\t", index=False)
+
 
+def find_gm_maps(caps_dir):
+    """
+    Lists the grey matter maps in MNI space of a CAPS folder.
+
+    Args:
+        caps_dir: (str) CAPS folder containing the outputs of t1-volume.
+    Returns:
+        (list) of tuples (participant_id, session_id, path to the map).
+    """
+    gm_maps = list()
     subjects = os.listdir(path.join(caps_dir, "subjects"))
     subjects = [subject for subject in subjects if subject[:4:] == "sub-"]
-    for subject in subjects:
+    for subject in sorted(subjects):
         subject_path = path.join(caps_dir, "subjects", subject)
         sessions = os.listdir(subject_path)
         sessions = [session for session in sessions if session[:4:] == "ses-"]
-        for session in sessions:
+        for session in sorted(sessions):
             image_path = path.join(
                 subject_path,
                 session,
@@ -82,47 +134,105 @@ def extract_metrics(caps_dir, output_dir, group_label):
                 + session
                 + "_T1w_segm-graymatter_space-Ixi549Space_modulated-off_probability.nii.gz",
             )
-
             if path.exists(image_path):
-                # GM analysis
-                image_nii = nib.load(image_path)
-                image_np = image_nii.get_fdata()
-                image_segmentation_np = image_np * segmentation_np
-                eyes_nmi_value = nmi(
-                    occlusion1=template_segmentation_np,
-                    occlusion2=image_segmentation_np,
-                )
-
-                non_zero_percentage = np.count_nonzero(image_np) / image_np.size
-
-                row = [
-                    [
-                        subject,
-                        session,
-                        np.max(image_np),
-                        non_zero_percentage,
-                        eyes_nmi_value,
-                    ]
-                ]
-                row_df = pd.DataFrame(row, columns=columns)
-                results_df = pd.concat([results_df, row_df])
+                gm_maps.append((subject, session, image_path))
+
+    return gm_maps
+
+
+def _prepare_template(segmentation_np, template_np):
+    # Only the voxels of the eyes segmentation differ between the masked images,
+    # the others are all zeros.
+    mask = segmentation_np != 0
+    template_values = template_np[mask] * segmentation_np[mask]
+    n_outside = int(mask.size - np.count_nonzero(mask))
+    return {
+        "mask": mask,
+        "segmentation_values": segmentation_np[mask],
+        "n_outside": n_outside,
+        "template_bins": _bin_indices(template_values, include_zero=n_outside > 0),
+        "template_zero_bin": _zero_bin(template_values, include_zero=True),
+    }
+
+
+def _init_worker(template_data):
+    _worker_data.update(template_data)
+
+
+def _session_metrics(task):
+    subject, session, image_path = task
+    image_np = nib.load(image_path).get_fdata(dtype=np.float32)
+    image_values = image_np[_worker_data["mask"]] * _worker_data["segmentation_values"]
+    n_outside = _worker_data["n_outside"]
+
+    image_bins = _bin_indices(image_values, include_zero=n_outside > 0)
+    joint_histogram = np.bincount(
+        _worker_data["template_bins"] * N_BINS + image_bins,
+        minlength=N_BINS * N_BINS,
+    ).reshape(N_BINS, N_BINS)
+    if n_outside > 0:
+        joint_histogram[
+            _worker_data["template_zero_bin"],
+            _zero_bin(image_values, include_zero=True),
+        ] += n_outside
+
+    return [
+        subject,
+        session,
+        float(np.max(image_np)),
+        np.count_nonzero(image_np) / image_np.size,
+        nmi_from_histogram(joint_histogram),
+    ]
 
-    results_df.sort_values("max_intensity", inplace=True, ascending=True)
-    results_df.to_csv(filename, sep="\t", index=False)
+
+def _value_range(values, include_zero):
+    _min = float(np.min(values)) if values.size > 0 else 0.0
+    _max = float(np.max(values)) if values.size > 0 else 0.0
+    if include_zero:
+        _min, _max = min(_min, 0.0), max(_max, 0.0)
+    if _min == _max:
+        # Same convention as np.histogram for constant inputs
+        _min, _max = _min - 0.5, _max + 0.5
+    return _min, _max
+
+
+def _bin_indices(values, include_zero=False):
+    """Indices of the bins of np.histogram(values, bins=N_BINS)."""
+    _min, _max = _value_range(values, include_zero)
+    indices = ((values - _min) * (N_BINS / (_max - _min))).astype(np.int64)
+    return np.clip(indices, 0, N_BINS - 1)
+
+
+def _zero_bin(values, include_zero=False):
+    _min, _max = _value_range(values, include_zero)
+    return min(int((0 - _min) * (N_BINS / (_max - _min))), N_BINS - 1)
 
 
 def nmi(occlusion1, occlusion2):
-    """Mutual information for joint histogram"""
-    # Convert bins counts to probability values
-    hist_inter, _, _ = np.histogram2d(occlusion1.ravel(), occlusion2.ravel())
-    hist1, _, _ = np.histogram2d(occlusion1.ravel(), occlusion1.ravel())
-    hist2, _, _ = np.histogram2d(occlusion2.ravel(), occlusion2.ravel())
-
-    return (
-        2
-        * _mutual_information(hist_inter)
-        / (_mutual_information(hist1) + _mutual_information(hist2))
+    """Normalized mutual information of two images"""
+    hist_inter, _, _ = np.histogram2d(
+        occlusion1.ravel(), occlusion2.ravel(), bins=N_BINS
     )
+    return nmi_from_histogram(hist_inter)
+
+
+def nmi_from_histogram(hgram):
+    """
+    Normalized mutual information computed from a joint histogram.
+
+    The entropies of the images are computed from the marginals of the joint
+    histogram, which are the histograms of each image.
+    """
+    pxy = hgram / float(np.sum(hgram))
+    px = np.sum(pxy, axis=1)
+    py = np.sum(pxy, axis=0)
+
+    return 2 * _mutual_information(pxy) / (_entropy(px) + _entropy(py))
+
+
+def _entropy(p):
+    nzs = p > 0
+    return -np.sum(p[nzs] * np.log(p[nzs]))
 
 
 def _mutual_information(hgram):
@@ -0,0 +1,155 @@
+"""
+Persistent store of the per-session results of the quality check procedures.
+"""
+import hashlib
+import os
+from os import path
+
+import pandas as pd
+
+KEY_COLUMNS = ["participant_id", "session_id"]
+STAMP_COLUMNS = ["checksum", "input_mtime", "input_size"]
+
+
+def file_checksum(file_path, chunk_size=2 ** 20):
+    """
+    Computes the sha256 checksum of a file.
+
+    Args:
+        file_path: (str) path to the file.
+        chunk_size: (int) number of bytes read at once.
+    Returns:
+        (str) hexadecimal checksum.
+    """
+    sha256 = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+def read_store(store_file):
+    """Reads a store file, keeping identifiers as strings."""
+    return pd.read_csv(
+        store_file,
+        sep="\t",
+        dtype={"participant_id": str, "session_id": str, "checksum": str},
+    )
+
+
+def store_path(output_path):
+    """Path to the store associated to an output TSV file."""
+    return path.splitext(output_path)[0] + "_store.tsv"
+
+
+class QCStore:
+    """
+    Results of a quality check procedure, keyed by participant and session.
+
+    Each result is tagged with the checksum of the QC model (or of the reference
+    images) and with the modification time and size of the input image. A session is
+    only processed again if one of these tags changed. Results are appended to the
+    store file as soon as they are added, so that an interrupted run can be resumed.
+    """
+
+    def __init__(self, store_file, columns, checksum):
+        """
+        Args:
+            store_file: (str) path to the TSV file of the store.
+            columns: (list) names of the results of one session.
+            checksum: (str) identifier of the QC model used to compute the results.
+        """
+        self.store_file = store_file
+        self.columns = list(columns)
+        self.checksum = checksum
+        self.stamps = dict()
+
+        all_columns = KEY_COLUMNS + STAMP_COLUMNS + self.columns
+        if path.exists(store_file):
+            store_df = read_store(store_file)
+            if list(store_df.columns) != all_columns:
+                raise ValueError(
+                    "The columns of the QC store %s are %s instead of %s. "
+                    "Please remove this file to compute all the results again."
+                    % (store_file, list(store_df.columns), all_columns)
+                )
+            self.store_df = store_df.drop_duplicates(KEY_COLUMNS, keep="last")
+        else:
+            self.store_df = pd.DataFrame(columns=all_columns)
+        self._write(self.store_df)
+
+    def _write(self, store_df):
+        store_dir = path.dirname(path.abspath(self.store_file))
+        os.makedirs(store_dir, exist_ok=True)
+        store_df.to_csv(self.store_file, sep="\t", index=False)
+
+    @staticmethod
+    def stamp(image_path):
+        """Modification time (in ns) and size of an input image."""
+        stat = os.stat(image_path)
+        return stat.st_mtime_ns, stat.st_size
+
+    def pending(self, sessions):
+        """
+        Selects the sessions without up-to-date results.
+
+        Args:
+            sessions: (list) tuples (participant_id, session_id, image_path).
+        Returns:
+            (list) the tuples of the sessions which must be processed.
+        """
+        stored = {
+            (row.participant_id, row.session_id): (
+                row.checksum,
+                int(row.input_mtime),
+                int(row.input_size),
+            )
+            for row in self.store_df.itertuples()
+        }
+        pending_sessions = list()
+        for participant_id, session_id, image_path in sessions:
+            stamp = self.stamp(image_path)
+            self.stamps[(participant_id, session_id)] = stamp
+            if stored.get((participant_id, session_id)) != (self.checksum,) + stamp:
+                pending_sessions.append((participant_id, session_id, image_path))
+
+        return pending_sessions
+
+    def add(self, participant_id, session_id, values):
+        """
+        Appends the results of a session returned by pending to the store file.
+
+        Args:
+            participant_id: (str) participant of the session.
+            session_id: (str) session.
+            values: (list) results of the session, in the order of columns.
+        """
+        mtime, size = self.stamps[(participant_id, session_id)]
+        row = [participant_id, session_id, self.checksum, mtime, size] + list(values)
+        with open(self.store_file, "a") as f:
+            f.write("\t".join(str(value) for value in row) + "\n")
+
+    def results(self, sessions=None):
+        """
+        Reads the up-to-date results of the store.
+
+        The store file is rewritten without the results which were replaced.
+
+        Args:
+            sessions: (list) tuples (participant_id, session_id, ...) of the sessions
+                to return. Default returns all the sessions.
+        Returns:
+            (DataFrame) participant_id, session_id and results of the sessions.
+        """
+        store_df = read_store(self.store_file)
+        self.store_df = store_df.drop_duplicates(KEY_COLUMNS, keep="last")
+        self._write(self.store_df)
+
+        results_df = self.store_df[self.store_df.checksum == self.checksum]
+        if sessions is not None:
+            keys = pd.DataFrame(
+                [session[:2] for session in sessions], columns=KEY_COLUMNS
+            )
+            results_df = results_df.merge(keys, on=KEY_COLUMNS, how="inner")
+
+        return results_df[KEY_COLUMNS + self.columns].reset_index(drop=True)
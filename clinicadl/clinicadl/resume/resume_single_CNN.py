@@ -18,6 +18,10 @@ from ..tools.deep_learning.iotools import (
     write_requirements_version,
 )
 from ..tools.deep_learning.models import init_model, load_model, load_optimizer
+from ..tools.deep_learning.models.frozen import (
+    disable_activation_cache,
+    prepare_frozen_layers,
+)
 from ..train.train_singleCNN import test_single_cnn
 
 
@@ -91,6 +95,12 @@ def resume_single_cnn(params, resumed_split):
     model, current_epoch = load_model(
         model, model_dir, params.gpu, "checkpoint.pth.tar"
     )
+    model = prepare_frozen_layers(
+        model,
+        params,
+        path.join(params.output_dir, f"fold-{resumed_split}", "frozen_cache"),
+        logger=main_logger,
+    )
 
     params.beginning_epoch = current_epoch + 1
 
@@ -118,6 +128,7 @@ def resume_single_cnn(params, resumed_split):
         params,
         train_logger,
     )
+    model = disable_activation_cache(model)
 
     test_single_cnn(
         model,
@@ -130,6 +141,7 @@ def resume_single_cnn(params, resumed_split):
         eval_logger,
         params.selection_threshold,
         gpu=params.gpu,
+        file_format=params.prediction_format,
     )
     test_single_cnn(
         model,
@@ -142,4 +154,5 @@ def resume_single_cnn(params, resumed_split):
         eval_logger,
         params.selection_threshold,
         gpu=params.gpu,
+        file_format=params.prediction_format,
     )
@@ -5,6 +5,7 @@ This file generates data for trivial or intractable (random) data for binary cla
 """
 import tarfile
 from copy import copy
+from multiprocessing import Pool
 from os import makedirs
 from os.path import exists, join
 
@@ -15,17 +16,24 @@ import torch
 from clinica.utils.inputs import RemoteFileStructure, fetch_file
 
 from clinicadl.tools.deep_learning.iotools import check_and_clean, commandline_to_json
-from clinicadl.tools.inputs.filename_types import FILENAME_TYPE
+from clinicadl.tools.inputs.filename_types import (
+    FILENAME_TYPE,
+    SHEPPLOGAN_PACKED_FILENAME,
+    SHEPPLOGAN_PACKED_INDEX,
+)
 
 from ..deep_learning.data import MRIDataset
 from ..tsv.tsv_utils import extract_baseline
 from .utils import (
     find_image_path,
-    generate_shepplogan_phantom,
+    generate_shepplogan_phantoms,
     im_loss_roi_gaussian_distribution,
     load_and_check_tsv,
 )
 
+# Data shared by the processes generating the images, set by _init_worker
+_worker_data = dict()
+
 
 def generate_random_dataset(
     caps_dir,
@@ -36,6 +44,9 @@ def generate_random_dataset(
     sigma=0.5,
     preprocessing="t1-linear",
     multi_cohort=False,
+    n_proc=1,
+    seed=None,
+    extract_tensors=False,
 ):
     """
     Generates a random dataset.
@@ -55,6 +66,11 @@ def generate_random_dataset(
         sigma: (float) standard deviation of the gaussian noise
         preprocessing: (str) preprocessing performed. Must be in ['t1-linear', 't1-extensive'].
         multi_cohort (bool): If True caps_directory is the path to a TSV file linking cohort names and paths.
+        n_proc: (int) number of processes generating the images.
+        seed: (int) seed of the random generators. Each subject has its own random
+            stream, so the dataset does not depend on n_proc.
+        extract_tensors: (bool) if True the tensors of deeplearning-prepare-data
+            (image mode) are also written.
 
     Returns:
         A folder written on the output_dir location (in CAPS format), also a
@@ -69,6 +85,7 @@ def generate_random_dataset(
             "n_subjects": n_subjects,
             "mean": mean,
             "sigma": sigma,
+            "seed": seed,
         }
     )
     # Transform caps_dir in dict
@@ -89,7 +106,9 @@ def generate_random_dataset(
         caps_dict, participant_id, session_id, cohort, preprocessing
     )
     image_nii = nib.load(image_path)
-    image = image_nii.get_data()
+    image = image_nii.get_fdata(dtype=np.float32)
+    header = image_nii.header.copy()
+    header.set_data_dtype(np.float32)
 
     # Create output tsv file
     participant_id_list = [f"sub-RAND{i}" for i in range(2 * n_subjects)]
@@ -104,21 +123,19 @@ def generate_random_dataset(
     output_df["sex"] = "F"
     output_df.to_csv(join(output_dir, "data.tsv"), sep="\t", index=False)
 
-    for i in range(2 * n_subjects):
-        gauss = np.random.normal(mean, sigma, image.shape)
-        participant_id = f"sub-RAND{i}"
-        noisy_image = image + gauss
-        noisy_image_nii = nib.Nifti1Image(
-            noisy_image, header=image_nii.header, affine=image_nii.affine
-        )
-        noisy_image_nii_path = join(
-            output_dir, "subjects", participant_id, "ses-M00", "t1_linear"
-        )
-        noisy_image_nii_filename = (
-            participant_id + "_ses-M00" + FILENAME_TYPE["cropped"] + ".nii.gz"
-        )
-        makedirs(noisy_image_nii_path, exist_ok=True)
-        nib.save(noisy_image_nii, join(noisy_image_nii_path, noisy_image_nii_filename))
+    worker_data = {
+        "output_dir": output_dir,
+        "image": image,
+        "affine": image_nii.affine,
+        "header": header,
+        "mean": mean,
+        "sigma": sigma,
+        "extract_tensors": extract_tensors,
+    }
+    seeds = np.random.SeedSequence(seed).spawn(2 * n_subjects)
+    _run_tasks(
+        _generate_random_image, list(enumerate(seeds)), worker_data, n_proc=n_proc
+    )
 
     missing_path = join(output_dir, "missing_mods")
     makedirs(missing_path, exist_ok=True)
@@ -142,6 +159,9 @@ def generate_trivial_dataset(
     mask_path=None,
     atrophy_percent=60,
     multi_cohort=False,
+    n_proc=1,
+    seed=None,
+    extract_tensors=False,
 ):
     """
     Generates a fully separable dataset.
@@ -161,6 +181,11 @@ def generate_trivial_dataset(
         mask_path: (str) path to the extracted masks to generate the two labels.
         atrophy_percent: (float) percentage of atrophy applied.
         multi_cohort (bool): If True caps_directory is the path to a TSV file linking cohort names and paths.
+        n_proc: (int) number of processes generating the images.
+        seed: (int) seed of the random generators. Each subject has its own random
+            stream, so the dataset does not depend on n_proc.
+        extract_tensors: (bool) if True the tensors of deeplearning-prepare-data
+            (image mode) are also written.
 
     Returns:
         Folder structure where images are stored in CAPS format.
@@ -177,6 +202,7 @@ def generate_trivial_dataset(
             "preprocessing": preprocessing,
             "n_subjects": n_subjects,
             "atrophy_percent": atrophy_percent,
+            "seed": seed,
         }
     )
 
@@ -229,44 +255,40 @@ def generate_trivial_dataset(
     # Create subjects dir
     makedirs(join(output_dir, "subjects"), exist_ok=True)
 
-    # Output tsv file
-    columns = ["participant_id", "session_id", "diagnosis", "age_bl", "sex"]
-    output_df = pd.DataFrame(columns=columns)
-    diagnosis_list = ["AD", "CN"]
-
-    for i in range(2 * n_subjects):
-        data_idx = i // 2
-        label = i % 2
-
-        participant_id = data_df.loc[data_idx, "participant_id"]
-        session_id = data_df.loc[data_idx, "session_id"]
-        cohort = data_df.loc[data_idx, "cohort"]
-        filename = f"sub-TRIV{i}_ses-M00" + FILENAME_TYPE["cropped"] + ".nii.gz"
-        path_image = join(
-            output_dir, "subjects", f"sub-TRIV{i}", "ses-M00", "t1_linear"
+    # The masks of the two labels are loaded only once
+    masks = [
+        np.asanyarray(nib.load(join(mask_path, f"mask-{label + 1}.nii")).dataobj) != 0
+        for label in range(2)
+    ]
+    seeds = np.random.SeedSequence(seed).spawn(n_subjects)
+    tasks = [
+        (
+            data_idx,
+            seeds[data_idx],
+            find_image_path(
+                caps_dict,
+                data_df.loc[data_idx, "participant_id"],
+                data_df.loc[data_idx, "session_id"],
+                data_df.loc[data_idx, "cohort"],
+                preprocessing,
+            ),
         )
+        for data_idx in range(n_subjects)
+    ]
 
-        makedirs(path_image, exist_ok=True)
-
-        image_path = find_image_path(
-            caps_dict, participant_id, session_id, cohort, preprocessing
-        )
-        image_nii = nib.load(image_path)
-        image = image_nii.get_data()
+    worker_data = {
+        "output_dir": output_dir,
+        "masks": masks,
+        "atrophy_percent": atrophy_percent,
+        "extract_tensors": extract_tensors,
+    }
+    rows = _run_tasks(_generate_trivial_images, tasks, worker_data, n_proc=n_proc)
 
-        atlas_to_mask = nib.load(join(mask_path, f"mask-{label + 1}.nii")).get_data()
-
-        # Create atrophied image
-        trivial_image = im_loss_roi_gaussian_distribution(
-            image, atlas_to_mask, atrophy_percent
-        )
-        trivial_image_nii = nib.Nifti1Image(trivial_image, affine=image_nii.affine)
-        trivial_image_nii.to_filename(join(path_image, filename))
-
-        # Append row to output tsv
-        row = [f"sub-TRIV{i}", "ses-M00", diagnosis_list[label], 60, "F"]
-        row_df = pd.DataFrame([row], columns=columns)
-        output_df = output_df.append(row_df)
+    # Output tsv file
+    columns = ["participant_id", "session_id", "diagnosis", "age_bl", "sex"]
+    output_df = pd.DataFrame(
+        [row for image_rows in rows for row in image_rows], columns=columns
+    )
 
     output_df.to_csv(join(output_dir, "data.tsv"), sep="\t", index=False)
 
@@ -283,70 +305,126 @@ def generate_trivial_dataset(
         )
 
 
-def generate_shepplogan_dataset(
-    output_dir, img_size, labels_distribution, samples=100, smoothing=True
-):
+def _init_worker(worker_data):
+    _worker_data.update(worker_data)
 
-    check_and_clean(join(output_dir, "subjects"))
-    commandline_to_json(
-        {
-            "output_dir": output_dir,
-            "img_size": img_size,
-            "labels_distribution": labels_distribution,
-            "samples": samples,
-            "smoothing": smoothing,
-        }
+
+def _run_tasks(function, tasks, worker_data, n_proc=1):
+    """
+    Applies function to all the tasks, in parallel if n_proc > 1.
+
+    Args:
+        function: (callable) function of one task, reading the shared data in
+            _worker_data.
+        tasks: (list) arguments of the calls to function.
+        worker_data: (dict) data shared by all the tasks.
+        n_proc: (int) number of processes.
+    Returns:
+        (list) outputs of function, in the order of tasks.
+    """
+    if n_proc > 1:
+        with Pool(n_proc, initializer=_init_worker, initargs=(worker_data,)) as pool:
+            return list(pool.imap(function, tasks))
+
+    _init_worker(worker_data)
+    return list(map(function, tasks))
+
+
+def _write_synthetic_image(participant_id, image, affine, header=None):
+    """Writes the image of a synthetic subject in the t1-linear folder of the CAPS."""
+    session_id = "ses-M00"
+    filename = participant_id + "_" + session_id + FILENAME_TYPE["cropped"]
+    session_path = join(
+        _worker_data["output_dir"], "subjects", participant_id, session_id
     )
-    columns = ["participant_id", "session_id", "diagnosis", "subtype"]
-    data_df = pd.DataFrame(columns=columns)
 
-    for i, label in enumerate(labels_distribution.keys()):
-        samples_per_subtype = np.array(labels_distribution[label]) * samples
-        for subtype in range(len(samples_per_subtype)):
-            for j in range(int(samples_per_subtype[subtype])):
-                participant_id = "sub-CLNC%i%04d" % (
-                    i,
-                    j + np.sum(samples_per_subtype[:subtype:]).astype(int),
-                )
-                session_id = "ses-M00"
-                row_df = pd.DataFrame(
-                    [[participant_id, session_id, label, subtype]], columns=columns
-                )
-                data_df = data_df.append(row_df)
+    image_path = join(session_path, "t1_linear")
+    makedirs(image_path, exist_ok=True)
+    image_nii = nib.Nifti1Image(image, affine=affine, header=header)
+    image_nii.to_filename(join(image_path, filename + ".nii.gz"))
 
-                # Image generation
-                path_out = join(
-                    output_dir,
-                    "subjects",
-                    "%s_%s%s.pt"
-                    % (participant_id, session_id, FILENAME_TYPE["shepplogan"]),
-                )
-                img = generate_shepplogan_phantom(
-                    img_size, label=subtype, smoothing=smoothing
-                )
-                torch_img = torch.from_numpy(img).float().unsqueeze(0)
-                torch.save(torch_img, path_out)
+    if _worker_data["extract_tensors"]:
+        tensor_path = join(
+            session_path, "deeplearning_prepare_data", "image_based", "t1_linear"
+        )
+        makedirs(tensor_path, exist_ok=True)
+        torch.save(
+            torch.from_numpy(image).unsqueeze(0).float(),
+            join(tensor_path, filename + ".pt"),
+        )
 
-    data_df.to_csv(join(output_dir, "data.tsv"), sep="\t", index=False)
 
-    missing_path = join(output_dir, "missing_mods")
-    if not exists(missing_path):
-        makedirs(missing_path)
+def _generate_random_image(task):
+    """Writes the image of the CAPS with gaussian noise."""
+    i, seed = task
+    rng = np.random.default_rng(seed)
+    image = _worker_data["image"]
+    gauss = rng.standard_normal(image.shape, dtype=np.float32)
+    gauss *= _worker_data["sigma"]
+    gauss += _worker_data["mean"]
+    _write_synthetic_image(
+        f"sub-RAND{i}",
+        image + gauss,
+        _worker_data["affine"],
+        header=_worker_data["header"],
+    )
 
-    sessions = data_df.session_id.unique()
-    for session in sessions:
-        session_df = data_df[data_df.session_id == session]
-        out_df = copy(session_df[["participant_id"]])
-        out_df["t1w"] = [1] * len(out_df)
-        out_df.to_csv(
-            join(missing_path, "missing_mods_%s.tsv" % session), sep="\t", index=False
+
+def _generate_trivial_images(task):
+    """Writes the two atrophied versions (one per label) of an image of the CAPS."""
+    data_idx, seed, image_path = task
+    rng = np.random.default_rng(seed)
+    diagnosis_list = ["AD", "CN"]
+    image_nii = nib.load(image_path)
+    image = image_nii.get_fdata(dtype=np.float32)
+
+    rows = list()
+    for label in range(2):
+        i = 2 * data_idx + label
+
+        # Create atrophied image
+        trivial_image = im_loss_roi_gaussian_distribution(
+            image,
+            _worker_data["masks"][label],
+            _worker_data["atrophy_percent"],
+            rng=rng,
         )
+        _write_synthetic_image(f"sub-TRIV{i}", trivial_image, image_nii.affine)
+
+        rows.append([f"sub-TRIV{i}", "ses-M00", diagnosis_list[label], 60, "F"])
+
+    return rows
 
 
 def generate_shepplogan_dataset(
-    output_dir, img_size, labels_distribution, samples=100, smoothing=True
+    output_dir,
+    img_size,
+    labels_distribution,
+    samples=100,
+    smoothing=True,
+    batch_size=256,
+    individual_files=False,
+    seed=None,
 ):
+    """
+    Generates a dataset of 2D phantoms based on the Shepp-Logan phantom.
 
+    The phantoms are generated by batches. By default each batch is written in a
+    single memory-mapped array (subjects/packed_phantom-SheppLogan.npy) indexed by
+    subjects/packed_phantom-SheppLogan.tsv, which is read by the image datasets
+    without loading the whole array.
+
+    Args:
+        output_dir: (str) folder containing the synthetic dataset.
+        img_size: (int) size in pixels of the squared images.
+        labels_distribution: (dict) probabilities of the subtypes of each label.
+        samples: (int) number of subjects of each label.
+        smoothing: (bool) if True a random gaussian smoothing is applied.
+        batch_size: (int) number of phantoms generated at once.
+        individual_files: (bool) if True one tensor file is written per image
+            instead of the packed file.
+        seed: (int) seed of the random generator.
+    """
     check_and_clean(join(output_dir, "subjects"))
     commandline_to_json(
         {
@@ -355,35 +433,74 @@ def generate_shepplogan_dataset(
             "labels_distribution": labels_distribution,
             "samples": samples,
             "smoothing": smoothing,
+            "individual_files": individual_files,
+            "seed": seed,
         }
     )
-    columns = ["participant_id", "session_id", "diagnosis", "subtype"]
-    data_df = pd.DataFrame(columns=columns)
+    rng = np.random.default_rng(seed)
 
+    participant_ids = list()
+    diagnoses = list()
+    subtypes = list()
     for i, label in enumerate(labels_distribution.keys()):
-        for j in range(samples):
-            participant_id = "sub-CLNC%i%04d" % (i, j)
-            session_id = "ses-M00"
-            subtype = np.random.choice(
-                np.arange(len(labels_distribution[label])), p=labels_distribution[label]
+        participant_ids += ["sub-CLNC%i%04d" % (i, j) for j in range(samples)]
+        diagnoses += [label] * samples
+        subtypes.append(
+            rng.choice(
+                len(labels_distribution[label]),
+                size=samples,
+                p=labels_distribution[label],
             )
-            row_df = pd.DataFrame(
-                [[participant_id, session_id, label, subtype]], columns=columns
-            )
-            data_df = data_df.append(row_df)
-
-            # Image generation
-            path_out = join(
-                output_dir,
-                "subjects",
-                "%s_%s%s.pt"
-                % (participant_id, session_id, FILENAME_TYPE["shepplogan"]),
-            )
-            img = generate_shepplogan_phantom(
-                img_size, label=subtype, smoothing=smoothing
-            )
-            torch_img = torch.from_numpy(img).float().unsqueeze(0)
-            torch.save(torch_img, path_out)
+        )
+    subtypes = np.concatenate(subtypes)
+    session_id = "ses-M00"
+
+    data_df = pd.DataFrame(
+        {
+            "participant_id": participant_ids,
+            "session_id": session_id,
+            "diagnosis": diagnoses,
+            "subtype": subtypes,
+        }
+    )
+
+    # Image generation
+    if not individual_files:
+        images = np.lib.format.open_memmap(
+            join(output_dir, "subjects", SHEPPLOGAN_PACKED_FILENAME),
+            mode="w+",
+            dtype=np.float32,
+            shape=(len(data_df), 1, img_size, img_size),
+        )
+    for start in range(0, len(data_df), batch_size):
+        batch_images = generate_shepplogan_phantoms(
+            img_size,
+            subtypes[start : start + batch_size],
+            smoothing=smoothing,
+            rng=rng,
+        ).unsqueeze(1)
+        if individual_files:
+            for participant_id, img in zip(
+                participant_ids[start : start + batch_size], batch_images
+            ):
+                path_out = join(
+                    output_dir,
+                    "subjects",
+                    "%s_%s%s.pt"
+                    % (participant_id, session_id, FILENAME_TYPE["shepplogan"]),
+                )
+                torch.save(img.clone(), path_out)
+        else:
+            images[start : start + len(batch_images)] = batch_images.numpy()
+
+    if not individual_files:
+        images.flush()
+        del images
+        data_df[["participant_id", "session_id"]].to_csv(
+            join(output_dir, "subjects", SHEPPLOGAN_PACKED_INDEX),
+            sep="\t",
+            index=False,
+        )
 
     data_df.to_csv(join(output_dir, "data.tsv"), sep="\t", index=False)
 
@@ -1,10 +1,7 @@
 # coding: utf8
 
-import random
-
 import numpy as np
-from scipy.ndimage import gaussian_filter
-from skimage.draw import ellipse
+import torch
 
 from clinicadl.tools.inputs.filename_types import FILENAME_TYPE
 
@@ -101,31 +98,37 @@ def binary_t1_pgm(im_data):
     return m
 
 
-def im_loss_roi_gaussian_distribution(im_data, atlas_to_mask, min_value):
-    gm_masked = np.array(im_data, copy=True)
-    gm_masked[atlas_to_mask == 0] = 0
+def im_loss_roi_gaussian_distribution(im_data, atlas_to_mask, min_value, rng=None):
+    """
+    Simulates atrophy in a region of an image.
+
+    The non-zero voxels of the region lose a random percentage of their intensity,
+    drawn from a gaussian distribution shifted so that its minimum is min_value.
+
+    Args:
+        im_data: (array) image.
+        atlas_to_mask: (array) mask of the atrophied region, same shape as im_data.
+        min_value: (float) minimal percentage of atrophy.
+        rng: (Generator) random generator. Default uses the global generator of
+            numpy.
+    Returns:
+        (array) atrophied image.
+    """
+    im_with_loss_gm_roi = np.array(im_data, copy=True)
+    roi = (atlas_to_mask != 0) & (im_with_loss_gm_roi != 0)
+    length_coordinates = np.count_nonzero(roi)  # all the non zero values
+    if length_coordinates == 0:
+        return im_with_loss_gm_roi
 
-    gm_loss = np.array(gm_masked, copy=True)
-    idx = np.nonzero(gm_masked)
-    coordinates = []
-    for i in range(len(idx[0])):
-        coordinates.append([idx[0][i], idx[1][i], idx[2][i]])
-    length_coordinates = len(coordinates)  # all the non zero values
+    if rng is None:
+        rng = np.random
 
     # gaussian distribution with std = 0.1 and media = 0
-    n = np.random.normal(loc=0.0, scale=0.1, size=length_coordinates)
-    max_value = np.min(n)
-    n_new = n + abs(max_value)
+    n = rng.normal(loc=0.0, scale=0.1, size=length_coordinates)
+    n_new = n + abs(np.min(n))
 
     n_diff = n_new * 10 + min_value
-    for i, coord in enumerate(coordinates):
-        x, y, z = coord
-        gm_loss[x, y, z] = gm_masked[x, y, z] - n_diff[i] * (gm_masked[x, y, z]) / 100
-
-    normal_region = np.array(im_data, copy=True)
-    normal_region[atlas_to_mask > 0] = 0
-
-    im_with_loss_gm_roi = normal_region + gm_loss
+    im_with_loss_gm_roi[roi] = im_with_loss_gm_roi[roi] * (1 - n_diff / 100)
 
     return im_with_loss_gm_roi
 
@@ -189,149 +192,249 @@ def find_border_of_prob_gm_and_atlas(output_path, i, tsv_atlas, im_data):
     return coordinates
 
 
-def generate_scales(size):
-    if size == "large":
-        return random.uniform(1, 1.2), random.uniform(1, 1.2)
-    elif size == "small":
-        return random.uniform(0.8, 0.9), random.uniform(0.8, 0.9)
-    else:
+# Ranges of the scales of the regions of interest of the phantoms
+SCALES = {"large": (1, 1.2), "small": (0.8, 0.9)}
+# Sizes of the two regions of interest of each subtype
+SUBTYPE_SIZES = [("large", "large"), ("large", "small"), ("small", "large")]
+
+
+def generate_scales(size, n_samples=None, rng=None):
+    """
+    Draws the two scales of the radii of a region of interest.
+
+    Args:
+        size: (str) "large" or "small".
+        n_samples: (int) number of draws. Default draws scalars.
+        rng: (Generator) random generator. Default uses the global generator of
+            numpy.
+    Returns:
+        (tuple) scales of the two radii.
+    """
+    if size not in SCALES:
         raise NotImplementedError(
             "Size %s was not implemented for variable sizes." % size
         )
+    if rng is None:
+        rng = np.random
+    low, high = SCALES[size]
+    return rng.uniform(low, high, n_samples), rng.uniform(low, high, n_samples)
 
 
-def generate_shepplogan_phantom(img_size, label=0, smoothing=True):
-    img = np.zeros((img_size, img_size))
+def _ellipses(rows, cols, center_r, center_c, radius_r, radius_c, rotation=0):
+    """
+    Rasterizes one ellipse per image, following the convention of skimage.draw.ellipse.
+
+    Args:
+        rows, cols: (Tensor) coordinates of the pixels, of size (1, H, 1) and
+            (1, 1, W).
+        center_r, center_c, radius_r, radius_c, rotation: (array-like) parameters of
+            the ellipses, one value per image (or a scalar shared by all images).
+    Returns:
+        (Tensor) boolean masks of size (N, H, W).
+    """
+
+    def as_tensor(values):
+        return torch.as_tensor(values, dtype=torch.float64).reshape(-1, 1, 1)
+
+    rotation = as_tensor(rotation)
+    sin_alpha, cos_alpha = torch.sin(rotation), torch.cos(rotation)
+    r = rows - as_tensor(center_r)
+    c = cols - as_tensor(center_c)
+    distances = ((r * cos_alpha + c * sin_alpha) / as_tensor(radius_r)) ** 2 + (
+        (r * sin_alpha - c * cos_alpha) / as_tensor(radius_c)
+    ) ** 2
+    return distances < 1
+
+
+def symmetric_indices(length, radius):
+    """
+    Computes the indices of a dimension extended by radius on both sides with
+    half-sample symmetry.
+
+    Args:
+        length: (int) length of the dimension.
+        radius: (int) number of indices added on each side.
+    Returns:
+        (LongTensor) indices of size length + 2 * radius.
+    """
+    indices = torch.arange(-radius, length + radius) % (2 * length)
+    return torch.where(indices >= length, 2 * length - 1 - indices, indices)
+
+
+def gaussian_smoothing(images, sigmas, truncate=4.0):
+    """
+    Smooths each image with its own gaussian kernel, in a single batched convolution.
+
+    Borders are extended by half-sample symmetry, as the default "reflect" mode of
+    scipy.ndimage.gaussian_filter.
+
+    Args:
+        images: (Tensor) images of size (N, H, W).
+        sigmas: (Tensor) standard deviation of the kernel of each image, in pixels.
+        truncate: (float) the kernels are truncated at this many standard deviations.
+    Returns:
+        (Tensor) smoothed images of size (N, H, W).
+    """
+    from torch.nn.functional import conv2d
+
+    n_images = images.shape[0]
+    sigmas = torch.as_tensor(sigmas, dtype=images.dtype).reshape(-1, 1)
+    radius = int(truncate * float(sigmas.max()) + 0.5)
+    if radius == 0:
+        return images
+
+    x = torch.arange(-radius, radius + 1, dtype=images.dtype).reshape(1, -1)
+    # A null standard deviation gives a Dirac kernel
+    kernels = torch.exp(-0.5 * (x / sigmas.clamp(min=1e-6)) ** 2)
+    kernels = kernels / kernels.sum(dim=1, keepdim=True)
+
+    # Half-sample symmetric padding (d c b a | a b c d | d c b a)
+    rows = symmetric_indices(images.shape[1], radius)
+    columns = symmetric_indices(images.shape[2], radius)
+    images = images[:, rows][:, :, columns].unsqueeze(0)
+
+    # Separable convolution, each image being a group
+    images = conv2d(images, kernels.reshape(n_images, 1, -1, 1), groups=n_images)
+    images = conv2d(images, kernels.reshape(n_images, 1, 1, -1), groups=n_images)
+    return images.squeeze(0)
+
+
+def generate_shepplogan_phantoms(img_size, subtypes, smoothing=True, rng=None):
+    """
+    Generates a batch of 2D phantoms based on the Shepp-Logan phantom.
+
+    All the ellipses of the batch are rasterized at once from coordinate grids and
+    the random parameters of all the phantoms.
+
+    Args:
+        img_size: (int) size in pixels of the squared images.
+        subtypes: (array-like) subtype of each phantom, in [0, 1, 2].
+        smoothing: (bool) if True a random gaussian smoothing is applied.
+        rng: (Generator) random generator. Default uses the global generator of
+            numpy.
+    Returns:
+        (Tensor) phantoms of size (N, img_size, img_size).
+    """
+    if rng is None:
+        rng = np.random
+    subtypes = np.asarray(subtypes, dtype=int).reshape(-1)
+    n_samples = len(subtypes)
+    for subtype in np.unique(subtypes):
+        if subtype < 0 or subtype >= len(SUBTYPE_SIZES):
+            raise ValueError("Subtype %i was not implemented." % subtype)
+
+    def draw_scales(roi):
+        # Draws the scales of all the phantoms according to the size of their ROI
+        scales = [np.zeros(n_samples), np.zeros(n_samples)]
+        for size in SCALES:
+            selection = np.array(
+                [SUBTYPE_SIZES[subtype][roi] == size for subtype in subtypes],
+                dtype=bool,
+            )
+            for scale, draw in zip(
+                scales, generate_scales(size, np.count_nonzero(selection), rng)
+            ):
+                scale[selection] = draw
+        return scales
+
+    def draw_offsets():
+        return (
+            rng.uniform(1, img_size / 32, n_samples),
+            rng.uniform(1, img_size / 32, n_samples),
+        )
+
+    images = torch.zeros(n_samples, img_size, img_size, dtype=torch.float64)
+    coordinates = torch.arange(img_size, dtype=torch.float64)
+    rows, cols = coordinates.reshape(1, -1, 1), coordinates.reshape(1, 1, -1)
     center = (img_size + 1.0) / 2.0
     a = center - 2
     b = center * 2 / 3 - 2
 
-    color = random.uniform(0.4, 0.6)
+    color = torch.as_tensor(rng.uniform(0.4, 0.6, n_samples)).reshape(-1, 1, 1)
 
-    if label == 0:
-        roi1, roi2 = "large", "large"
-    elif label == 1:
-        roi1, roi2 = "large", "small"
-    elif label == 2:
-        roi1, roi2 = "small", "large"
-    else:
-        raise ValueError("Subtype %i was not implemented." % label)
+    def draw(value, *ellipse_parameters, rotation=0):
+        mask = _ellipses(rows, cols, *ellipse_parameters, rotation=rotation)
+        images.copy_(torch.where(mask, torch.as_tensor(value).double(), images))
 
     # Skull
-    rr, cc = ellipse(center, center, a, b, (img_size, img_size))
-    img[rr, cc] = 1
+    draw(1.0, center, center, a, b)
 
     # Brain
-    offset = random.uniform(1, img_size / 32)
-    rr, cc = ellipse(
-        center + offset / 2, center, a - offset, b - offset, (img_size, img_size)
-    )
-    img[rr, cc] = 0.2
+    offset = rng.uniform(1, img_size / 32, n_samples)
+    draw(0.2, center + offset / 2, center, a - offset, b - offset)
 
     # Central
-    offset1 = random.uniform(1, img_size / 32)
-    offset2 = random.uniform(1, img_size / 32)
-    scale1, scale2 = generate_scales("large")
-    phi = random.uniform(-np.pi, np.pi)
-    rr, cc = ellipse(
+    offset1, offset2 = draw_offsets()
+    scale1, scale2 = generate_scales("large", n_samples, rng)
+    phi = rng.uniform(-np.pi, np.pi, n_samples)
+    draw(
+        color,
         center + offset1,
         center + offset2,
         b / 6 * scale1,
         b / 6 * scale2,
-        (img_size, img_size),
         rotation=phi,
     )
-    img[rr, cc] = color
 
     # ROI 1
-    offset1 = random.uniform(1, img_size / 32)
-    offset2 = random.uniform(1, img_size / 32)
-    scale1, scale2 = generate_scales(roi1)
-    phi = random.uniform(-np.pi, np.pi)
-    rr, cc = ellipse(
+    offset1, offset2 = draw_offsets()
+    scale1, scale2 = draw_scales(0)
+    phi = rng.uniform(-np.pi, np.pi, n_samples)
+    draw(
+        color,
         center * 0.6 + offset1,
         center + offset2,
         b / 3 * scale1,
         b / 4 * scale2,
-        (img_size, img_size),
         rotation=phi,
     )
-    img[rr, cc] = color
 
     # ROI 2
-    offset1 = random.uniform(1, img_size / 32)
-    offset2 = random.uniform(1, img_size / 32)
-    scale1, scale2 = generate_scales(roi2)
-    phi = random.uniform(-np.pi, np.pi)
-    rr, cc = ellipse(
-        center * 1.5 + offset1,
-        center + offset2,
-        b / 10 * scale1,
-        b / 10 * scale2,
-        (img_size, img_size),
-        rotation=phi,
-    )
-    img[rr, cc] = color
-
-    offset1 = random.uniform(1, img_size / 32)
-    offset2 = random.uniform(1, img_size / 32)
-    scale1, scale2 = generate_scales(roi2)
-    phi = random.uniform(-np.pi, np.pi)
-    rr, cc = ellipse(
-        center * 1.5 + offset1,
-        center * 1.1 + offset2,
-        b / 10 * scale1,
-        b / 10 * scale2,
-        (img_size, img_size),
-        rotation=phi,
-    )
-    img[rr, cc] = color
-
-    offset1 = random.uniform(1, img_size / 32)
-    offset2 = random.uniform(1, img_size / 32)
-    scale1, scale2 = generate_scales(roi2)
-    phi = random.uniform(-np.pi, np.pi)
-    rr, cc = ellipse(
-        center * 1.5 + offset1,
-        center * 0.9 + offset2,
-        b / 10 * scale1,
-        b / 10 * scale2,
-        (img_size, img_size),
-        rotation=phi,
-    )
-    img[rr, cc] = color
-
-    # Ventricle 1
-    a_roi = a * random.uniform(0.8, 1.2)
-    phi = np.random.uniform(-np.pi / 16, np.pi / 16)
-    rr, cc = ellipse(
-        center,
-        center * 0.75,
-        a_roi / 3,
-        a_roi / 6,
-        (img_size, img_size),
-        rotation=np.pi / 8 + phi,
-    )
-    img[rr, cc] = 0.0
-
-    # Ventricle 2
-    a_roi = a * random.uniform(0.8, 1.2)
-    phi = np.random.uniform(-np.pi / 16, np.pi / 16)
-    rr, cc = ellipse(
-        center,
-        center * 1.25,
-        a_roi / 3,
-        a_roi / 6,
-        (img_size, img_size),
-        rotation=-np.pi / 8 + phi,
-    )
-    img[rr, cc] = 0.0
+    for center_factor in [1.0, 1.1, 0.9]:
+        offset1, offset2 = draw_offsets()
+        scale1, scale2 = draw_scales(1)
+        phi = rng.uniform(-np.pi, np.pi, n_samples)
+        draw(
+            color,
+            center * 1.5 + offset1,
+            center * center_factor + offset2,
+            b / 10 * scale1,
+            b / 10 * scale2,
+            rotation=phi,
+        )
+
+    # Ventricles
+    for center_factor, rotation in [(0.75, np.pi / 8), (1.25, -np.pi / 8)]:
+        a_roi = a * rng.uniform(0.8, 1.2, n_samples)
+        phi = rng.uniform(-np.pi / 16, np.pi / 16, n_samples)
+        draw(
+            0.0,
+            center,
+            center * center_factor,
+            a_roi / 3,
+            a_roi / 6,
+            rotation=rotation + phi,
+        )
+
+    images = images.float()
 
     # Random smoothing
     if smoothing:
-        sigma = random.uniform(0, 1)
-        img = gaussian_filter(img, sigma * img_size / 100.0)  # smoothing of data
+        sigmas = rng.uniform(0, 1, n_samples) * img_size / 100.0
+        images = gaussian_smoothing(images, sigmas)
+
+    return images.clamp(0, 1)
 
-    img.clip(0, 1)
 
-    return img
+def generate_shepplogan_phantom(img_size, label=0, smoothing=True):
+    """
+    Generates one 2D phantom based on the Shepp-Logan phantom.
+
+    Args:
+        img_size: (int) size in pixels of the squared image.
+        label: (int) subtype of the phantom, in [0, 1, 2].
+        smoothing: (bool) if True a random gaussian smoothing is applied.
+    Returns:
+        (array) phantom of size (img_size, img_size).
+    """
+    return generate_shepplogan_phantoms(img_size, [label], smoothing)[0].numpy()
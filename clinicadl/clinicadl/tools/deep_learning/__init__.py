@@ -7,6 +7,8 @@ from .iotools import (
 from .models import (
     create_autoencoder,
     create_model,
+    export_model,
+    load_exported_model,
     load_model,
     load_optimizer,
     save_checkpoint,
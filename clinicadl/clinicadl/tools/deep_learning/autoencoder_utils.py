@@ -5,7 +5,10 @@ from time import time
 
 import numpy as np
 import pandas as pd
+import torch
+import torch.nn.functional as F
 from torch import nn
+from torch.utils.data import DataLoader
 
 from clinicadl.tools.deep_learning import EarlyStopping, save_checkpoint
 from clinicadl.tools.deep_learning.iotools import check_and_clean
@@ -83,6 +86,11 @@ def train(
     train_loader.dataset.train()
     logger.debug(decoder)
 
+    # The training loss is evaluated on a fixed subset of the training set
+    train_evaluation_loader = evaluation_loader(
+        train_loader, getattr(options, "train_evaluation_size", 0)
+    )
+
     if options.gpu:
         decoder.cuda()
 
@@ -126,15 +134,21 @@ def train(
                     and (i + 1) % options.evaluation_steps == 0
                 ):
                     evaluation_flag = False
-                    loss_train = test_ae(decoder, train_loader, options.gpu, criterion)
+                    loss_train = test_ae(
+                        decoder, train_evaluation_loader, options.gpu, criterion
+                    )
                     mean_loss_train = loss_train / (
-                        len(train_loader) * train_loader.batch_size
+                        len(train_evaluation_loader)
+                        * train_evaluation_loader.batch_size
                     )
 
-                    loss_valid = test_ae(decoder, valid_loader, options.gpu, criterion)
+                    loss_valid, errors_valid = evaluate_ae(
+                        decoder, valid_loader, options.gpu, criterion
+                    )
                     mean_loss_valid = loss_valid / (
                         len(valid_loader) * valid_loader.batch_size
                     )
+                    log_reconstruction_summary(errors_valid, "validation", logger)
                     decoder.train()
                     train_loader.dataset.train()
 
@@ -175,11 +189,16 @@ def train(
         # Always test the results and save them once at the end of the epoch
         logger.debug("Last checkpoint at the end of the epoch %d" % epoch)
 
-        loss_train = test_ae(decoder, train_loader, options.gpu, criterion)
-        mean_loss_train = loss_train / (len(train_loader) * train_loader.batch_size)
+        loss_train = test_ae(decoder, train_evaluation_loader, options.gpu, criterion)
+        mean_loss_train = loss_train / (
+            len(train_evaluation_loader) * train_evaluation_loader.batch_size
+        )
 
-        loss_valid = test_ae(decoder, valid_loader, options.gpu, criterion)
+        loss_valid, errors_valid = evaluate_ae(
+            decoder, valid_loader, options.gpu, criterion
+        )
         mean_loss_valid = loss_valid / (len(valid_loader) * valid_loader.batch_size)
+        log_reconstruction_summary(errors_valid, "validation", logger)
         decoder.train()
         train_loader.dataset.train()
 
@@ -241,23 +260,189 @@ def test_ae(decoder, dataloader, use_cuda, criterion):
     Returns:
         (float) total loss of the model
     """
+    total_loss, _ = evaluate_ae(decoder, dataloader, use_cuda, criterion)
+    return total_loss
+
+
+def evaluate_ae(decoder, dataloader, use_cuda, criterion):
+    """
+    Computes the loss of an autoencoder and the reconstruction error of each input.
+
+    The evaluation is done in evaluation mode and without building the autograd graph.
+    Only one error per input is kept, so that the memory used does not depend on the
+    size of the inputs.
+
+    Args:
+        decoder: (Autoencoder) Autoencoder constructed from a CNN with the Autoencoder class.
+        dataloader: (DataLoader) wrapper of the dataset.
+        use_cuda: (bool) if True a gpu is used.
+        criterion: (loss) function to calculate the loss (with a mean reduction).
+
+    Returns:
+        (float) total loss of the model (sum of the losses of the batches).
+        (DataFrame) reconstruction error of each input.
+    """
     decoder.eval()
     dataloader.dataset.eval()
+    mode = dataloader.dataset.mode
 
     total_loss = 0
-    for i, data in enumerate(dataloader, 0):
-        if use_cuda:
-            inputs = data["image"].cuda()
-        else:
-            inputs = data["image"]
+    rows = list()
+    with torch.no_grad():
+        for i, data in enumerate(dataloader, 0):
+            if use_cuda:
+                inputs = data["image"].cuda()
+            else:
+                inputs = data["image"]
 
-        outputs = decoder(inputs)
-        loss = criterion(outputs, inputs)
-        total_loss += loss.item()
+            outputs = decoder(inputs)
+            errors = sample_errors(criterion, outputs, inputs)
+            total_loss += errors.mean().item()
 
-        del inputs, outputs, loss
+            for idx, error in enumerate(errors.tolist()):
+                row = {
+                    "participant_id": data["participant_id"][idx],
+                    "session_id": data["session_id"][idx],
+                    "reconstruction_error": error,
+                }
+                if mode != "image":
+                    row["%s_id" % mode] = int(data["%s_id" % mode][idx])
+                rows.append(row)
 
-    return total_loss
+            del inputs, outputs, errors
+
+    return total_loss, pd.DataFrame(rows)
+
+
+def sample_errors(criterion, outputs, inputs):
+    """
+    Applies a loss to each input of a batch.
+
+    Args:
+        criterion: (loss) loss returned by get_criterion (MSE, L1 or smooth L1),
+            it is not modified.
+        outputs: (Tensor) reconstructions of the inputs.
+        inputs: (Tensor) batch of inputs.
+    Returns:
+        (Tensor) mean loss of each input of the batch.
+    """
+    if isinstance(criterion, nn.MSELoss):
+        errors = F.mse_loss(outputs, inputs, reduction="none")
+    elif isinstance(criterion, nn.L1Loss):
+        errors = F.l1_loss(outputs, inputs, reduction="none")
+    elif isinstance(criterion, nn.SmoothL1Loss):
+        # beta is only an attribute of the loss in recent versions of torch
+        kwargs = {"beta": criterion.beta} if hasattr(criterion, "beta") else {}
+        errors = F.smooth_l1_loss(outputs, inputs, reduction="none", **kwargs)
+    else:
+        raise ValueError(
+            "Reconstruction errors cannot be computed for each input with the loss %s."
+            % type(criterion).__name__
+        )
+
+    return errors.view(len(errors), -1).mean(dim=1)
+
+
+def evaluation_loader(dataloader, n_inputs=0, seed=0):
+    """
+    Wraps a fixed random subset of the dataset of dataloader, used to evaluate the
+    training loss without going through the whole training set.
+
+    Args:
+        dataloader: (DataLoader) wrapper of the full dataset.
+        n_inputs: (int) number of inputs of the subset. If 0, or larger than the
+            dataset, the whole dataset is used in order.
+        seed: (int) seed of the selection of the subset.
+    Returns:
+        (DataLoader) wrapper of the subset.
+    """
+    dataset = dataloader.dataset
+    if n_inputs <= 0 or n_inputs >= len(dataset):
+        indices = list(range(len(dataset)))
+    else:
+        rng = np.random.RandomState(seed)
+        indices = sorted(rng.choice(len(dataset), n_inputs, replace=False).tolist())
+
+    return DataLoader(
+        dataset,
+        batch_size=dataloader.batch_size,
+        sampler=indices,
+        num_workers=dataloader.num_workers,
+        pin_memory=dataloader.pin_memory,
+    )
+
+
+def session_errors(errors_df):
+    """
+    Aggregates the reconstruction errors of the inputs of each session.
+
+    Args:
+        errors_df: (DataFrame) reconstruction error of each input (output of evaluate_ae).
+    Returns:
+        (DataFrame) mean, maximum and number of inputs of each session.
+    """
+    return (
+        errors_df.groupby(["participant_id", "session_id"])["reconstruction_error"]
+        .agg(["mean", "max", "count"])
+        .rename(
+            columns={
+                "mean": "reconstruction_error",
+                "max": "max_reconstruction_error",
+                "count": "n_inputs",
+            }
+        )
+        .reset_index()
+    )
+
+
+def reconstruction_summary(errors_df, quantiles=(0.05, 0.25, 0.5, 0.75, 0.95)):
+    """
+    Summarizes the reconstruction errors of a dataset.
+
+    Args:
+        errors_df: (DataFrame) reconstruction error of each input (output of evaluate_ae).
+        quantiles: (tuple) quantiles of the errors of the sessions.
+    Returns:
+        (dict) mean error of the inputs and quantiles of the mean errors of the sessions.
+    """
+    summary = {"mean": errors_df.reconstruction_error.mean()}
+    errors = session_errors(errors_df).reconstruction_error
+    for quantile in quantiles:
+        summary["q%i" % round(quantile * 100)] = errors.quantile(quantile)
+
+    return summary
+
+
+def log_reconstruction_summary(errors_df, name, logger):
+    summary = reconstruction_summary(errors_df)
+    logger.debug(
+        "%s reconstruction error: %s"
+        % (name, ", ".join("%s %f" % item for item in summary.items()))
+    )
+
+
+def reconstruction_errors_to_tsvs(decoder, loaders, output_dir, use_cuda, criterion):
+    """
+    Writes the reconstruction error of each session of several datasets, which can be
+    used to screen anomalous sessions.
+
+    Args:
+        decoder: (Autoencoder) Autoencoder constructed from a CNN with the Autoencoder class.
+        loaders: (dict) DataLoaders of the datasets, indexed by the name of the dataset.
+        output_dir: (str) folder in which <name>.tsv files are written.
+        use_cuda: (bool) if True a gpu is used.
+        criterion: (loss) function to calculate the loss.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    for name, loader in loaders.items():
+        # All the inputs are evaluated once, whatever the sampler used for training
+        ordered_loader = evaluation_loader(loader)
+        _, errors_df = evaluate_ae(decoder, ordered_loader, use_cuda, criterion)
+        session_errors(errors_df).to_csv(
+            os.path.join(output_dir, "%s.tsv" % name),
+            sep="\t",
+            index=False,
+        )
 
 
 def visualize_image(decoder, dataloader, visualization_path, nb_images=1):
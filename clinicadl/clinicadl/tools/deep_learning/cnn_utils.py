@@ -14,7 +14,9 @@ from sklearn.utils import column_or_1d
 from torch.nn.modules.loss import _Loss
 
 from clinicadl.tools.deep_learning import EarlyStopping, save_checkpoint
+from clinicadl.tools.deep_learning.columnar import find_table, read_table, write_table
 from clinicadl.tools.deep_learning.iotools import check_and_clean
+from clinicadl.tools.deep_learning.models.frozen import set_cache_batch
 
 #####################
 # CNN train / test  #
@@ -125,6 +127,7 @@ def train(
                 imgs, labels = data["image"].cuda(), data["label"].cuda()
             else:
                 imgs, labels = data["image"], data["label"]
+            set_cache_batch(model, data, train_loader.dataset)
 
             if hasattr(model, "variational") and model.variational:
                 z, mu, std, train_output = model(imgs)
@@ -437,6 +440,7 @@ def test(model, dataloader, use_cuda, criterion, mode="image", use_labels=True):
                 inputs, labels = data["image"].cuda(), data["label"].cuda()
             else:
                 inputs, labels = data["image"], data["label"]
+            set_cache_batch(model, data, dataloader.dataset)
 
             if hasattr(model, "variational") and model.variational:
                 z, mu, std, outputs = model(inputs)
@@ -519,9 +523,28 @@ def sort_predicted(
     batch_size=1,
     num_workers=0,
     gpu=False,
+    predictions_df=None,
 ):
-    from copy import copy
+    """
+    Keeps only the sessions correctly (or wrongly) classified by the model.
 
+    Args:
+        model: (Module) CNN used to classify the sessions.
+        data_df: (DataFrame) list of the sessions.
+        input_dir: (str) path to the CAPS.
+        model_options: (Namespace) options of the model.
+        criterion: (loss) function to calculate the loss.
+        keep_true: (bool) if True the sessions correctly classified are kept, else
+            the sessions wrongly classified. If None all the sessions are kept.
+        batch_size: (int) batch size of the DataLoader.
+        num_workers: (int) number of workers of the DataLoader.
+        gpu: (bool) if True a gpu is used.
+        predictions_df: (DataFrame) predictions already computed for the sessions
+            (columns participant_id, session_id, true_label and predicted_label).
+            If given the model is not run again.
+    Returns:
+        (DataFrame) the sessions kept, sorted by participant and session.
+    """
     from torch.utils.data import DataLoader
 
     from .data import get_transforms, return_dataset
@@ -529,38 +552,36 @@ def sort_predicted(
     if keep_true is None:
         return data_df
 
-    _, all_transforms = get_transforms(
-        model_options.mode, model_options.minmaxnormalization
-    )
-    dataset = return_dataset(
-        mode=model_options.mode,
-        input_dir=input_dir,
-        data_df=data_df,
-        preprocessing=model_options.preprocessing,
-        train_transformations=None,
-        all_transformations=all_transforms,
-        params=model_options,
-    )
-    dataloader = DataLoader(
-        dataset,
-        batch_size=batch_size,
-        shuffle=False,
-        num_workers=num_workers,
-        pin_memory=True,
-    )
-
-    test_options = copy(model_options)
-    test_options.gpu = gpu
+    if predictions_df is None:
+        _, all_transforms = get_transforms(
+            model_options.mode, model_options.minmaxnormalization
+        )
+        dataset = return_dataset(
+            mode=model_options.mode,
+            input_dir=input_dir,
+            data_df=data_df,
+            preprocessing=model_options.preprocessing,
+            train_transformations=None,
+            all_transformations=all_transforms,
+            params=model_options,
+        )
+        dataloader = DataLoader(
+            dataset,
+            batch_size=batch_size,
+            shuffle=False,
+            num_workers=num_workers,
+            pin_memory=True,
+        )
 
-    results_df, _ = test(
-        model, dataloader, gpu, criterion, model_options.mode, use_labels=True
-    )
+        predictions_df, _ = test(
+            model, dataloader, gpu, criterion, model_options.mode, use_labels=True
+        )
 
     sorted_df = data_df.sort_values(["participant_id", "session_id"]).reset_index(
         drop=True
     )
-    results_df = results_df.sort_values(["participant_id", "session_id"]).reset_index(
-        drop=True
+    results_df = sorted_df[["participant_id", "session_id"]].merge(
+        predictions_df, on=["participant_id", "session_id"], how="left"
     )
 
     if keep_true:
@@ -587,6 +608,7 @@ def mode_level_to_tsvs(
     mode,
     dataset="train",
     cnn_index=None,
+    file_format="tsv",
 ):
     """
     Writes the outputs of the test function in tsv files.
@@ -600,6 +622,8 @@ def mode_level_to_tsvs(
         mode: (str) input used by the network. Chosen from ['image', 'patch', 'roi', 'slice'].
         dataset: (str) the dataset on which the evaluation was performed.
         cnn_index: (int) provide the cnn_index only for a multi-cnn framework.
+        file_format: (str) format of the prediction file, chosen in ['tsv', 'npz'].
+            Image-level predictions and metrics are always written in tsv files.
     """
     if cnn_index is None:
         performance_dir = os.path.join(
@@ -616,10 +640,10 @@ def mode_level_to_tsvs(
 
     os.makedirs(performance_dir, exist_ok=True)
 
-    results_df.to_csv(
-        os.path.join(performance_dir, "%s_%s_level_prediction.tsv" % (dataset, mode)),
-        index=False,
-        sep="\t",
+    write_table(
+        results_df,
+        os.path.join(performance_dir, "%s_%s_level_prediction" % (dataset, mode)),
+        file_format=file_format if mode != "image" else "tsv",
     )
 
     if metrics is not None:
@@ -651,19 +675,22 @@ def concat_multi_cnn_results(output_dir, fold, selection, mode, dataset, num_cnn
     """Concatenate the tsv files of a multi-CNN framework"""
     prediction_df = pd.DataFrame()
     metrics_df = pd.DataFrame()
+    file_format = "tsv"
     for cnn_index in range(num_cnn):
         cnn_dir = os.path.join(
             output_dir, "fold-%i" % fold, "cnn_classification", "cnn-%i" % cnn_index
         )
         performance_dir = os.path.join(cnn_dir, selection)
-        cnn_pred_path = os.path.join(
-            performance_dir, "%s_%s_level_prediction.tsv" % (dataset, mode)
+        cnn_pred_path = find_table(
+            os.path.join(performance_dir, "%s_%s_level_prediction" % (dataset, mode))
         )
         cnn_metrics_path = os.path.join(
             performance_dir, "%s_%s_level_metrics.tsv" % (dataset, mode)
         )
 
-        cnn_pred_df = pd.read_csv(cnn_pred_path, sep="\t")
+        # The concatenated file keeps the format of the files of each CNN
+        file_format = os.path.splitext(cnn_pred_path)[1][1:]
+        cnn_pred_df = read_table(cnn_pred_path)
         prediction_df = pd.concat([prediction_df, cnn_pred_df])
         os.remove(cnn_pred_path)
 
@@ -684,28 +711,33 @@ def concat_multi_cnn_results(output_dir, fold, selection, mode, dataset, num_cnn
     else:
         metrics_df.reset_index(drop=True, inplace=True)
     mode_level_to_tsvs(
-        output_dir, prediction_df, metrics_df, fold, selection, mode, dataset
+        output_dir,
+        prediction_df,
+        metrics_df,
+        fold,
+        selection,
+        mode,
+        dataset,
+        file_format=file_format,
     )
 
 
 def retrieve_sub_level_results(output_dir, fold, selection, mode, dataset, num_cnn):
     """Retrieve performance_df for single or multi-CNN framework.
     If the results of the multi-CNN were not concatenated it will be done here."""
-    result_tsv = os.path.join(
+    result_root = os.path.join(
         output_dir,
         "fold-%i" % fold,
         "cnn_classification",
         selection,
-        "%s_%s_level_prediction.tsv" % (dataset, mode),
+        "%s_%s_level_prediction" % (dataset, mode),
     )
-    if os.path.exists(result_tsv):
-        performance_df = pd.read_csv(result_tsv, sep="\t")
-
-    else:
+    result_path = find_table(result_root)
+    if result_path is None:
         concat_multi_cnn_results(output_dir, fold, selection, mode, dataset, num_cnn)
-        performance_df = pd.read_csv(result_tsv, sep="\t")
+        result_path = find_table(result_root)
 
-    return performance_df
+    return read_table(result_path)
 
 
 def soft_voting_to_tsvs(
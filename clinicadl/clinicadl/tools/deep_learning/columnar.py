@@ -0,0 +1,166 @@
+# coding: utf8
+
+"""
+Compact binary storage of DataFrames.
+
+Each column is stored as a typed NumPy array in an uncompressed npz archive.
+String columns (participant_id, session_id...) are stored as categorical codes
+and their categories, so that files can be read back without parsing text.
+"""
+
+import os
+
+import numpy as np
+import pandas as pd
+
+COLUMNS_KEY = "__columns__"
+CODES_SUFFIX = "__codes"
+CATEGORIES_SUFFIX = "__categories"
+FILE_FORMATS = {"tsv": ".tsv", "npz": ".npz"}
+
+
+def write_columnar(df, file_path):
+    """
+    Writes a DataFrame in the columnar npz format.
+
+    Args:
+        df: (DataFrame) table to write.
+        file_path: (str) path to the output file (.npz).
+    """
+    df = df.infer_objects()
+    arrays = {COLUMNS_KEY: np.array(df.columns.values, dtype=str)}
+    for column in df.columns.values:
+        values = df[column].values
+        if values.dtype == object:
+            categories, codes = np.unique(values.astype(str), return_inverse=True)
+            arrays[column + CATEGORIES_SUFFIX] = categories
+            arrays[column + CODES_SUFFIX] = codes.astype(np.int32)
+        else:
+            arrays[column] = values
+
+    with open(file_path, "wb") as f:
+        np.savez(f, **arrays)
+
+
+def read_columnar(file_path):
+    """
+    Reads a DataFrame written by write_columnar.
+
+    Args:
+        file_path: (str) path to the npz file.
+    Returns:
+        (DataFrame) the table stored.
+    """
+    with np.load(file_path) as arrays:
+        data = dict()
+        for column in arrays[COLUMNS_KEY]:
+            if column + CODES_SUFFIX in arrays.files:
+                categories = arrays[column + CATEGORIES_SUFFIX].astype(object)
+                data[column] = categories[arrays[column + CODES_SUFFIX]]
+            else:
+                data[column] = arrays[column]
+
+    return pd.DataFrame(data, columns=list(data.keys()))
+
+
+def columnar_to_tsv(file_path, tsv_path=None):
+    """
+    Exports a columnar file to TSV.
+
+    Args:
+        file_path: (str) path to the npz file.
+        tsv_path: (str) path to the TSV file. Default replaces the extension of file_path.
+    Returns:
+        (str) path to the TSV file written.
+    """
+    if tsv_path is None:
+        tsv_path = os.path.splitext(file_path)[0] + ".tsv"
+    read_columnar(file_path).to_csv(tsv_path, index=False, sep="\t")
+
+    return tsv_path
+
+
+def is_columnar(file_path):
+    """Returns True if file_path is a npz file written by write_columnar."""
+    if not file_path.endswith(FILE_FORMATS["npz"]):
+        return False
+    try:
+        with np.load(file_path) as arrays:
+            return COLUMNS_KEY in arrays.files
+    except (OSError, ValueError):
+        return False
+
+
+def find_columnar(input_path):
+    """
+    Finds the columnar files at a path.
+
+    Args:
+        input_path: (str) path to a columnar file, or to a folder searched recursively.
+    Returns:
+        (list of str) paths to the columnar files found.
+    """
+    if not os.path.isdir(input_path):
+        return [input_path] if is_columnar(input_path) else []
+
+    file_paths = list()
+    for root, _, filenames in os.walk(input_path):
+        for filename in sorted(filenames):
+            file_path = os.path.join(root, filename)
+            if is_columnar(file_path):
+                file_paths.append(file_path)
+
+    return sorted(file_paths)
+
+
+def find_table(file_root):
+    """
+    Finds the file storing a table whatever its format.
+
+    Args:
+        file_root: (str) path to the file without extension.
+    Returns:
+        (str) path to the existing file, None if no file exists.
+    """
+    for extension in [FILE_FORMATS["npz"], FILE_FORMATS["tsv"]]:
+        if os.path.exists(file_root + extension):
+            return file_root + extension
+
+    return None
+
+
+def read_table(file_path):
+    """Reads a table stored as TSV or columnar npz according to its extension."""
+    if file_path.endswith(FILE_FORMATS["npz"]):
+        return read_columnar(file_path)
+    return pd.read_csv(file_path, sep="\t")
+
+
+def write_table(df, file_root, file_format="tsv"):
+    """
+    Writes a table in the wanted format.
+
+    Args:
+        df: (DataFrame) table to write.
+        file_root: (str) path to the file without extension.
+        file_format: (str) format chosen in ['tsv', 'npz'].
+    Returns:
+        (str) path to the file written.
+    """
+    if file_format not in FILE_FORMATS:
+        raise ValueError(
+            "File format %s is not implemented. Please choose in %s."
+            % (file_format, list(FILE_FORMATS.keys()))
+        )
+    # Remove the files of other formats so that readers cannot find outdated results
+    for extension in FILE_FORMATS.values():
+        if os.path.exists(file_root + extension):
+            os.remove(file_root + extension)
+
+    file_path = file_root + FILE_FORMATS[file_format]
+    if file_format == "npz":
+        write_columnar(df, file_path)
+    else:
+        df.to_csv(file_path, index=False, sep="\t")
+
+    return file_path
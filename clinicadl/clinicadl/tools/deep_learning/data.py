@@ -11,7 +11,12 @@ import torch
 import torchvision.transforms as transforms
 from torch.utils.data import Dataset, sampler
 
-from clinicadl.tools.inputs.filename_types import FILENAME_TYPE, MASK_PATTERN
+from clinicadl.tools.inputs.filename_types import (
+    FILENAME_TYPE,
+    MASK_PATTERN,
+    SHEPPLOGAN_PACKED_FILENAME,
+    SHEPPLOGAN_PACKED_INDEX,
+)
 
 #################################
 # Datasets loaders
@@ -21,6 +26,16 @@ from clinicadl.tools.inputs.filename_types import FILENAME_TYPE, MASK_PATTERN
 class MRIDataset(Dataset):
     """Abstract class for all derived MRIDatasets."""
 
+    diagnosis_code = {
+        "CN": 0,
+        "BV": 1,
+        "AD": 1,
+        "sMCI": 0,
+        "pMCI": 1,
+        "MCI": 1,
+        "unlabeled": -1,
+    }
+
     def __init__(
         self,
         caps_directory,
@@ -39,15 +54,6 @@ class MRIDataset(Dataset):
         self.augmentation_transformations = augmentation_transformations
         self.eval_mode = False
         self.labels = labels
-        self.diagnosis_code = {
-            "CN": 0,
-            "BV": 1,
-            "AD": 1,
-            "sMCI": 0,
-            "pMCI": 1,
-            "MCI": 1,
-            "unlabeled": -1,
-        }
         self.preprocessing = preprocessing
 
         if not hasattr(self, "elem_index"):
@@ -386,6 +392,8 @@ class MRIDatasetImage(MRIDataset):
         """
         self.elem_index = None
         self.mode = "image"
+        # Packed Shepp-Logan images, by path of the packed file, loaded on first access
+        self.packed_images = dict()
         super().__init__(
             caps_directory,
             data_file,
@@ -402,7 +410,13 @@ class MRIDatasetImage(MRIDataset):
         participant, session, cohort, _, label = self._get_meta_data(idx)
 
         image_path = self._get_path(participant, session, cohort, "image")
-        image = torch.load(image_path)
+        if self.preprocessing == "shepplogan" and not path.exists(image_path):
+            image_path = path.join(
+                self.caps_dict[cohort], "subjects", SHEPPLOGAN_PACKED_FILENAME
+            )
+            image = self._get_packed_image(image_path, participant, session)
+        else:
+            image = torch.load(image_path)
 
         if self.transformations:
             image = self.transformations(image)
@@ -415,6 +429,7 @@ class MRIDatasetImage(MRIDataset):
             "label": label,
             "participant_id": participant,
             "session_id": session,
+            "cohort": cohort,
             "image_path": image_path,
         }
 
@@ -425,6 +440,35 @@ class MRIDatasetImage(MRIDataset):
 
         return sample
 
+    def _get_packed_image(self, packed_path, participant, session):
+        """
+        Reads an image in an array file containing all the images of a dataset.
+
+        The array is memory-mapped, so that only the images read are loaded and the
+        pages are shared by the workers of the DataLoader.
+        """
+        if packed_path not in self.packed_images:
+            index_df = pd.read_csv(
+                path.join(path.dirname(packed_path), SHEPPLOGAN_PACKED_INDEX), sep="\t"
+            )
+            index = {
+                key: i
+                for i, key in enumerate(
+                    zip(index_df.participant_id.values, index_df.session_id.values)
+                )
+            }
+            images = np.load(packed_path, mmap_mode="r")
+            self.packed_images[packed_path] = (index, images)
+
+        index, images = self.packed_images[packed_path]
+        return torch.from_numpy(np.array(images[index[(participant, session)]]))
+
+    def __getstate__(self):
+        # Memory maps are opened again by each worker instead of being copied
+        state = self.__dict__.copy()
+        state["packed_images"] = dict()
+        return state
+
     def num_elem_per_image(self):
         return 1
 
@@ -517,6 +561,7 @@ class MRIDatasetPatch(MRIDataset):
             "label": label,
             "participant_id": participant,
             "session_id": session,
+            "cohort": cohort,
             "patch_id": patch_idx,
         }
 
@@ -533,17 +578,7 @@ class MRIDatasetPatch(MRIDataset):
 
         image = self._get_full_image()
 
-        patches_tensor = (
-            image.unfold(1, self.patch_size, self.stride_size)
-            .unfold(2, self.patch_size, self.stride_size)
-            .unfold(3, self.patch_size, self.stride_size)
-            .contiguous()
-        )
-        patches_tensor = patches_tensor.view(
-            -1, self.patch_size, self.patch_size, self.patch_size
-        )
-        num_patches = patches_tensor.shape[0]
-        return num_patches
+        return len(patch_corners(image.shape[1:], self.patch_size, self.stride_size))
 
     def extract_patch_from_mri(self, image_tensor, index_patch):
 
@@ -561,6 +596,27 @@ class MRIDatasetPatch(MRIDataset):
         return extracted_patch
 
 
+def patch_corners(image_shape, patch_size, stride_size):
+    """
+    Computes the position of the patches extracted from an image.
+
+    Patches are ordered as the patches extracted by MRIDatasetPatch, so that the
+    i-th corner is the one of the patch of index i.
+
+    Args:
+        image_shape: (tuple) spatial dimensions of the image.
+        patch_size: (int) size of the regular patch.
+        stride_size: (int) length between the corners of two patches.
+    Returns:
+        (list of tuples) first voxel of each patch.
+    """
+    from itertools import product
+
+    return list(
+        product(*[range(0, dim - patch_size + 1, stride_size) for dim in image_shape])
+    )
+
+
 class MRIDatasetRoi(MRIDataset):
     def __init__(
         self,
@@ -649,6 +705,7 @@ class MRIDatasetRoi(MRIDataset):
             "label": label,
             "participant_id": participant,
             "session_id": session,
+            "cohort": cohort,
             "roi_id": roi_idx,
         }
 
@@ -912,6 +969,7 @@ class MRIDatasetSlice(MRIDataset):
             "label": label,
             "participant_id": participant,
             "session_id": session,
+            "cohort": cohort,
             "slice_id": slice_idx,
         }
 
@@ -951,6 +1009,61 @@ class MRIDatasetSlice(MRIDataset):
         return triple_slice
 
 
+class LatentDataset(Dataset):
+    """Dataset of the latent representations written by clinicadl encode."""
+
+    def __init__(self, latent_dir, in_memory=False):
+        """
+        Args:
+            latent_dir (string): Folder containing latents.npy and latents.tsv.
+            in_memory (bool): If True the whole array is loaded in memory,
+                else it is read from the memory-mapped file.
+        """
+        self.df = pd.read_csv(path.join(latent_dir, "latents.tsv"), sep="\t")
+        self.latents = np.load(
+            path.join(latent_dir, "latents.npy"), mmap_mode=None if in_memory else "r"
+        )
+        if len(self.latents) != len(self.df):
+            raise ValueError(
+                "The number of latents %i does not correspond to the number of rows "
+                "of the index %i." % (len(self.latents), len(self.df))
+            )
+        elem_columns = [
+            column
+            for column in ["patch_id", "roi_id", "slice_id"]
+            if column in self.df.columns
+        ]
+        self.mode = elem_columns[0].split("_")[0] if elem_columns else "image"
+        self.labels = "label" in self.df.columns
+        self.augmentation_transformations = None
+        self.eval_mode = False
+        self.size = self[0]["image"].size()
+
+    def __len__(self):
+        return len(self.df)
+
+    def __getitem__(self, idx):
+        row = self.df.loc[idx]
+        sample = {
+            "image": torch.from_numpy(np.array(self.latents[row.latent_index])),
+            "label": int(row.label) if self.labels else -1,
+            "participant_id": row.participant_id,
+            "session_id": row.session_id,
+        }
+        if self.mode != "image":
+            sample["%s_id" % self.mode] = int(row["%s_id" % self.mode])
+
+        return sample
+
+    def eval(self):
+        self.eval_mode = True
+        return self
+
+    def train(self):
+        self.eval_mode = False
+        return self
+
+
 def return_dataset(
     mode,
     input_dir,
@@ -262,6 +262,24 @@ def read_json(options=None, json_path=None, test=False, read_computational=False
     if not hasattr(options, "atlas_weight"):
         options.atlas_weight = 1
 
+    if not hasattr(options, "prediction_format"):
+        options.prediction_format = "tsv"
+
+    if not hasattr(options, "fix_first_layers"):
+        options.fix_first_layers = 0
+
+    if not hasattr(options, "frozen_cache"):
+        options.frozen_cache = None
+
+    if not hasattr(options, "frozen_cache_size"):
+        options.frozen_cache_size = 1000
+
+    if not hasattr(options, "unpooling"):
+        options.unpooling = "indices"
+
+    if not hasattr(options, "train_evaluation_size"):
+        options.train_evaluation_size = 0
+
     if hasattr(options, "n_splits") and options.n_splits is None:
         options.n_splits = 0
 
@@ -295,6 +313,9 @@ def check_and_complete(options, random_search=False):
         "dropout": 0,
         "epochs": 20,
         "evaluation_steps": 0,
+        "fix_first_layers": 0,
+        "frozen_cache": None,
+        "frozen_cache_size": 1000,
         "learning_rate": 4,
         "loss": "default",
         "merged_tsv_path": None,
@@ -305,10 +326,13 @@ def check_and_complete(options, random_search=False):
         "unnormalize": False,
         "patience": 0,
         "predict_atlas_intensities": None,
+        "prediction_format": "tsv",
         "split": None,
         "tolerance": 0.0,
+        "train_evaluation_size": 0,
         "transfer_learning_path": None,
         "transfer_learning_selection": "best_loss",
+        "unpooling": "indices",
         "use_cpu": False,
         "wd_bool": True,
         "weight_decay": 4,
@@ -340,6 +364,10 @@ def check_and_complete(options, random_search=False):
         default_values["network_normalization"] = "BatchNorm"
         default_values["channels_limit"] = 512
         default_values["n_conv"] = 1
+        default_values["input_shape"] = None
+        default_values["memory_budget"] = None
+        default_values["flops_budget"] = None
+        default_values["max_resampling"] = 100
 
     set_default(options, default_values)
 
@@ -1,6 +1,12 @@
 from .autoencoder import AutoEncoder, initialize_other_autoencoder, transfer_learning
 from .image_level import Conv5_FC3, Conv5_FC3_down, Conv5_FC3_mni, Conv6_FC3, VConv5_FC3
-from .iotools import load_model, load_optimizer, save_checkpoint
+from .iotools import (
+    export_model,
+    load_exported_model,
+    load_model,
+    load_optimizer,
+    save_checkpoint,
+)
 from .patch_level import Conv4_FC3
 from .random import RandomArchitecture
 from .slice_level import ConvNet, resnet18
@@ -18,7 +24,28 @@ def create_model(options, initial_shape, len_atlas=0):
     Returns:
         (Module) the model object
     """
+    model = build_model(options, initial_shape, len_atlas=len_atlas)
 
+    if options.gpu:
+        model.cuda()
+    else:
+        model.cpu()
+
+    return model
+
+
+def build_model(options, initial_shape, len_atlas=0):
+    """
+    Builds the model object from the model_name without moving it to a device.
+
+    Args:
+        options: (Namespace) arguments needed to create the model.
+        initial_shape: (array-like) shape of the input data.
+        len_atlas: (int) length of the atlas in case of double prediction
+
+    Returns:
+        (Module) the model object
+    """
     if not hasattr(options, "model"):
         model = RandomArchitecture(
             options.convolutions,
@@ -38,11 +65,6 @@ def create_model(options, initial_shape, len_atlas=0):
                 "The model wanted %s has not been implemented." % options.model
             )
 
-    if options.gpu:
-        model.cuda()
-    else:
-        model.cpu()
-
     return model
 
 
@@ -59,7 +81,7 @@ def create_autoencoder(options, initial_shape, difference=0):
     from .autoencoder import AutoEncoder, initialize_other_autoencoder
 
     model = create_model(options, initial_shape)
-    decoder = AutoEncoder(model)
+    decoder = AutoEncoder(model, unpooling=getattr(options, "unpooling", "indices"))
 
     if options.transfer_learning_path is not None:
         if path.splitext(options.transfer_learning_path) != ".pth.tar":
@@ -77,6 +99,6 @@ def init_model(options, initial_shape, autoencoder=False, len_atlas=0):
 
     model = create_model(options, initial_shape, len_atlas=len_atlas)
     if autoencoder:
-        model = AutoEncoder(model)
+        model = AutoEncoder(model, unpooling=getattr(options, "unpooling", "indices"))
 
     return model
@@ -8,35 +8,54 @@ from torch import nn
 from .modules import (
     CropMaxUnpool2d,
     CropMaxUnpool3d,
+    CropUpsample3d,
     Flatten,
     PadMaxPool2d,
     PadMaxPool3d,
     Reshape,
+    compress_indices,
+    expand_offsets,
 )
 
+UNPOOLING_MODES = ["indices", "compact", "upsampling"]
+
 
 class AutoEncoder(nn.Module):
-    def __init__(self, model=None):
+    def __init__(self, model=None, unpooling="indices"):
         """
         Construct an autoencoder from a given CNN. The encoder part corresponds to the convolutional part of the CNN.
 
         :param model: (Module) a CNN. The convolutional part must be comprised in a 'features' class variable.
+        :param unpooling: (str) how the decoder inverts the max pooling layers of the encoder:
+            - "indices": the int64 indices of the maxima are kept until the unpooling,
+            - "compact": the positions of the maxima in their pooling window are kept on 8 bits.
+              This only saves memory when no autograd graph is built (evaluation, encoding):
+              during training the pooling keeps its int64 indices for the backward pass,
+            - "upsampling": a learned upsampling is used and no index is kept.
         """
         from copy import deepcopy
 
         super(AutoEncoder, self).__init__()
 
+        if unpooling not in UNPOOLING_MODES:
+            raise ValueError(
+                "Unpooling mode %s is not implemented. Please choose in %s."
+                % (unpooling, UNPOOLING_MODES)
+            )
+
         self.level = 0
+        self.unpooling = unpooling
 
         if model is not None:
             self.encoder = deepcopy(model.features)
             self.decoder = self.construct_inv_layers(model)
 
+            return_indices = unpooling != "upsampling"
             for i, layer in enumerate(self.encoder):
                 if isinstance(layer, PadMaxPool3d):
-                    self.encoder[i].set_new_return()
+                    self.encoder[i].set_new_return(return_indices=return_indices)
                 elif isinstance(layer, nn.MaxPool3d):
-                    self.encoder[i].return_indices = True
+                    self.encoder[i].return_indices = return_indices
         else:
             self.encoder = nn.Sequential()
             self.decoder = nn.Sequential()
@@ -49,26 +68,64 @@ class AutoEncoder(nn.Module):
         indices_list = []
         pad_list = []
         for layer in self.encoder:
-            if isinstance(layer, PadMaxPool3d):
+            if isinstance(layer, PadMaxPool3d) and self.unpooling == "upsampling":
+                x, pad = layer(x)
+                pad_list.append(pad)
+            elif isinstance(layer, PadMaxPool3d):
+                input_shape = x.shape[2:]
                 x, indices, pad = layer(x)
-                indices_list.append(indices)
+                # Shape of the padded input of the pooling
+                input_shape = tuple(
+                    size + coord for size, coord in zip(input_shape, pad[-2::-2])
+                )
+                indices_list.append(self._keep_indices(indices, input_shape, layer))
                 pad_list.append(pad)
-            elif isinstance(layer, nn.MaxPool3d):
+            elif isinstance(layer, nn.MaxPool3d) and layer.return_indices:
+                input_shape = x.shape[2:]
                 x, indices = layer(x)
-                indices_list.append(indices)
+                indices_list.append(self._keep_indices(indices, input_shape, layer))
             else:
                 x = layer(x)
 
         for layer in self.decoder:
-            if isinstance(layer, CropMaxUnpool3d):
-                x = layer(x, indices_list.pop(), pad_list.pop())
+            if isinstance(layer, CropUpsample3d):
+                x = layer(x, pad_list.pop())
+            elif isinstance(layer, CropMaxUnpool3d):
+                x = layer(x, self._restore_indices(indices_list.pop()), pad_list.pop())
             elif isinstance(layer, nn.MaxUnpool3d):
-                x = layer(x, indices_list.pop())
+                x = layer(x, self._restore_indices(indices_list.pop()))
             else:
                 x = layer(x)
 
         return x
 
+    def encode(self, x):
+        """
+        Computes the latent representation of x without keeping any unpooling information.
+
+        :param x: (Tensor) batch of inputs.
+        :return: (Tensor) outputs of the encoder.
+        """
+        for layer in self.encoder:
+            x = layer(x)
+            if isinstance(x, tuple):
+                x = x[0]
+
+        return x
+
+    def _keep_indices(self, indices, input_shape, layer):
+        if self.unpooling == "compact":
+            offsets = compress_indices(
+                indices, input_shape, layer.kernel_size, layer.stride
+            )
+            return offsets, input_shape, layer.kernel_size, layer.stride
+        return indices
+
+    def _restore_indices(self, kept_indices):
+        if self.unpooling == "compact":
+            return expand_offsets(*kept_indices)
+        return kept_indices
+
     def construct_inv_layers(self, model):
         """
         Implements the decoder part from the CNN. The decoder part is the symmetrical list of the encoder
@@ -79,8 +136,10 @@ class AutoEncoder(nn.Module):
         :return: (Module) decoder part of the Autoencoder
         """
         inv_layers = []
+        n_channels = None
         for i, layer in enumerate(self.encoder):
             if isinstance(layer, nn.Conv3d):
+                n_channels = layer.out_channels
                 inv_layers.append(
                     nn.ConvTranspose3d(
                         layer.out_channels,
@@ -91,6 +150,14 @@ class AutoEncoder(nn.Module):
                     )
                 )
                 self.level += 1
+            elif isinstance(layer, PadMaxPool3d) and self.unpooling == "upsampling":
+                if n_channels is None:
+                    raise ValueError(
+                        "The learned upsampling needs a convolution before each pooling."
+                    )
+                inv_layers.append(
+                    CropUpsample3d(n_channels, layer.kernel_size, stride=layer.stride)
+                )
             elif isinstance(layer, PadMaxPool3d):
                 inv_layers.append(
                     CropMaxUnpool3d(layer.kernel_size, stride=layer.stride)
@@ -179,7 +246,12 @@ def transfer_learning(
         source_commandline = translate_parameters(source_commandline)
         if source_commandline.mode_task == "autoencoder":
             logger.info("A pretrained autoencoder is loaded at path %s" % source_path)
-            model = transfer_autoencoder_weights(model, source_path, split)
+            model = transfer_autoencoder_weights(
+                model,
+                source_path,
+                split,
+                unpooling=getattr(source_commandline, "unpooling", "indices"),
+            )
 
         else:
             logger.info("A pretrained CNN is loaded at path %s" % source_path)
@@ -198,7 +270,7 @@ def transfer_learning(
     return model
 
 
-def transfer_autoencoder_weights(model, source_path, split):
+def transfer_autoencoder_weights(model, source_path, split, unpooling="indices"):
     """
     Set the weights of the model according to the autoencoder at source path.
     The encoder part of the autoencoder must exactly correspond to the convolutional part of the model.
@@ -206,13 +278,20 @@ def transfer_autoencoder_weights(model, source_path, split):
     :param model: (Module) the model which must be initialized
     :param source_path: (str) path to the source task experiment
     :param split: (int) split number to load
+    :param unpooling: (str) unpooling mode of the source autoencoder.
     :return: (str) path to the written weights ready to be loaded
     """
     import os
     from copy import deepcopy
 
     if not isinstance(model, AutoEncoder):
-        decoder = AutoEncoder(model)
+        decoder = AutoEncoder(model, unpooling=unpooling)
+    elif model.unpooling != unpooling:
+        raise ValueError(
+            "The source autoencoder uses the unpooling mode %s whereas the target "
+            "autoencoder uses %s. Please train the target with --unpooling %s."
+            % (unpooling, model.unpooling, unpooling)
+        )
     else:
         decoder = model
 
@@ -0,0 +1,393 @@
+# coding: utf8
+
+"""
+Static estimation of the memory and of the computations needed to train a network.
+
+When torch allows it (torch >= 2.0), the network is built on the meta device: no
+memory is allocated for its parameters and the forward pass of an empty input only
+computes the shapes of the activations. Otherwise the costs of the networks sampled
+by the random search are computed from their description, and other networks are
+built and run on CPU.
+"""
+
+import warnings
+
+import numpy as np
+import torch
+from torch import nn
+
+from .modules import CropUpsample3d, Flatten, Reshape
+
+# Number of tensors of the size of the parameters kept by each optimizer
+OPTIMIZER_STATES = {
+    "Adadelta": 2,
+    "Adagrad": 1,
+    "Adam": 2,
+    "AdamW": 2,
+    "Adamax": 2,
+    "RMSprop": 1,
+    "SGD": 0,
+}
+# The backward pass computes the gradients of both the inputs and the weights
+BACKWARD_FLOPS_RATIO = 2
+# Modules returning a view of their input
+VIEW_MODULES = (Flatten, Reshape, nn.Flatten, nn.Identity)
+
+
+def _prod(values):
+    result = 1
+    for value in values:
+        result *= value
+    return result
+
+
+def _tensors(output):
+    if isinstance(output, torch.Tensor):
+        return [output]
+    elif isinstance(output, (tuple, list)):
+        return [tensor for tensor in output if isinstance(tensor, torch.Tensor)]
+    return []
+
+
+def _kernel_size(module, dimension):
+    kernel_size = module.kernel_size
+    if isinstance(kernel_size, int):
+        return (kernel_size,) * dimension
+    return tuple(kernel_size)
+
+
+def layer_flops(module, inputs, outputs):
+    """
+    Counts the floating point operations of the forward pass of a leaf module.
+
+    Multiply-accumulate operations count for two operations. Normalization layers,
+    activations and other element-wise operations are approximated.
+
+    Args:
+        module: (Module) leaf module.
+        inputs: (list) input tensors of the module.
+        outputs: (list) output tensors of the module.
+    Returns:
+        (int) number of operations.
+    """
+    if len(inputs) == 0 or len(outputs) == 0:
+        return 0
+    input_numel = inputs[0].numel()
+    output_numel = outputs[0].numel()
+
+    if isinstance(module, nn.modules.conv._ConvNd):
+        kernel_volume = _prod(module.kernel_size)
+        if module.transposed:
+            return (
+                2 * input_numel * module.out_channels // module.groups * kernel_volume
+            )
+        return 2 * output_numel * module.in_channels // module.groups * kernel_volume
+    elif isinstance(module, CropUpsample3d):
+        return 2 * input_numel * module.weight.shape[1] * _prod(module.kernel_size)
+    elif isinstance(module, nn.Linear):
+        return 2 * output_numel * module.in_features
+    elif isinstance(
+        module,
+        (nn.modules.batchnorm._BatchNorm, nn.modules.instancenorm._InstanceNorm),
+    ):
+        return 4 * output_numel
+    elif isinstance(
+        module, (nn.modules.pooling._MaxPoolNd, nn.modules.pooling._AvgPoolNd)
+    ):
+        dimension = outputs[0].dim() - 2
+        return output_numel * _prod(_kernel_size(module, dimension))
+    elif isinstance(module, VIEW_MODULES):
+        return 0
+    return output_numel
+
+
+def meta_available():
+    """Returns True if modules can be built on the meta device (torch >= 2.0)."""
+    return hasattr(torch.device("meta"), "__enter__")
+
+
+def build_on_meta(builder, *args, **kwargs):
+    """
+    Calls builder on the meta device if the version of torch allows it.
+
+    Args:
+        builder: (callable) function returning a Module.
+    Returns:
+        (Module) the output of builder, without memory allocated for its parameters
+            if the meta device was used.
+    """
+    if not meta_available():
+        warnings.warn(
+            "The meta device needs torch >= 2.0: the network is built and run on "
+            "CPU to estimate its complexity."
+        )
+        return builder(*args, **kwargs)
+
+    with torch.device("meta"):
+        return builder(*args, **kwargs)
+
+
+def estimate_complexity(model, initial_shape, batch_size=1, optimizer="Adam"):
+    """
+    Estimates the memory and the computations needed to train model.
+
+    The forward pass is run on one input (on the meta device if the model was built
+    with build_on_meta) and the costs are then scaled to the batch size. The memory
+    of the activations is the size of the outputs of all the leaf modules, which are
+    kept for the backward pass.
+
+    Args:
+        model: (Module) network.
+        initial_shape: (array-like) shape of one input, channel dimension included.
+        batch_size: (int) number of inputs in a batch.
+        optimizer: (str) name of the optimizer in torch.optim.
+    Returns:
+        (dict) with the following keys:
+            - n_parameters, n_trainable_parameters: (int) numbers of parameters,
+            - parameters_memory: (int) bytes of the parameters,
+            - activations_memory: (int) bytes of the activations of a batch,
+            - peak_training_memory: (int) bytes of the parameters, gradients,
+                optimizer states, input and activations of a batch,
+            - forward_flops, backward_flops: (int) operations for a batch.
+    """
+    parameters = list(model.parameters())
+    n_parameters = sum(parameter.numel() for parameter in parameters)
+    n_trainable_parameters = sum(
+        parameter.numel() for parameter in parameters if parameter.requires_grad
+    )
+    parameters_memory = sum(
+        parameter.numel() * parameter.element_size() for parameter in parameters
+    )
+    trainable_memory = sum(
+        parameter.numel() * parameter.element_size()
+        for parameter in parameters
+        if parameter.requires_grad
+    )
+    device = parameters[0].device if len(parameters) > 0 else torch.device("cpu")
+
+    counts = {"flops": 0, "activations_memory": 0}
+
+    def hook(module, inputs, output):
+        outputs = _tensors(output)
+        counts["flops"] += layer_flops(module, _tensors(inputs), outputs)
+        if not isinstance(module, VIEW_MODULES):
+            counts["activations_memory"] += sum(
+                tensor.numel() * tensor.element_size() for tensor in outputs
+            )
+
+    handles = [
+        module.register_forward_hook(hook)
+        for module in model.modules()
+        if len(list(module.children())) == 0
+    ]
+    training = model.training
+    # Evaluation mode gives the same shapes without updating the normalization stats
+    model.eval()
+    x = torch.zeros((1,) + tuple(int(size) for size in initial_shape), device=device)
+    try:
+        with torch.no_grad():
+            model(x)
+    finally:
+        for handle in handles:
+            handle.remove()
+        model.train(training)
+
+    return _complexity_dict(
+        n_parameters,
+        n_trainable_parameters,
+        parameters_memory,
+        trainable_memory,
+        x.numel() * x.element_size(),
+        counts["activations_memory"],
+        counts["flops"],
+        batch_size,
+        optimizer,
+    )
+
+
+def _complexity_dict(
+    n_parameters,
+    n_trainable_parameters,
+    parameters_memory,
+    trainable_memory,
+    input_memory,
+    activations_memory,
+    flops,
+    batch_size,
+    optimizer,
+):
+    """Scales the costs of one input to a batch and adds the optimizer states."""
+    input_memory = batch_size * input_memory
+    activations_memory = batch_size * activations_memory
+    forward_flops = batch_size * flops
+    n_states = OPTIMIZER_STATES.get(optimizer, 2)
+
+    return {
+        "n_parameters": n_parameters,
+        "n_trainable_parameters": n_trainable_parameters,
+        "parameters_memory": parameters_memory,
+        "activations_memory": activations_memory,
+        "peak_training_memory": parameters_memory
+        + (1 + n_states) * trainable_memory
+        + input_memory
+        + activations_memory,
+        "forward_flops": forward_flops,
+        "backward_flops": BACKWARD_FLOPS_RATIO * forward_flops,
+    }
+
+
+def estimate_random_complexity(options, initial_shape, n_classes=2):
+    """
+    Computes the costs of estimate_complexity for a RandomArchitecture classifier
+    from its description, without building it.
+
+    The layers are counted as the forward hooks of estimate_complexity count the
+    leaf modules of the network built by build_model, in float32.
+
+    Args:
+        options: (Namespace) options of the training (convolutions, n_fcblocks,
+            network_normalization, batch_size and optimizer).
+        initial_shape: (array-like) shape of one input, channel dimension included.
+        n_classes: (int) number of outputs of the network.
+    Returns:
+        (dict) see estimate_complexity.
+    """
+    from .random import RandomArchitecture
+
+    element_size = 4
+    counts = {"parameters": 0, "flops": 0, "activations": 0}
+    shape = [int(size) for size in initial_shape]
+    dimension = len(shape) - 1
+    kernel_volume = 3 ** dimension
+
+    def add_layer(output_shape, parameters, flops):
+        counts["parameters"] += parameters
+        counts["flops"] += flops
+        counts["activations"] += _prod(output_shape)
+
+    def add_conv(in_channels, out_channels, stride):
+        spatial = [(size - 1) // stride + 1 for size in shape[1:]]
+        shape[:] = [out_channels] + spatial
+        add_layer(
+            shape,
+            kernel_volume * in_channels * out_channels + out_channels,
+            2 * _prod(shape) * in_channels * kernel_volume,
+        )
+        if options.network_normalization == "BatchNorm":
+            add_layer(shape, 2 * out_channels, 4 * _prod(shape))
+        elif options.network_normalization == "InstanceNorm":
+            add_layer(shape, 0, 4 * _prod(shape))
+        # LeakyReLU
+        add_layer(shape, 0, _prod(shape))
+
+    for conv_dict in options.convolutions.values():
+        in_channels = conv_dict["in_channels"] or shape[0]
+        for _ in range(conv_dict["n_conv"] - 1):
+            add_conv(in_channels, in_channels, 1)
+        if conv_dict["d_reduction"] == "MaxPooling":
+            add_conv(in_channels, conv_dict["out_channels"], 1)
+            # Padding and pooling of PadMaxPoolNd
+            shape[1:] = [size + size % 2 for size in shape[1:]]
+            add_layer(shape, 0, _prod(shape))
+            shape[1:] = [size // 2 for size in shape[1:]]
+            add_layer(shape, 0, _prod(shape) * 2 ** dimension)
+        else:
+            add_conv(in_channels, conv_dict["out_channels"], 2)
+
+    # Dropout (Flatten only returns a view)
+    add_layer(shape, 0, _prod(shape))
+    fc, _ = RandomArchitecture.fc_dict_design(
+        options.n_fcblocks, options.convolutions, initial_shape, n_classes
+    )
+    for i, fc_dict in enumerate(fc.values()):
+        in_features, out_features = fc_dict["in_features"], fc_dict["out_features"]
+        add_layer(
+            [out_features],
+            in_features * out_features + out_features,
+            2 * out_features * in_features,
+        )
+        if i < len(fc) - 1:
+            # LeakyReLU
+            add_layer([out_features], 0, out_features)
+
+    parameters_memory = element_size * counts["parameters"]
+    return _complexity_dict(
+        counts["parameters"],
+        counts["parameters"],
+        parameters_memory,
+        parameters_memory,
+        element_size * int(np.prod(initial_shape)),
+        element_size * counts["activations"],
+        counts["flops"],
+        getattr(options, "batch_size", 1),
+        getattr(options, "optimizer", "Adam"),
+    )
+
+
+def estimate_options_complexity(options, initial_shape):
+    """
+    Estimates the training costs of the network described by options.
+
+    Without the meta device, the costs of random CNNs are computed from their
+    description, so that networks too large for the memory are never built.
+
+    Args:
+        options: (Namespace) options of the training (model or random architecture,
+            network_type, batch_size and optimizer).
+        initial_shape: (array-like) shape of one input, channel dimension included.
+    Returns:
+        (dict) see estimate_complexity.
+    """
+    from . import build_model
+    from .autoencoder import AutoEncoder
+
+    def builder():
+        model = build_model(options, initial_shape)
+        if getattr(options, "network_type", None) == "autoencoder":
+            model = AutoEncoder(
+                model, unpooling=getattr(options, "unpooling", "indices")
+            )
+        return model
+
+    batch_size = getattr(options, "batch_size", 1)
+    optimizer = getattr(options, "optimizer", "Adam")
+    if (
+        not meta_available()
+        and not hasattr(options, "model")
+        and getattr(options, "network_type", None) != "autoencoder"
+    ):
+        return estimate_random_complexity(options, initial_shape)
+    try:
+        return estimate_complexity(
+            build_on_meta(builder), initial_shape, batch_size, optimizer
+        )
+    except NotImplementedError:
+        # Some operations of the network are not implemented on the meta device
+        warnings.warn(
+            "The complexity of the network cannot be estimated on the meta device: "
+            "it is built and run on CPU."
+        )
+        return estimate_complexity(builder(), initial_shape, batch_size, optimizer)
+
+
+def fits_budget(complexity, memory_budget=None, flops_budget=None):
+    """
+    Checks that a network can be trained within the budgets.
+
+    Args:
+        complexity: (dict) output of estimate_complexity.
+        memory_budget: (float) maximum peak training memory in GB. None for no limit.
+        flops_budget: (float) maximum number of GFLOPs of one training step (forward
+            and backward passes) for one batch. None for no limit.
+    Returns:
+        (bool) True if the network fits in the budgets.
+    """
+    if (
+        memory_budget is not None
+        and complexity["peak_training_memory"] > memory_budget * 1e9
+    ):
+        return False
+    training_flops = complexity["forward_flops"] + complexity["backward_flops"]
+    if flops_budget is not None and training_flops > flops_budget * 1e9:
+        return False
+    return True
@@ -0,0 +1,344 @@
+# coding: utf8
+
+"""
+Cache of the activations of the frozen first layers of a CNN.
+
+When the first layers of the convolutional part of a network are frozen (after
+transfer learning for example), their outputs only depend on the input. They are
+computed once per input and stored in RAM or on disk, so that training only runs
+the trainable layers.
+"""
+
+import hashlib
+import os
+import shutil
+import types
+from collections import OrderedDict
+
+import torch
+from torch import nn
+
+
+class ActivationCache:
+    """
+    Least recently used store of the activations of the frozen layers.
+
+    Keys identify an input by its cohort, participant, session and element (patch,
+    roi or slice) index. Inputs modified by data augmentation are never cached.
+    """
+
+    def __init__(self, storage="ram", max_items=1000, cache_dir=None):
+        """
+        Args:
+            storage: (str) "ram" keeps the activations in memory, "disk" writes them
+                in cache_dir.
+            max_items: (int) maximum number of inputs cached. The least recently used
+                activations are evicted first.
+            cache_dir: (str) folder of the disk cache.
+        """
+        if storage not in ["ram", "disk"]:
+            raise ValueError(
+                "Storage %s is not implemented. Please choose in ['ram', 'disk']."
+                % storage
+            )
+        if storage == "disk" and cache_dir is None:
+            raise ValueError("A folder must be given to store the cache on disk.")
+        self.storage = storage
+        self.max_items = max_items
+        self.cache_dir = cache_dir
+        self.items = OrderedDict()
+        self.batch_keys = None
+        if storage == "disk":
+            os.makedirs(cache_dir, exist_ok=True)
+
+    def __deepcopy__(self, memo):
+        # Activations of frozen layers are shared by all the copies of a model
+        return self
+
+    def __len__(self):
+        return len(self.items)
+
+    def set_batch(self, data, dataset):
+        """
+        Gives the keys of the next batch given to the model.
+
+        Args:
+            data: (dict) batch given by the DataLoader.
+            dataset: (MRIDataset) dataset of the batch.
+        """
+        if dataset.augmentation_transformations and not dataset.eval_mode:
+            self.batch_keys = None
+            return
+
+        elem_ids = data.get("%s_id" % dataset.mode)
+        self.batch_keys = [
+            (
+                cohort,
+                participant_id,
+                session_id,
+                int(elem_ids[i]) if elem_ids is not None else 0,
+            )
+            for i, (cohort, participant_id, session_id) in enumerate(
+                zip(data["cohort"], data["participant_id"], data["session_id"])
+            )
+        ]
+
+    def pop_batch_keys(self):
+        batch_keys, self.batch_keys = self.batch_keys, None
+        return batch_keys
+
+    def get(self, key):
+        if key not in self.items:
+            return None
+        self.items.move_to_end(key)
+        if self.storage == "ram":
+            return self.items[key]
+        return torch.load(self.items[key])
+
+    def put(self, key, activation):
+        if self.max_items <= 0:
+            return
+        # Copy to avoid keeping the memory of the whole batch
+        activation = activation.detach().to("cpu", copy=True)
+        if self.storage == "ram":
+            self.items[key] = activation
+        else:
+            file_path = os.path.join(
+                self.cache_dir,
+                hashlib.sha1(repr(key).encode()).hexdigest() + ".pt",
+            )
+            torch.save(activation, file_path)
+            self.items[key] = file_path
+        self.items.move_to_end(key)
+
+        while len(self.items) > self.max_items:
+            _, evicted = self.items.popitem(last=False)
+            if self.storage == "disk":
+                os.remove(evicted)
+
+    def clear(self):
+        self.items = OrderedDict()
+        if self.storage == "disk" and os.path.exists(self.cache_dir):
+            shutil.rmtree(self.cache_dir)
+
+    def prefix_activations(self, keys, input_batch, prefix):
+        """
+        Computes the outputs of the frozen layers, using the cache when possible.
+
+        Args:
+            keys: (list) keys of the inputs of the batch. If None the cache is not used.
+            input_batch: (Tensor) batch of inputs.
+            prefix: (list of Module) frozen layers.
+        Returns:
+            (Tensor) outputs of the frozen layers.
+        """
+        if keys is None:
+            return self._run_prefix(input_batch, prefix)
+
+        activations = [self.get(key) for key in keys]
+        missing = [i for i, activation in enumerate(activations) if activation is None]
+
+        if len(missing) > 0:
+            output = self._run_prefix(input_batch[missing], prefix)
+            for j, i in enumerate(missing):
+                activations[i] = output[j]
+                self.put(keys[i], output[j])
+
+        return torch.stack(
+            [activation.to(input_batch.device) for activation in activations]
+        )
+
+    @staticmethod
+    def _run_prefix(input_batch, prefix):
+        training_modes = [layer.training for layer in prefix]
+        with torch.no_grad():
+            output = input_batch
+            for layer in prefix:
+                # Frozen layers are run in evaluation mode to be deterministic
+                layer.eval()
+                output = layer(output)
+        for layer, training in zip(prefix, training_modes):
+            layer.train(training)
+
+        return output
+
+
+def feature_blocks(model):
+    """
+    Splits the convolutional part of model in blocks.
+
+    If the children of model.features are Sequential (RandomArchitecture), each of
+    them is a block. Otherwise a block ends after each pooling layer, as in
+    Conv5_FC3 where a block is a convolution, a batch normalization, a ReLU and a
+    pooling layer.
+
+    Args:
+        model: (Module) CNN with a features attribute.
+    Returns:
+        (list of list of Module) layers of each block.
+    """
+    layers = list(model.features.children())
+    if all(isinstance(layer, nn.Sequential) for layer in layers):
+        return [[layer] for layer in layers]
+
+    blocks = [[]]
+    for layer in layers:
+        blocks[-1].append(layer)
+        if "pool" in type(layer).__name__.lower():
+            blocks.append([])
+    if len(blocks[-1]) == 0:
+        blocks.pop()
+
+    return blocks
+
+
+def fix_first_layers(model, n):
+    """
+    Freezes the parameters of the n first blocks of the convolutional part of model.
+
+    Models defining their own fix_first_layers method (RandomArchitecture) use it.
+
+    Args:
+        model: (Module) CNN with a features attribute.
+        n: (int) number of blocks of model.features frozen.
+    Returns:
+        (Module) the model.
+    """
+    if not hasattr(model, "features"):
+        raise ValueError(
+            "Layers can only be frozen in models with a 'features' attribute."
+        )
+    blocks = feature_blocks(model)
+    if n > len(blocks):
+        raise ValueError(
+            "The number of frozen blocks %i cannot exceed the number of blocks of "
+            "the convolutional part %i" % (n, len(blocks))
+        )
+    if hasattr(model, "fix_first_layers"):
+        return model.fix_first_layers(n)
+
+    for block in blocks[:n]:
+        for layer in block:
+            for parameter in layer.parameters():
+                parameter.requires_grad = False
+
+    return model
+
+
+def frozen_prefix_length(model):
+    """
+    Counts the first children of model.features which have no trainable parameter.
+
+    Args:
+        model: (Module) CNN with a features attribute.
+    Returns:
+        (int) number of layers of the frozen prefix.
+    """
+    n = 0
+    for layer in model.features.children():
+        if any(parameter.requires_grad for parameter in layer.parameters()):
+            break
+        n += 1
+
+    return n
+
+
+def _cached_forward(self, x):
+    keys = self.activation_cache.pop_batch_keys()
+    if keys is not None and len(keys) != len(x):
+        keys = None
+
+    layers = list(self.children())
+    prefix, suffix = (
+        layers[: self.frozen_prefix_length],
+        layers[self.frozen_prefix_length :],
+    )
+    x = self.activation_cache.prefix_activations(keys, x, prefix)
+    for layer in suffix:
+        x = layer(x)
+    return x
+
+
+def enable_activation_cache(model, cache, logger=None):
+    """
+    Makes model.features read the outputs of its frozen first blocks in cache.
+
+    The keys of each batch must be given to cache.set_batch before the forward pass,
+    else the frozen blocks are computed without using the cache. Frozen blocks are
+    always run in evaluation mode.
+
+    Args:
+        model: (Module) CNN with a features attribute.
+        cache: (ActivationCache) store of the activations.
+        logger: Logger instance.
+    Returns:
+        (Module) the model.
+    """
+    import logging
+
+    if logger is None:
+        logger = logging
+
+    if not hasattr(model, "features") or not isinstance(model.features, nn.Sequential):
+        raise ValueError(
+            "The activation cache needs the convolutional part of the model in a "
+            "'features' Sequential attribute."
+        )
+    n = frozen_prefix_length(model)
+    if n == 0:
+        logger.warning("No layer is frozen, the activation cache is not used.")
+        return model
+
+    logger.info("The outputs of the %i first frozen layers are cached." % n)
+    model.activation_cache = cache
+    model.features.activation_cache = cache
+    model.features.frozen_prefix_length = n
+    model.features.forward = types.MethodType(_cached_forward, model.features)
+
+    return model
+
+
+def disable_activation_cache(model):
+    """Restores the forward pass of model.features and clears the cache."""
+    if not hasattr(model, "activation_cache"):
+        return model
+
+    model.activation_cache.clear()
+    del model.features.forward
+    del model.features.activation_cache
+    del model.features.frozen_prefix_length
+    del model.activation_cache
+
+    return model
+
+
+def set_cache_batch(model, data, dataset):
+    """Gives the keys of a batch to the activation cache of model, if it has one."""
+    if hasattr(model, "activation_cache"):
+        model.activation_cache.set_batch(data, dataset)
+
+
+def prepare_frozen_layers(model, options, cache_dir, logger=None):
+    """
+    Freezes the first blocks of model and caches their outputs according to options.
+
+    Args:
+        model: (Module) CNN after transfer learning.
+        options: (Namespace) training options (fix_first_layers, frozen_cache and
+            frozen_cache_size).
+        cache_dir: (str) folder used if the cache is stored on disk.
+        logger: Logger instance.
+    Returns:
+        (Module) the model.
+    """
+    if getattr(options, "fix_first_layers", 0) > 0:
+        model = fix_first_layers(model, options.fix_first_layers)
+    if getattr(options, "frozen_cache", None) is not None:
+        cache = ActivationCache(
+            options.frozen_cache,
+            max_items=options.frozen_cache_size,
+            cache_dir=cache_dir,
+        )
+        model = enable_activation_cache(model, cache, logger=logger)
+
+    return model
@@ -4,6 +4,20 @@
 Script containing the iotools for model and optimizer serialization.
 """
 
+EXPORT_FILENAME = "model_best_torchscript.pt"
+EXPORT_METADATA = "metadata.json"
+
+
+def file_digest(file_path, chunk_size=1 << 20):
+    """Computes the SHA-256 digest of a file without loading it entirely."""
+    import hashlib
+
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
 
 def save_checkpoint(
     state,
@@ -88,3 +102,102 @@ def load_optimizer(optimizer_path, model):
     optimizer.load_state_dict(optimizer_dict["optimizer"])
 
     return optimizer
+
+
+def export_model(
+    model,
+    input_shape,
+    checkpoint_dir,
+    filename=EXPORT_FILENAME,
+    quantization=None,
+    checkpoint_filename="model_best.pth.tar",
+):
+    """
+    Writes a frozen TorchScript version of the model for CPU inference.
+
+    The model is traced in evaluation mode, then frozen: dropout layers are removed
+    and batch normalization layers are folded in the preceding convolutions.
+    The SHA-256 digest of the checkpoint is stored with the module, so that
+    load_exported_model can detect an export older than its checkpoint.
+
+    :param model: (Module) CNN with the weights to export.
+    :param input_shape: (array-like) shape of one input of the model (without batch dimension).
+    :param checkpoint_dir: (str) path to the folder in which the module is written.
+    :param filename: (str) name of the file containing the module.
+    :param quantization: (str) quantization applied to the model (stored with the module).
+    :param checkpoint_filename: (str) name of the checkpoint file from which the weights were loaded.
+    :return: (str) path to the written module.
+    """
+    import json
+    import os
+
+    import torch
+
+    model = model.cpu().eval()
+    example_input = torch.zeros((1, *input_shape))
+    with torch.no_grad():
+        traced_model = torch.jit.trace(model, example_input)
+    frozen_model = torch.jit.freeze(traced_model)
+    if quantization is None:
+        frozen_model = torch.jit.optimize_for_inference(frozen_model)
+
+    metadata = {
+        "input_shape": list(input_shape),
+        "variational": bool(getattr(model, "variational", False)),
+        "quantization": quantization,
+        "checkpoint_sha256": file_digest(
+            os.path.join(checkpoint_dir, checkpoint_filename)
+        ),
+    }
+    export_path = os.path.join(checkpoint_dir, filename)
+    torch.jit.save(
+        frozen_model, export_path, _extra_files={EXPORT_METADATA: json.dumps(metadata)}
+    )
+
+    return export_path
+
+
+def load_exported_model(
+    checkpoint_dir, filename=EXPORT_FILENAME, checkpoint_filename="model_best.pth.tar"
+):
+    """
+    Load a module written by export_model.
+
+    If the checkpoint was modified since the export (retrain or resume), or if the
+    module does not store the digest of its checkpoint, a warning is raised and
+    None is returned so that the caller falls back to load_model.
+
+    :param checkpoint_dir: (str) path to the folder containing the exported module.
+    :param filename: (str) name of the file containing the module.
+    :param checkpoint_filename: (str) name of the checkpoint file the module was exported from.
+    :return: (ScriptModule) the frozen model, (tuple) the input shape of the model.
+        Both are None if the module does not match the checkpoint.
+    """
+    import json
+    import os
+    import warnings
+
+    import torch
+
+    extra_files = {EXPORT_METADATA: ""}
+    model = torch.jit.load(
+        os.path.join(checkpoint_dir, filename),
+        map_location="cpu",
+        _extra_files=extra_files,
+    )
+    metadata = json.loads(extra_files[EXPORT_METADATA])
+    checkpoint_path = os.path.join(checkpoint_dir, checkpoint_filename)
+    if metadata.get("checkpoint_sha256") != file_digest(checkpoint_path):
+        warnings.warn(
+            "The module %s was not exported from the current checkpoint %s: "
+            "the checkpoint is loaded instead. Run clinicadl export again to "
+            "update the module."
+            % (os.path.join(checkpoint_dir, filename), checkpoint_path)
+        )
+        return None, None
+
+    # Python attributes are not kept by TorchScript but are read by cnn_utils.test
+    model.variational = metadata["variational"]
+    model.quantization = metadata.get("quantization")
+
+    return model, tuple(metadata["input_shape"])
@@ -4,7 +4,9 @@
 Class of layers used in the CNN not directly implemented in pytorch.
 """
 
+import torch
 import torch.nn as nn
+import torch.nn.functional as F
 
 
 class Flatten(nn.Module):
@@ -130,3 +132,119 @@ class CropMaxUnpool2d(nn.Module):
             output = output[:, :, x1::, y1::]
 
         return output
+
+
+class CropUpsample3d(nn.Module):
+    """
+    Learned upsampling replacing CropMaxUnpool3d, which does not need the indices of
+    the max pooling. It is initialized as a nearest neighbour upsampling.
+    """
+
+    def __init__(self, channels, kernel_size, stride):
+        super(CropUpsample3d, self).__init__()
+        self.kernel_size = _to_tuple(kernel_size, 3)
+        self.stride = _to_tuple(stride, 3)
+        self.weight = nn.Parameter(torch.zeros(channels, channels, *self.kernel_size))
+        self.bias = nn.Parameter(torch.zeros(channels))
+        with torch.no_grad():
+            for channel in range(channels):
+                self.weight[channel, channel] = 1
+
+    def forward(self, f_maps, padding=None):
+        output = F.conv_transpose3d(f_maps, self.weight, self.bias, stride=self.stride)
+        if padding is not None:
+            x1 = padding[4]
+            y1 = padding[2]
+            z1 = padding[0]
+            output = output[:, :, x1::, y1::, z1::]
+
+        return output
+
+
+def _to_tuple(value, n_dims):
+    if isinstance(value, int):
+        return (value,) * n_dims
+    return tuple(value)
+
+
+def _output_positions(indices, dim, n_dims):
+    """Positions of the outputs of the pooling along one spatial dimension."""
+    shape = [1] * (n_dims + 2)
+    shape[dim + 2] = indices.size(dim + 2)
+    return torch.arange(indices.size(dim + 2), device=indices.device).view(shape)
+
+
+def compress_indices(indices, input_shape, kernel_size, stride):
+    """
+    Converts the indices of a max pooling in offsets within each pooling window.
+
+    The indices given by MaxPoolNd are flat positions in the whole input volume and
+    are stored on 64 bits. The offsets only give the position of the maximum in its
+    window and are stored on 8 bits.
+
+    Args:
+        indices: (Tensor) indices returned by the max pooling.
+        input_shape: (tuple) spatial shape of the input of the pooling (padding included).
+        kernel_size: (int or tuple) kernel size of the pooling.
+        stride: (int or tuple) stride of the pooling.
+    Returns:
+        (Tensor) uint8 tensor of offsets with the same shape as indices.
+    """
+    n_dims = len(input_shape)
+    kernel_size = _to_tuple(kernel_size, n_dims)
+    stride = _to_tuple(stride, n_dims)
+    window_size = 1
+    for size in kernel_size:
+        window_size *= size
+    if window_size > 256:
+        raise ValueError(
+            "Offsets within a pooling window of size %s cannot be stored on 8 bits."
+            % (kernel_size,)
+        )
+
+    coordinates = list()
+    remainder = indices
+    for size in reversed(input_shape):
+        coordinates.insert(0, remainder % size)
+        remainder = remainder // size
+
+    offsets = torch.zeros_like(indices)
+    for dim in range(n_dims):
+        window_coordinate = coordinates[dim] - stride[dim] * _output_positions(
+            indices, dim, n_dims
+        )
+        offsets = offsets * kernel_size[dim] + window_coordinate
+
+    return offsets.to(torch.uint8)
+
+
+def expand_offsets(offsets, input_shape, kernel_size, stride):
+    """
+    Converts offsets computed by compress_indices back in the indices of the max pooling.
+
+    Args:
+        offsets: (Tensor) offsets of the maxima in their pooling window.
+        input_shape: (tuple) spatial shape of the input of the pooling (padding included).
+        kernel_size: (int or tuple) kernel size of the pooling.
+        stride: (int or tuple) stride of the pooling.
+    Returns:
+        (Tensor) int64 indices which can be given to MaxUnpoolNd.
+    """
+    n_dims = len(input_shape)
+    kernel_size = _to_tuple(kernel_size, n_dims)
+    stride = _to_tuple(stride, n_dims)
+
+    window_coordinates = list()
+    remainder = offsets.long()
+    for size in reversed(kernel_size):
+        window_coordinates.insert(0, remainder % size)
+        remainder = remainder // size
+
+    indices = torch.zeros_like(remainder)
+    for dim in range(n_dims):
+        coordinate = window_coordinates[dim] + stride[dim] * _output_positions(
+            offsets, dim, n_dims
+        )
+        indices = indices * input_shape[dim] + coordinate
+
+    return indices
@@ -0,0 +1,94 @@
+# coding: utf8
+
+"""
+Post-training quantization of the CNN for CPU inference.
+"""
+
+from copy import deepcopy
+
+import torch
+from torch import nn
+
+
+def quantize_linear_layers(model):
+    """
+    Applies dynamic int8 quantization to the fully connected layers.
+
+    Weights are quantized once and activations are quantized on the fly,
+    hence no calibration data is needed.
+
+    Args:
+        model: (Module) CNN on CPU.
+    Returns:
+        (Module) the quantized copy of the model.
+    """
+    return torch.quantization.quantize_dynamic(
+        deepcopy(model).cpu().eval(), {nn.Linear}, dtype=torch.qint8
+    )
+
+
+def quantize_convolutions(model, dataloader, n_samples=32):
+    """
+    Applies static int8 quantization to the 3D convolutions of model.features.
+
+    Each convolution (fused with the following batch normalization and ReLU
+    layers if possible) is quantized independently: its input is quantized and its
+    output dequantized, so that the other layers keep running in float. Activation
+    ranges are calibrated on the samples of dataloader.
+
+    Args:
+        model: (Module) CNN on CPU with its convolutional part in a 'features' attribute.
+        dataloader: (DataLoader) wrapper of the calibration dataset.
+        n_samples: (int) maximum number of samples used for calibration.
+    Returns:
+        (Module) the quantized copy of the model.
+    """
+    if not hasattr(model, "features"):
+        raise ValueError(
+            "Static quantization of convolutions needs the convolutional part "
+            "of the model in a 'features' attribute."
+        )
+
+    model = deepcopy(model).cpu().eval()
+    qconfig = torch.quantization.get_default_qconfig("fbgemm")
+    for module in list(model.features.modules()):
+        if isinstance(module, nn.Sequential):
+            _wrap_convolutions(module, qconfig)
+
+    torch.quantization.prepare(model, inplace=True)
+    n_seen = 0
+    with torch.no_grad():
+        for data in dataloader:
+            model(data["image"])
+            n_seen += len(data["image"])
+            if n_seen >= n_samples:
+                break
+    torch.quantization.convert(model, inplace=True)
+
+    return model
+
+
+def _wrap_convolutions(sequential, qconfig):
+    """Fuses and wraps in place the Conv3d layers which are direct children of sequential."""
+    layers = list(sequential.children())
+    names = [name for name, _ in sequential.named_children()]
+    for i, layer in enumerate(layers):
+        if not isinstance(layer, nn.Conv3d):
+            continue
+        fused_names = [names[i]]
+        if i + 1 < len(layers) and isinstance(layers[i + 1], nn.BatchNorm3d):
+            fused_names.append(names[i + 1])
+            if i + 2 < len(layers) and isinstance(layers[i + 2], nn.ReLU):
+                fused_names.append(names[i + 2])
+        elif i + 1 < len(layers) and isinstance(layers[i + 1], nn.ReLU):
+            fused_names.append(names[i + 1])
+        if len(fused_names) > 1:
+            torch.quantization.fuse_modules(sequential, [fused_names], inplace=True)
+
+        block = nn.Sequential(
+            torch.quantization.QuantStub(),
+            getattr(sequential, names[i]),
+            torch.quantization.DeQuantStub(),
+        )
+        block.qconfig = qconfig
+        setattr(sequential, names[i], block)
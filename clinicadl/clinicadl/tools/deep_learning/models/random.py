@@ -128,9 +128,56 @@ def random_sampling(rs_options, options):
     )
     options.convolutions = random_conv_sampling(rs_options)
 
+    if (
+        getattr(rs_options, "memory_budget", None) is not None
+        or getattr(rs_options, "flops_budget", None) is not None
+    ):
+        options = resample_in_budget(rs_options, options)
+
     return options
 
 
+def resample_in_budget(rs_options, options):
+    """
+    Samples new architectures until the network fits in the random search budgets.
+
+    The memory and the computations needed to train the network are estimated without
+    data from the input_shape given in random_search.json.
+
+    Args:
+        rs_options: (Namespace) parameters of the random search
+        options: (Namespace) options of the training, with a sampled architecture
+
+    Returns:
+        options (Namespace), options updated with an architecture fitting in the budgets
+    """
+    from .complexity import estimate_options_complexity, fits_budget
+
+    if getattr(rs_options, "input_shape", None) is None:
+        raise ValueError(
+            "The input_shape must be given in random_search.json to estimate the "
+            "memory and the computations of the sampled networks."
+        )
+
+    max_resampling = getattr(rs_options, "max_resampling", 100)
+    for _ in range(max_resampling):
+        complexity = estimate_options_complexity(options, rs_options.input_shape)
+        if fits_budget(
+            complexity,
+            memory_budget=rs_options.memory_budget,
+            flops_budget=rs_options.flops_budget,
+        ):
+            return options
+        options.n_fcblocks = sampling_fn(rs_options.n_fcblocks, "randint")
+        options.convolutions = random_conv_sampling(rs_options)
+
+    raise ValueError(
+        "No architecture fitting in the budgets (memory: %s GB, computations: "
+        "%s GFLOPs) was found after %i samplings."
+        % (rs_options.memory_budget, rs_options.flops_budget, max_resampling)
+    )
+
+
 def find_evaluation_steps(accumulation_steps, goal=18):
     """
     Compute the evaluation steps to be a multiple of accumulation steps as close possible as the goal.
@@ -458,7 +505,9 @@ class RandomArchitecture(nn.Module):
 
         Args:
             n_fcblocks: (int) number of fully connected blocks in the architecture.
-            convolutions: (dict) parameters of the convolutional part.
+            convolutions: (dict) parameters of the convolutional part. If empty, the
+                FC blocks are directly applied on the input (latent representations
+                computed by an autoencoder for example).
             initial_shape: (array_like) shape of the initial input.
             n_classes: (int) number of classes in the classification problem.
         Returns:
@@ -466,10 +515,10 @@ class RandomArchitecture(nn.Module):
             (list) the shape of the flattened layer
         """
         n_conv = len(convolutions)
-        last_conv = convolutions["conv%i" % (len(convolutions) - 1)]
-        out_channels = last_conv["out_channels"]
         flattened_shape = np.ceil(np.array(initial_shape) / 2 ** n_conv)
-        flattened_shape[0] = out_channels
+        if n_conv > 0:
+            last_conv = convolutions["conv%i" % (len(convolutions) - 1)]
+            flattened_shape[0] = last_conv["out_channels"]
         in_features = np.product(flattened_shape)
 
         # Sample number of FC layers
@@ -16,3 +16,8 @@ MASK_PATTERN = {
     "gm_maps": "",
     "shepplogan": "",
 }
+
+# Single array file containing all the images of a Shepp-Logan dataset,
+# and the participant and session of each of its rows
+SHEPPLOGAN_PACKED_FILENAME = "packed" + FILENAME_TYPE["shepplogan"] + ".npy"
+SHEPPLOGAN_PACKED_INDEX = "packed" + FILENAME_TYPE["shepplogan"] + ".tsv"
@@ -4,9 +4,11 @@ Launch a random network training.
 
 import argparse
 from os import path
+from time import time
 
 from ..tools.deep_learning import check_and_complete, read_json
 from ..tools.deep_learning.models.random import random_sampling
+from .random_search_index import record_job
 from .train_autoencoder import train_autoencoder
 from .train_multiCNN import train_multi_cnn
 from .train_singleCNN import train_single_cnn
@@ -23,9 +25,22 @@ def launch_search(options):
 
     options.output_dir = path.join(options.launch_dir, options.name)
 
+    start_time = time()
     if options.network_type == "autoencoder":
         train_autoencoder(options)
     elif options.network_type == "cnn":
         train_single_cnn(options)
     elif options.network_type == "multicnn":
         train_multi_cnn(options)
+
+    record_job(
+        options.launch_dir,
+        {
+            "name": options.name,
+            "status": "done",
+            "returncode": 0,
+            "start_time": start_time,
+            "duration": time() - start_time,
+            "output_dir": options.output_dir,
+        },
+    )
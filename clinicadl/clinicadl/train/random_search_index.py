@@ -0,0 +1,458 @@
+"""
+SQLite index of the jobs of a random search.
+
+The index stores, for each job of a launch directory, its status and timing, its
+hyperparameters and the metrics of its best models. It is filled when a job ends
+and can be rebuilt from the job folders, so that the analysis of a random search is
+a set of queries.
+"""
+
+import json
+import os
+import sqlite3
+from contextlib import closing
+from os import path
+
+import numpy as np
+import pandas as pd
+
+DB_FILENAME = "random_search.db"
+SELECTIONS = ["balanced_accuracy", "loss"]
+SUBSETS = ["train", "validation"]
+METRICS = ["accuracy", "balanced_accuracy", "sensitivity", "specificity", "total_loss"]
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    name TEXT PRIMARY KEY,
+    status TEXT,
+    returncode INTEGER,
+    start_time REAL,
+    duration REAL,
+    output_dir TEXT
+);
+CREATE TABLE IF NOT EXISTS hyperparameters (
+    name TEXT,
+    parameter TEXT,
+    value TEXT,
+    PRIMARY KEY (name, parameter)
+);
+CREATE TABLE IF NOT EXISTS metrics (
+    name TEXT,
+    fold INTEGER,
+    selection TEXT,
+    subset TEXT,
+    accuracy REAL,
+    balanced_accuracy REAL,
+    sensitivity REAL,
+    specificity REAL,
+    total_loss REAL,
+    PRIMARY KEY (name, fold, selection, subset)
+);
+CREATE INDEX IF NOT EXISTS metrics_selection ON metrics (selection, subset);
+"""
+# Options which describe the job but are not hyperparameters
+IGNORED_PARAMETERS = [
+    "func",
+    "launch_dir",
+    "name",
+    "output_dir",
+    "task",
+    "random_task",
+    "verbose",
+]
+
+
+def connect(launch_dir):
+    """
+    Opens the index of launch_dir, and creates its tables if needed.
+
+    Args:
+        launch_dir: (str) folder containing random_search.json.
+    Returns:
+        (Connection) connection to the SQLite database.
+    """
+    # Several launchers may write in the index at the same time
+    connection = sqlite3.connect(path.join(launch_dir, DB_FILENAME), timeout=60)
+    connection.executescript(SCHEMA)
+    return connection
+
+
+def read_hyperparameters(output_dir):
+    """
+    Reads the hyperparameters of a job in its commandline.json.
+
+    The values are encoded in JSON. The convolutional part of random architectures
+    is summarized by its number of blocks and the width of its first layer.
+
+    Args:
+        output_dir: (str) output folder of the job.
+    Returns:
+        (dict) values of the hyperparameters.
+    """
+    json_path = path.join(output_dir, "commandline.json")
+    if not path.exists(json_path):
+        return dict()
+    with open(json_path, "r") as f:
+        options = json.load(f)
+
+    hyperparameters = dict()
+    for parameter, value in options.items():
+        if parameter in IGNORED_PARAMETERS:
+            continue
+        elif parameter == "convolutions" and isinstance(value, dict):
+            hyperparameters["n_convblocks"] = json.dumps(len(value))
+            if "conv0" in value:
+                hyperparameters["first_conv_width"] = json.dumps(
+                    value["conv0"]["out_channels"]
+                )
+        elif not isinstance(value, dict):
+            hyperparameters[parameter] = json.dumps(value)
+
+    return hyperparameters
+
+
+def read_metrics(output_dir):
+    """
+    Reads the image-level metrics of the best models of all the folds of a job.
+
+    Args:
+        output_dir: (str) output folder of the job.
+    Returns:
+        (list of tuple) rows of the metrics table.
+    """
+    rows = list()
+    if not path.isdir(output_dir):
+        return rows
+    for fold_dir in sorted(os.listdir(output_dir)):
+        if not fold_dir.startswith("fold-") or not fold_dir[5:].isdigit():
+            continue
+        for selection in SELECTIONS:
+            performance_path = path.join(
+                output_dir, fold_dir, "cnn_classification", "best_%s" % selection
+            )
+            for subset in SUBSETS:
+                metrics_path = path.join(
+                    performance_path, "%s_image_level_metrics.tsv" % subset
+                )
+                if not path.exists(metrics_path):
+                    continue
+                metrics_df = pd.read_csv(metrics_path, sep="\t")
+                rows.append(
+                    (int(fold_dir[5:]), selection, subset)
+                    + tuple(
+                        float(metrics_df.loc[0, metric])
+                        if metric in metrics_df.columns
+                        else None
+                        for metric in METRICS
+                    )
+                )
+
+    return rows
+
+
+def training_duration(output_dir):
+    """Sums the training times written in the training.tsv of all the folds."""
+    duration = None
+    if not path.isdir(output_dir):
+        return duration
+    for fold_dir in os.listdir(output_dir):
+        training_path = path.join(output_dir, fold_dir, "training.tsv")
+        if fold_dir.startswith("fold-") and path.exists(training_path):
+            training_df = pd.read_csv(training_path, sep="\t")
+            if len(training_df) > 0:
+                duration = (duration or 0) + float(training_df.time.iloc[-1])
+
+    return duration
+
+
+def record_job(launch_dir, row, connection=None):
+    """
+    Adds a job to the index, or replaces it if it was already indexed.
+
+    Args:
+        launch_dir: (str) folder containing random_search.json.
+        row: (dict) name, status, returncode, start_time, duration and output_dir
+            of the job.
+        connection: (Connection) opened index. If None the index of launch_dir is
+            opened and closed.
+    """
+    if connection is None:
+        with closing(connect(launch_dir)) as connection:
+            record_job(launch_dir, row, connection)
+        return
+
+    name = row["name"]
+    hyperparameters = read_hyperparameters(row["output_dir"])
+    metrics = read_metrics(row["output_dir"])
+    with connection:
+        connection.execute(
+            "INSERT OR REPLACE INTO jobs VALUES (?, ?, ?, ?, ?, ?)",
+            (
+                name,
+                row["status"],
+                row.get("returncode"),
+                row.get("start_time"),
+                row.get("duration"),
+                row["output_dir"],
+            ),
+        )
+        connection.execute("DELETE FROM hyperparameters WHERE name = ?", (name,))
+        connection.executemany(
+            "INSERT INTO hyperparameters VALUES (?, ?, ?)",
+            [(name, parameter, value) for parameter, value in hyperparameters.items()],
+        )
+        connection.execute("DELETE FROM metrics WHERE name = ?", (name,))
+        connection.executemany(
+            "INSERT INTO metrics VALUES (%s)" % ", ".join(["?"] * (4 + len(METRICS))),
+            [(name,) + metrics_row for metrics_row in metrics],
+        )
+
+
+def job_folders(launch_dir):
+    """Lists the jobs of launch_dir, i.e. its folders containing a commandline.json."""
+    return sorted(
+        job
+        for job in os.listdir(launch_dir)
+        if path.exists(path.join(launch_dir, job, "commandline.json"))
+    )
+
+
+def index_folders(launch_dir, jobs, connection):
+    """
+    Adds jobs to the index from their folders.
+
+    The status of a job is read in the queue of random-search run if the job was
+    queued. Otherwise a job is done if the metrics of its best models exist.
+
+    Args:
+        launch_dir: (str) folder containing random_search.json.
+        jobs: (list of str) names of the job folders to index.
+        connection: (Connection) opened index.
+    """
+    from .random_search_queue import JOB_STATES, QUEUE_DIRNAME
+
+    queue_states = dict()
+    for state in JOB_STATES:
+        state_dir = path.join(launch_dir, QUEUE_DIRNAME, state)
+        if path.isdir(state_dir):
+            for filename in os.listdir(state_dir):
+                if filename.endswith(".json"):
+                    queue_states[filename[:-5]] = state
+
+    for job in jobs:
+        output_dir = path.join(launch_dir, job)
+        if job in queue_states:
+            status = queue_states[job]
+        elif len(read_metrics(output_dir)) > 0:
+            status = "done"
+        else:
+            status = "unknown"
+        record_job(
+            launch_dir,
+            {
+                "name": job,
+                "status": status,
+                "duration": training_duration(output_dir),
+                "output_dir": output_dir,
+            },
+            connection,
+        )
+
+
+def rebuild_index(launch_dir):
+    """
+    Writes a new index from the folders of the jobs of launch_dir.
+
+    Args:
+        launch_dir: (str) folder containing random_search.json.
+    Returns:
+        (int) number of jobs indexed.
+    """
+    db_path = path.join(launch_dir, DB_FILENAME)
+    if path.exists(db_path):
+        os.remove(db_path)
+
+    jobs = job_folders(launch_dir)
+    with closing(connect(launch_dir)) as connection:
+        index_folders(launch_dir, jobs, connection)
+
+    return len(jobs)
+
+
+def update_index(launch_dir):
+    """
+    Indexes the job folders of launch_dir which are not in the index yet.
+
+    Jobs are only recorded in the index when they are run by random-search run,
+    hence the jobs generated before the creation of the index, or trained outside
+    of the queue, are found here.
+
+    Args:
+        launch_dir: (str) folder containing random_search.json.
+    Returns:
+        (int) number of jobs added to the index.
+    """
+    with closing(connect(launch_dir)) as connection:
+        indexed_jobs = {
+            name for (name,) in connection.execute("SELECT name FROM jobs").fetchall()
+        }
+        missing_jobs = [
+            job for job in job_folders(launch_dir) if job not in indexed_jobs
+        ]
+        index_folders(launch_dir, missing_jobs, connection)
+
+    return len(missing_jobs)
+
+
+def job_scores(connection, selection, folds=None, subset="validation"):
+    """
+    Averages the balanced accuracies of the best models of all the indexed jobs.
+
+    As in the analysis based on the job folders, jobs are not filtered on their
+    status: the folds which were not evaluated are not counted.
+
+    Args:
+        connection: (Connection) opened index.
+        selection: (str) metric used to select the best models.
+        folds: (list of int) folds averaged. If None all the folds are used.
+        subset: (str) subset on which the balanced accuracy was computed.
+    Returns:
+        (DataFrame) balanced_accuracy and number of folds of each job, indexed by name.
+    """
+    fold_condition = ""
+    if folds is not None:
+        fold_condition = "AND m.fold IN (%s)" % ", ".join(str(int(f)) for f in folds)
+    query = (
+        "SELECT j.name, AVG(m.balanced_accuracy) AS balanced_accuracy, "
+        "COUNT(m.fold) AS folds FROM jobs j LEFT JOIN metrics m "
+        "ON m.name = j.name AND m.selection = ? AND m.subset = ? %s "
+        "GROUP BY j.name ORDER BY j.name" % fold_condition
+    )
+    return pd.read_sql_query(
+        query, connection, params=(selection, subset), index_col="name"
+    )
+
+
+def threshold_table(scores, thresholds, columns):
+    """
+    Compares the mean balanced accuracy of each job with a series of thresholds.
+
+    Args:
+        scores: (DataFrame) output of job_scores.
+        thresholds: (array-like) thresholds on the balanced accuracy.
+        columns: (list) names of the columns of the thresholds, followed by the name
+            of the column of the number of folds.
+    Returns:
+        (DataFrame) one row per job and a total row.
+    """
+    # Jobs without any fold are below all the thresholds
+    accuracies = scores.balanced_accuracy.fillna(0).values.reshape(-1, 1)
+    data = (accuracies > np.asarray(thresholds).reshape(1, -1)).astype(int)
+    output_df = pd.DataFrame(data, index=scores.index, columns=columns[:-1])
+    output_df[columns[-1]] = scores.folds.values.astype(int)
+
+    total_df = pd.DataFrame(
+        [output_df.sum().values], columns=output_df.columns, index=["total"]
+    )
+    output_df = pd.concat([output_df, total_df])
+    output_df.sort_index(inplace=True)
+
+    return output_df
+
+
+def best_jobs(connection, selection, k=10, folds=None):
+    """
+    Lists the k best jobs with their hyperparameters.
+
+    Args:
+        connection: (Connection) opened index.
+        selection: (str) metric used to select the best models.
+        k: (int) number of jobs listed.
+        folds: (list of int) folds averaged. If None all the folds are used.
+    Returns:
+        (DataFrame) mean validation balanced accuracy, number of folds, training
+            duration and hyperparameters of the best jobs.
+    """
+    scores = job_scores(connection, selection, folds=folds)
+    scores = scores[scores.folds > 0].sort_values("balanced_accuracy", ascending=False)
+    scores = scores.head(k)
+    if len(scores) == 0:
+        return scores
+
+    names = ", ".join("?" * len(scores))
+    hyperparameters_df = pd.read_sql_query(
+        "SELECT name, parameter, value FROM hyperparameters WHERE name IN (%s)" % names,
+        connection,
+        params=tuple(scores.index),
+    ).pivot(index="name", columns="parameter", values="value")
+    durations = pd.read_sql_query(
+        "SELECT name, duration FROM jobs WHERE name IN (%s)" % names,
+        connection,
+        params=tuple(scores.index),
+        index_col="name",
+    )
+
+    return scores.join(durations).join(hyperparameters_df)
+
+
+def marginals(connection, selection, folds=None, n_bins=5):
+    """
+    Summarizes the mean validation balanced accuracy of the jobs according to the
+    value of each hyperparameter which differs between jobs.
+
+    Numerical hyperparameters taking more than n_bins values are grouped in n_bins
+    quantile bins.
+
+    Args:
+        connection: (Connection) opened index.
+        selection: (str) metric used to select the best models.
+        folds: (list of int) folds averaged. If None all the folds are used.
+        n_bins: (int) maximum number of groups of a numerical hyperparameter.
+    Returns:
+        (DataFrame) parameter, value, n_jobs, mean, std and max of the balanced
+            accuracies.
+    """
+    scores = job_scores(connection, selection, folds=folds)
+    scores = scores[scores.folds > 0]
+    hyperparameters_df = pd.read_sql_query(
+        "SELECT name, parameter, value FROM hyperparameters",
+        connection,
+    )
+    hyperparameters_df = hyperparameters_df[
+        hyperparameters_df.name.isin(scores.index)
+    ].copy()
+    hyperparameters_df["balanced_accuracy"] = scores.balanced_accuracy.loc[
+        hyperparameters_df.name
+    ].values
+
+    rows = list()
+    for parameter, parameter_df in hyperparameters_df.groupby("parameter"):
+        if parameter_df.value.nunique() < 2:
+            continue
+        values = parameter_df.value
+        numerical_values = pd.to_numeric(values, errors="coerce")
+        if numerical_values.notna().all() and values.nunique() > n_bins:
+            values = pd.qcut(numerical_values, n_bins, duplicates="drop").astype(str)
+        grouped = parameter_df.balanced_accuracy.groupby(values)
+        for value, accuracies in grouped:
+            rows.append(
+                {
+                    "parameter": parameter,
+                    "value": value,
+                    "n_jobs": len(accuracies),
+                    "mean_balanced_accuracy": accuracies.mean(),
+                    "std_balanced_accuracy": accuracies.std(),
+                    "max_balanced_accuracy": accuracies.max(),
+                }
+            )
+
+    return pd.DataFrame(
+        rows,
+        columns=[
+            "parameter",
+            "value",
+            "n_jobs",
+            "mean_balanced_accuracy",
+            "std_balanced_accuracy",
+            "max_balanced_accuracy",
+        ],
+    )
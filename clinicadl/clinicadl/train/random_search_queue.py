@@ -0,0 +1,647 @@
+"""
+Sample random networks in a queue stored in launch_dir and train them locally.
+
+Optionally, the worst jobs are stopped early with asynchronous successive halving
+(ASHA): their validation metrics are read in training.tsv and compared at rungs.
+"""
+
+import fcntl
+import json
+import os
+import subprocess
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from copy import deepcopy
+from os import path
+from time import sleep, time
+
+import pandas as pd
+
+from .random_search_index import record_job
+
+QUEUE_DIRNAME = "queue"
+RUNGS_FILENAME = "rungs.tsv"
+JOB_STATES = ["pending", "running", "done", "failed", "stopped"]
+INDEX_COLUMNS = ["name", "status", "returncode", "start_time", "duration", "output_dir"]
+# Options of the launcher which are not written in the options of the jobs
+LAUNCHER_OPTIONS = [
+    "func",
+    "task",
+    "random_task",
+    "n_jobs",
+    "workers",
+    "threads_per_worker",
+    "job_prefix",
+    "group_size",
+    "halving",
+    "min_epochs",
+    "reduction_factor",
+    "halving_metric",
+    "n_replacements",
+]
+# Seconds between two readings of the training.tsv of a running job
+POLL_INTERVAL = 30
+
+
+class JobQueue:
+    """
+    Queue of training jobs stored in <launch_dir>/queue.
+
+    Each job is the JSON file of its options, moved between the pending, running,
+    done and failed folders. Jobs are claimed by renaming their file, which is atomic,
+    so that several launchers can share the same queue.
+    """
+
+    def __init__(self, launch_dir):
+        self.launch_dir = launch_dir
+        self.queue_dir = path.join(launch_dir, QUEUE_DIRNAME)
+        for state in JOB_STATES + ["logs"]:
+            os.makedirs(path.join(self.queue_dir, state), exist_ok=True)
+
+    def job_path(self, name, state):
+        return path.join(self.queue_dir, state, "%s.json" % name)
+
+    def log_path(self, name):
+        return path.join(self.queue_dir, "logs", "%s.log" % name)
+
+    def jobs(self, state):
+        """Returns the names of the jobs in a given state, in submission order."""
+        return sorted(
+            filename[:-5]
+            for filename in os.listdir(path.join(self.queue_dir, state))
+            if filename.endswith(".json")
+        )
+
+    def known_names(self):
+        names = set(
+            job
+            for job in os.listdir(self.launch_dir)
+            if path.isdir(path.join(self.launch_dir, job))
+        )
+        for state in JOB_STATES:
+            names.update(self.jobs(state))
+        return names
+
+    def submit(self, name, options):
+        """
+        Adds a job to the pending jobs.
+
+        Args:
+            name: (str) name of the job, also the name of its output folder.
+            options: (Namespace) options of the training.
+        """
+        options_dict = {
+            key: value
+            for key, value in vars(options).items()
+            if key not in LAUNCHER_OPTIONS
+        }
+        job_path = self.job_path(name, "pending")
+        tmp_path = job_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(options_dict, f, skipkeys=True, indent=4)
+        # The job is only visible once it is complete
+        os.replace(tmp_path, job_path)
+
+    def claim(self):
+        """
+        Moves the first pending job to the running jobs.
+
+        Returns:
+            (str) name of the job claimed, None if no job is pending.
+        """
+        for name in self.jobs("pending"):
+            try:
+                os.rename(
+                    self.job_path(name, "pending"), self.job_path(name, "running")
+                )
+            except FileNotFoundError:
+                # Claimed by another worker
+                continue
+            return name
+        return None
+
+    def claim_group(self, max_size=1):
+        """
+        Moves the first pending job and up to max_size - 1 pending jobs using the
+        same data (see train_sweep.sweep_key) to the running jobs.
+
+        Returns:
+            (list) names of the jobs claimed, empty if no job is pending.
+        """
+        from .train_sweep import sweep_key
+
+        name = self.claim()
+        if name is None:
+            return []
+        group = [name]
+        if max_size == 1:
+            return group
+
+        with open(self.job_path(name, "running"), "r") as f:
+            key = sweep_key(json.load(f))
+        if key is None:
+            return group
+
+        for other in self.jobs("pending"):
+            if len(group) == max_size:
+                break
+            try:
+                with open(self.job_path(other, "pending"), "r") as f:
+                    other_key = sweep_key(json.load(f))
+                if other_key != key:
+                    continue
+                os.rename(
+                    self.job_path(other, "pending"), self.job_path(other, "running")
+                )
+            except FileNotFoundError:
+                # Claimed by another worker
+                continue
+            group.append(other)
+
+        return group
+
+    def finish(self, name, state):
+        os.replace(self.job_path(name, "running"), self.job_path(name, state))
+
+
+@contextmanager
+def file_lock(lock_path):
+    """Holds an exclusive lock on lock_path, released if the process is killed."""
+    with open(lock_path, "a") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+class SuccessiveHalving:
+    """
+    Asynchronous successive halving of the jobs of a queue.
+
+    Rungs are placed every min_epochs * reduction_factor ** k epochs. When a job
+    reaches a rung, its best validation metric so far is compared with the ones of
+    the jobs which reached this rung before. Once reduction_factor jobs reached the
+    rung, a job is stopped if it is not in the top 1 / reduction_factor of them.
+    The values recorded at the rungs are kept in <launch_dir>/queue/rungs.tsv, which
+    is read again under a file lock before each decision, so that all the launchers
+    sharing the queue compare their jobs with the same records.
+    """
+
+    def __init__(self, launch_dir, min_epochs=1, reduction_factor=3, metric="loss"):
+        """
+        Args:
+            launch_dir: (str) folder containing random_search.json and the queue.
+            min_epochs: (int) number of epochs of the first rung.
+            reduction_factor: (int) ratio between the epochs of two consecutive rungs,
+                also the inverse of the fraction of the jobs kept at each rung.
+            metric: (str) validation metric compared, "loss" or "balanced_accuracy".
+        """
+        if min_epochs < 1:
+            raise ValueError("The first rung must be placed after at least one epoch.")
+        if reduction_factor < 2:
+            raise ValueError("The reduction factor must be at least 2.")
+        if metric not in ["loss", "balanced_accuracy"]:
+            raise ValueError(
+                "Metric %s is not implemented. Please choose in "
+                "['loss', 'balanced_accuracy']." % metric
+            )
+        self.min_epochs = min_epochs
+        self.reduction_factor = reduction_factor
+        self.metric = metric
+        self.rungs_path = path.join(launch_dir, QUEUE_DIRNAME, RUNGS_FILENAME)
+        self.lock_path = self.rungs_path + ".lock"
+        self.lock = threading.Lock()
+        self.records = self.read_records()
+
+    def read_records(self):
+        """Reads the values recorded at the rungs by all the launchers."""
+        if path.exists(self.rungs_path):
+            return pd.read_csv(self.rungs_path, sep="\t")
+        return pd.DataFrame(columns=["name", "rung", "value"])
+
+    def rungs(self, epochs):
+        """Returns the number of epochs of the rungs of a job trained during epochs."""
+        rungs = list()
+        rung = self.min_epochs
+        while rung < epochs:
+            rungs.append(rung)
+            rung *= self.reduction_factor
+        return rungs
+
+    def job_values(self, training_df):
+        """
+        Returns the validation metric of a job in the direction "lower is better".
+
+        Args:
+            training_df: (DataFrame) content of the training.tsv of the job.
+        Returns:
+            (Series) values of the metric, indexed as training_df.
+        """
+        column = "%s_valid" % self.metric
+        if column not in training_df.columns:
+            # Autoencoders are only evaluated with their loss
+            column = "loss_valid"
+        values = pd.to_numeric(training_df[column], errors="coerce")
+        if column.startswith("balanced_accuracy"):
+            return -values
+        return values
+
+    def report(self, name, training_df, epochs):
+        """
+        Records the rungs reached by a job and decides if it is stopped.
+
+        A job reaches the rung of r epochs when training.tsv contains an evaluation
+        of its r-th epoch.
+
+        Args:
+            name: (str) name of the job.
+            training_df: (DataFrame) content of the training.tsv of the job.
+            epochs: (int) maximum number of epochs of the job.
+        Returns:
+            (bool) True if the job must be stopped.
+        """
+        values = self.job_values(training_df)
+        evaluated = values.notna()
+        if not evaluated.any():
+            return False
+        training_epochs = pd.to_numeric(training_df.epoch, errors="coerce")
+        n_epochs = int(training_epochs[evaluated].max()) + 1
+
+        with self.lock, file_lock(self.lock_path):
+            self.records = self.read_records()
+            job_records = self.records[self.records.name == name]
+            for rung in self.rungs(epochs):
+                if rung > n_epochs:
+                    break
+                if rung in job_records.rung.values:
+                    continue
+                value = values[evaluated & (training_epochs < rung)].min()
+                self.record(name, rung, value)
+                if self.is_stopped(rung, value):
+                    return True
+        return False
+
+    def record(self, name, rung, value):
+        row_df = pd.DataFrame([[name, rung, value]], columns=["name", "rung", "value"])
+        self.records = pd.concat([self.records, row_df], ignore_index=True)
+        row_df.to_csv(
+            self.rungs_path,
+            mode="a",
+            header=not path.exists(self.rungs_path),
+            index=False,
+            sep="\t",
+        )
+
+    def is_stopped(self, rung, value):
+        rung_values = self.records[self.records.rung == rung].value.astype(float)
+        if len(rung_values) < self.reduction_factor:
+            return False
+        n_kept = len(rung_values) // self.reduction_factor
+        return value > rung_values.nsmallest(n_kept).max()
+
+
+def sample_jobs(options, n_jobs, prefix="job"):
+    """
+    Samples n_jobs configurations with random_sampling and adds them to the queue.
+
+    Args:
+        options: (Namespace) options given to the command line (computational
+            resources and launch_dir).
+        n_jobs: (int) number of configurations sampled.
+        prefix: (str) prefix of the names of the jobs.
+    Returns:
+        (list) names of the jobs added.
+    """
+    import argparse
+
+    from ..tools.deep_learning import check_and_complete, read_json
+    from ..tools.deep_learning.models.random import random_sampling
+
+    rs_options = argparse.Namespace()
+    rs_options = read_json(
+        rs_options, path.join(options.launch_dir, "random_search.json")
+    )
+    check_and_complete(rs_options, random_search=True)
+
+    queue = JobQueue(options.launch_dir)
+    known_names = queue.known_names()
+    names = list()
+    index = 0
+    while len(names) < n_jobs:
+        name = "%s-%03i" % (prefix, index)
+        index += 1
+        if name in known_names:
+            continue
+        job_options = random_sampling(rs_options, deepcopy(options))
+        job_options.name = name
+        queue.submit(name, job_options)
+        names.append(name)
+
+    return names
+
+
+def run_queue(
+    launch_dir,
+    n_workers=1,
+    n_threads=1,
+    group_size=1,
+    scheduler=None,
+    poll_interval=POLL_INTERVAL,
+    replace=None,
+    logger=None,
+):
+    """
+    Trains the pending jobs of the queue with n_workers concurrent processes.
+
+    Each job is run by `clinicadl train from_json` in a subprocess whose BLAS and
+    OpenMP thread pools are limited to n_threads. The outputs of the job are written
+    in <launch_dir>/<name> and its logs in <launch_dir>/queue/logs/<name>.log.
+    Every job finished is added to the index of the random search (see
+    random_search_index.record_job).
+    The slot of a job stopped by the scheduler is given to the next pending job,
+    after replace is called to add new jobs to the queue.
+
+    Args:
+        launch_dir: (str) folder containing random_search.json and the queue.
+        n_workers: (int) number of jobs trained at the same time.
+        n_threads: (int) number of threads of each job.
+        group_size: (int) maximum number of jobs using the same data trained
+            together by a worker with `clinicadl train sweep`.
+        scheduler: (SuccessiveHalving) decides which jobs are stopped early.
+            If None all the jobs are trained until the end.
+        poll_interval: (float) seconds between two readings of the metrics of a job.
+        replace: (callable) called with the name of each job stopped by the scheduler.
+            If None no job is added to the queue.
+        logger: Logger instance.
+    Returns:
+        (DataFrame) rows of the index added by this call.
+    """
+    import logging
+
+    if logger is None:
+        logger = logging
+
+    queue = JobQueue(launch_dir)
+    index_lock = threading.Lock()
+    rows = list()
+
+    def worker():
+        while True:
+            names = queue.claim_group(group_size)
+            if len(names) == 0:
+                return
+            logger.info("Jobs %s started." % ", ".join(names))
+            if len(names) == 1:
+                group_rows = [
+                    run_job(queue, names[0], n_threads, scheduler, poll_interval)
+                ]
+            else:
+                group_rows = run_group(queue, names, n_threads)
+            for row in group_rows:
+                queue.finish(row["name"], row["status"])
+                with index_lock:
+                    record_job(launch_dir, row)
+                    rows.append(row)
+                logger.info(
+                    "Job %s %s in %.0fs."
+                    % (row["name"], row["status"], row["duration"])
+                )
+                if row["status"] == "stopped" and replace is not None:
+                    replace(row["name"])
+
+    with ThreadPoolExecutor(max_workers=n_workers) as executor:
+        futures = [executor.submit(worker) for _ in range(n_workers)]
+    for future in futures:
+        future.result()
+
+    return pd.DataFrame(rows, columns=INDEX_COLUMNS)
+
+
+def run_job(queue, name, n_threads=1, scheduler=None, poll_interval=POLL_INTERVAL):
+    """
+    Trains a job claimed in the queue in a subprocess.
+
+    Args:
+        queue: (JobQueue) queue of the job.
+        name: (str) name of the job.
+        n_threads: (int) maximum number of threads used by the job.
+        scheduler: (SuccessiveHalving) decides if the job is stopped early.
+        poll_interval: (float) seconds between two readings of the metrics of the job.
+    Returns:
+        (dict) row of the index describing the job.
+    """
+    output_dir = path.join(queue.launch_dir, name)
+    env = dict(os.environ)
+    for variable in ["OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS"]:
+        env[variable] = str(n_threads)
+
+    command = [
+        sys.executable,
+        "-m",
+        "clinicadl",
+        "train",
+        "from_json",
+        queue.job_path(name, "running"),
+        output_dir,
+    ]
+    with open(queue.job_path(name, "running"), "r") as f:
+        epochs = json.load(f).get("epochs", 20)
+
+    start_time = time()
+    stopped = False
+    with open(queue.log_path(name), "w") as log_file:
+        process = subprocess.Popen(
+            command, env=env, stdout=log_file, stderr=subprocess.STDOUT
+        )
+        if scheduler is None:
+            returncode = process.wait()
+        else:
+            returncode = process.poll()
+            while returncode is None:
+                sleep(poll_interval)
+                training_df = read_training(output_dir)
+                if training_df is not None and scheduler.report(
+                    name, training_df, epochs
+                ):
+                    stopped = True
+                    stop_process(process)
+                returncode = process.poll()
+
+    if stopped:
+        status = "stopped"
+    elif returncode == 0:
+        status = "done"
+    else:
+        status = "failed"
+
+    return {
+        "name": name,
+        "status": status,
+        "returncode": returncode,
+        "start_time": start_time,
+        "duration": time() - start_time,
+        "output_dir": output_dir,
+    }
+
+
+def run_group(queue, names, n_threads=1):
+    """
+    Trains jobs claimed in the queue in one subprocess sharing their input pipeline.
+
+    The status of each job is read in the sweep_status.json written by
+    `clinicadl train sweep` in its output folder, so that a job failing does not
+    change the status of the others. A job without this file failed with the
+    subprocess.
+
+    Args:
+        queue: (JobQueue) queue of the jobs.
+        names: (list of str) names of the jobs, which must use the same data.
+        n_threads: (int) maximum number of threads used by the subprocess.
+    Returns:
+        (list of dict) rows of the index describing the jobs.
+    """
+    from .train_sweep import read_status
+
+    env = dict(os.environ)
+    for variable in ["OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS"]:
+        env[variable] = str(n_threads)
+
+    command = [
+        sys.executable,
+        "-m",
+        "clinicadl",
+        "train",
+        "sweep",
+        queue.launch_dir,
+    ] + [queue.job_path(name, "running") for name in names]
+    start_time = time()
+    with open(queue.log_path(names[0]), "w") as log_file:
+        returncode = subprocess.call(
+            command, env=env, stdout=log_file, stderr=subprocess.STDOUT
+        )
+    duration = time() - start_time
+
+    rows = list()
+    for name in names:
+        output_dir = path.join(queue.launch_dir, name)
+        status = read_status(output_dir)
+        if status is None:
+            status = {
+                "status": "failed",
+                "error": "The sweep ended with return code %i before writing the "
+                "status of the job." % returncode,
+            }
+        with open(queue.log_path(name), "a") as log_file:
+            if name != names[0]:
+                log_file.write("Trained with %s, see %s.log\n" % (names[0], names[0]))
+            if status["error"] is not None:
+                log_file.write("Job %s failed:\n%s\n" % (name, status["error"]))
+        rows.append(
+            {
+                "name": name,
+                "status": status["status"],
+                "returncode": returncode,
+                "start_time": start_time,
+                "duration": duration,
+                "output_dir": output_dir,
+            }
+        )
+
+    return rows
+
+
+def stop_process(process, timeout=60):
+    """Terminates a training subprocess, and kills it if it does not stop in time."""
+    process.terminate()
+    try:
+        process.wait(timeout=timeout)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
+
+
+def read_training(output_dir):
+    """
+    Reads the training.tsv of the first fold of a job during its training.
+
+    Args:
+        output_dir: (str) output folder of the job.
+    Returns:
+        (DataFrame) metrics written by the job, None if they cannot be read yet.
+    """
+    if not path.isdir(output_dir):
+        return None
+    folds = sorted(
+        int(fold_dir[5:])
+        for fold_dir in os.listdir(output_dir)
+        if fold_dir.startswith("fold-") and fold_dir[5:].isdigit()
+    )
+    if len(folds) == 0:
+        return None
+    training_path = path.join(output_dir, "fold-%i" % folds[0], "training.tsv")
+    if not path.exists(training_path):
+        return None
+    try:
+        return pd.read_csv(training_path, sep="\t")
+    except (pd.errors.EmptyDataError, pd.errors.ParserError):
+        # The file is being written
+        return None
+
+
+def launch_queue(options):
+    """
+    Samples new jobs if asked, then trains all the pending jobs of launch_dir.
+    With successive halving, up to n_replacements jobs are sampled to replace the
+    jobs stopped.
+    """
+    from ..tools.deep_learning.iotools import return_logger
+
+    logger = return_logger(options.verbose, "random search")
+    if options.n_jobs > 0:
+        names = sample_jobs(options, options.n_jobs, prefix=options.job_prefix)
+        logger.info("%i jobs added to the queue: %s" % (len(names), ", ".join(names)))
+
+    group_size = getattr(options, "group_size", 1)
+    scheduler = None
+    if getattr(options, "halving", False):
+        if group_size > 1:
+            raise ValueError(
+                "Jobs trained in groups cannot be stopped early. Please choose "
+                "between --halving and --group_size."
+            )
+        scheduler = SuccessiveHalving(
+            options.launch_dir,
+            min_epochs=options.min_epochs,
+            reduction_factor=options.reduction_factor,
+            metric=options.halving_metric,
+        )
+
+    n_replacements = getattr(options, "n_replacements", 0)
+    if scheduler is not None and n_replacements > 0:
+        replacements = list()
+        sampling_lock = threading.Lock()
+
+        def replace(stopped_name):
+            with sampling_lock:
+                if len(replacements) >= n_replacements:
+                    return
+                name = sample_jobs(options, 1, prefix=options.job_prefix)[0]
+                replacements.append(name)
+            logger.info(
+                "Job %s added to the queue to replace %s." % (name, stopped_name)
+            )
+    else:
+        replace = None
+
+    run_queue(
+        options.launch_dir,
+        n_workers=options.workers,
+        n_threads=options.threads_per_worker,
+        group_size=group_size,
+        scheduler=scheduler,
+        replace=replace,
+        logger=logger,
+    )
@@ -7,6 +7,7 @@ from torch.utils.data import DataLoader
 
 from ..tools.deep_learning.autoencoder_utils import (
     get_criterion,
+    reconstruction_errors_to_tsvs,
     train,
     visualize_image,
 )
@@ -150,13 +151,21 @@ def train_autoencoder(params, erase_existing=True):
             train_logger,
         )
 
+        best_decoder, _ = load_model(
+            decoder,
+            os.path.join(model_dir, "best_loss"),
+            params.gpu,
+            filename="model_best.pth.tar",
+        )
+        reconstruction_errors_to_tsvs(
+            best_decoder,
+            {"train": train_loader, "validation": valid_loader},
+            os.path.join(params.output_dir, "fold-%i" % fi, "reconstruction_errors"),
+            params.gpu,
+            criterion,
+        )
+
         if params.visualization:
-            best_decoder, _ = load_model(
-                decoder,
-                os.path.join(model_dir, "best_loss"),
-                params.gpu,
-                filename="model_best.pth.tar",
-            )
             nb_images = data_train.size.elem_per_image
             if nb_images <= 2:
                 nb_images *= 3
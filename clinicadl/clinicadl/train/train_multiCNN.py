@@ -27,6 +27,10 @@ from ..tools.deep_learning.iotools import (
     write_requirements_version,
 )
 from ..tools.deep_learning.models import create_model, load_model, transfer_learning
+from ..tools.deep_learning.models.frozen import (
+    disable_activation_cache,
+    prepare_frozen_layers,
+)
 
 
 def train_multi_cnn(params, erase_existing=True):
@@ -145,6 +149,17 @@ def train_multi_cnn(params, erase_existing=True):
                 selection=params.transfer_learning_selection,
                 logger=main_logger,
             )
+            model = prepare_frozen_layers(
+                model,
+                params,
+                os.path.join(
+                    params.output_dir,
+                    "fold-%i" % fi,
+                    "frozen_cache",
+                    "cnn-%i" % cnn_index,
+                ),
+                logger=main_logger,
+            )
 
             # Define criterion and optimizer
             criterion = get_criterion(params.loss)
@@ -178,6 +193,7 @@ def train_multi_cnn(params, erase_existing=True):
                 params,
                 logger=train_logger,
             )
+            model = disable_activation_cache(model)
 
             test_cnn(
                 model,
@@ -190,6 +206,7 @@ def train_multi_cnn(params, erase_existing=True):
                 mode=params.mode,
                 gpu=params.gpu,
                 logger=eval_logger,
+                file_format=params.prediction_format,
             )
             test_cnn(
                 model,
@@ -202,6 +219,7 @@ def train_multi_cnn(params, erase_existing=True):
                 mode=params.mode,
                 gpu=params.gpu,
                 logger=eval_logger,
+                file_format=params.prediction_format,
             )
 
         for selection in ["best_balanced_accuracy", "best_loss"]:
@@ -238,6 +256,7 @@ def test_cnn(
     mode,
     logger,
     gpu=False,
+    file_format="tsv",
 ):
 
     for selection in ["best_balanced_accuracy", "best_loss"]:
@@ -267,4 +286,5 @@ def test_cnn(
             mode,
             dataset=subset_name,
             cnn_index=cnn_index,
+            file_format=file_format,
         )
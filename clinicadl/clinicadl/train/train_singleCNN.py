@@ -27,6 +27,10 @@ from ..tools.deep_learning.iotools import (
     write_requirements_version,
 )
 from ..tools.deep_learning.models import init_model, load_model, transfer_learning
+from ..tools.deep_learning.models.frozen import (
+    disable_activation_cache,
+    prepare_frozen_layers,
+)
 
 
 def train_single_cnn(params, erase_existing=True):
@@ -131,6 +135,12 @@ def train_single_cnn(params, erase_existing=True):
             selection=params.transfer_learning_selection,
             logger=main_logger,
         )
+        model = prepare_frozen_layers(
+            model,
+            params,
+            os.path.join(params.output_dir, "fold-%i" % fi, "frozen_cache"),
+            logger=main_logger,
+        )
 
         # Define criterion and optimizer
         criterion = get_criterion(params.loss)
@@ -157,6 +167,7 @@ def train_single_cnn(params, erase_existing=True):
             params,
             train_logger,
         )
+        model = disable_activation_cache(model)
 
         test_single_cnn(
             model,
@@ -169,6 +180,7 @@ def train_single_cnn(params, erase_existing=True):
             eval_logger,
             params.selection_threshold,
             gpu=params.gpu,
+            file_format=params.prediction_format,
         )
         test_single_cnn(
             model,
@@ -181,6 +193,7 @@ def train_single_cnn(params, erase_existing=True):
             eval_logger,
             params.selection_threshold,
             gpu=params.gpu,
+            file_format=params.prediction_format,
         )
 
 
@@ -195,6 +208,7 @@ def test_single_cnn(
     logger,
     selection_threshold,
     gpu=False,
+    file_format="tsv",
 ):
 
     for selection in ["best_balanced_accuracy", "best_loss"]:
@@ -207,27 +221,63 @@ def test_single_cnn(
         )
 
         results_df, metrics = test(model, data_loader, gpu, criterion, mode)
-        logger.info(
-            "%s level %s balanced accuracy is %f for model selected on %s"
-            % (mode, subset_name, metrics["balanced_accuracy"], selection)
-        )
-
-        mode_level_to_tsvs(
-            output_dir, results_df, metrics, split, selection, mode, dataset=subset_name
-        )
-
-        # Soft voting
-        if data_loader.dataset.elem_per_image > 1:
-            soft_voting_to_tsvs(
-                output_dir,
-                split,
-                logger=logger,
-                selection=selection,
-                mode=mode,
-                dataset=subset_name,
-                selection_threshold=selection_threshold,
-            )
-        elif mode != "image":
-            mode_to_image_tsvs(
-                output_dir, split, selection=selection, mode=mode, dataset=subset_name
-            )
+        results_to_tsvs(
+            output_dir,
+            results_df,
+            metrics,
+            subset_name,
+            split,
+            selection,
+            mode,
+            logger,
+            selection_threshold,
+            elem_per_image=data_loader.dataset.elem_per_image,
+            file_format=file_format,
+        )
+
+
+def results_to_tsvs(
+    output_dir,
+    results_df,
+    metrics,
+    subset_name,
+    split,
+    selection,
+    mode,
+    logger,
+    selection_threshold,
+    elem_per_image=1,
+    file_format="tsv",
+):
+    """Writes the predictions of a CNN and computes its image-level performance."""
+    logger.info(
+        "%s level %s balanced accuracy is %f for model selected on %s"
+        % (mode, subset_name, metrics["balanced_accuracy"], selection)
+    )
+
+    mode_level_to_tsvs(
+        output_dir,
+        results_df,
+        metrics,
+        split,
+        selection,
+        mode,
+        dataset=subset_name,
+        file_format=file_format,
+    )
+
+    # Soft voting
+    if elem_per_image > 1:
+        soft_voting_to_tsvs(
+            output_dir,
+            split,
+            logger=logger,
+            selection=selection,
+            mode=mode,
+            dataset=subset_name,
+            selection_threshold=selection_threshold,
+        )
+    elif mode != "image":
+        mode_to_image_tsvs(
+            output_dir, split, selection=selection, mode=mode, dataset=subset_name
+        )
@@ -0,0 +1,871 @@
+# coding: utf8
+
+"""
+Train several CNNs with a shared input pipeline.
+
+The candidates of a hyperparameter sweep which use the same data (mode,
+preprocessing, data split, batch size...) are trained in one process: each batch is
+loaded once and given to all the models, which keep their own optimizer, early
+stopping and output folder. A model which fails is stopped without interrupting the
+others, and the outcome of each training is written in its output folder.
+"""
+
+import argparse
+import json
+import os
+import traceback
+from os import path
+from time import time
+
+import numpy as np
+import pandas as pd
+import torch
+from torch.utils.data import DataLoader
+
+from ..tools.deep_learning import (
+    EarlyStopping,
+    check_and_complete,
+    commandline_to_json,
+    read_json,
+    save_checkpoint,
+    write_requirements_version,
+)
+from ..tools.deep_learning.cnn_utils import evaluate_prediction, get_criterion
+from ..tools.deep_learning.data import (
+    generate_sampler,
+    get_transforms,
+    load_data,
+    return_dataset,
+)
+from ..tools.deep_learning.iotools import (
+    check_and_clean,
+    return_logger,
+    translate_parameters,
+)
+from ..tools.deep_learning.models import init_model, load_model, transfer_learning
+from ..tools.deep_learning.models.frozen import (
+    disable_activation_cache,
+    prepare_frozen_layers,
+    set_cache_batch,
+)
+from .train_singleCNN import results_to_tsvs
+
+# Options which must be identical for all the models sharing the input pipeline
+SHARED_OPTIONS = [
+    "baseline",
+    "batch_size",
+    "caps_dir",
+    "data_augmentation",
+    "diagnoses",
+    "discarded_slices",
+    "evaluation_steps",
+    "merged_tsv_path",
+    "mode",
+    "multi_cohort",
+    "n_splits",
+    "network_type",
+    "nproc",
+    "patch_size",
+    "predict_atlas_intensities",
+    "preprocessing",
+    "roi_list",
+    "sampler",
+    "slice_direction",
+    "split",
+    "stride_size",
+    "tsv_path",
+    "uncropped_roi",
+    "unnormalize",
+    "use_cpu",
+    "use_extracted_patches",
+    "use_extracted_roi",
+    "use_extracted_slices",
+]
+# File written in the output folder of each model with the outcome of its training
+STATUS_FILENAME = "sweep_status.json"
+TRAINING_COLUMNS = [
+    "epoch",
+    "iteration",
+    "time",
+    "balanced_accuracy_train",
+    "loss_train",
+    "balanced_accuracy_valid",
+    "loss_valid",
+]
+
+
+def sweep_key(options):
+    """
+    Summarizes the options of a training which define its input pipeline.
+
+    Args:
+        options: (Namespace or dict) options of the training, before their translation.
+    Returns:
+        (str) key shared by all the trainings which can use the same DataLoader,
+            None if the training cannot be part of a sweep.
+    """
+    if not isinstance(options, dict):
+        options = vars(options)
+    # Only single CNNs are trained in sweeps
+    if options.get("network_type") != "cnn":
+        return None
+    return json.dumps(
+        {name: options.get(name) for name in SHARED_OPTIONS}, sort_keys=True
+    )
+
+
+class SweepMember:
+    """
+    CNN of a sweep, with its own optimizer, early stopping and output folder.
+    """
+
+    def __init__(self, options, fold, initial_shape, len_atlas=0, logger=None):
+        """
+        Args:
+            options: (Namespace) translated options of the training of the model.
+            fold: (int) index of the fold trained.
+            initial_shape: (array-like) shape of the inputs.
+            len_atlas: (int) number of atlas intensities predicted.
+            logger: Logger instance.
+        """
+        from torch.utils.tensorboard import SummaryWriter
+
+        self.options = options
+        self.logger = logger
+        self.active = True
+        self.error = None
+        self.stepped = False
+        fold_dir = path.join(options.output_dir, "fold-%i" % fold)
+        self.model_dir = path.join(fold_dir, "models")
+        self.filename = path.join(fold_dir, "training.tsv")
+        log_dir = path.join(fold_dir, "tensorboard_logs")
+
+        model = init_model(options, initial_shape=initial_shape, len_atlas=len_atlas)
+        model = transfer_learning(
+            model,
+            fold,
+            source_path=options.transfer_learning_path,
+            gpu=options.gpu,
+            selection=options.transfer_learning_selection,
+            logger=logger,
+        )
+        self.model = prepare_frozen_layers(
+            model, options, path.join(fold_dir, "frozen_cache"), logger=logger
+        )
+        self.criterion = get_criterion(options.loss)
+        self.optimizer = getattr(torch.optim, options.optimizer)(
+            filter(lambda x: x.requires_grad, self.model.parameters()),
+            lr=options.learning_rate,
+            weight_decay=options.weight_decay,
+        )
+
+        check_and_clean(self.model_dir)
+        check_and_clean(log_dir)
+        pd.DataFrame(columns=TRAINING_COLUMNS).to_csv(
+            self.filename, index=False, sep="\t"
+        )
+        self.writer_train = SummaryWriter(path.join(log_dir, "train"))
+        self.writer_valid = SummaryWriter(path.join(log_dir, "validation"))
+
+        self.early_stopping = EarlyStopping(
+            "min", min_delta=options.tolerance, patience=options.patience
+        )
+        self.best_valid_accuracy = -1.0
+        self.best_valid_loss = np.inf
+        self.mean_loss_valid = None
+        self.t_beginning = time()
+        self.model.train()
+
+    def start_epoch(self, epoch):
+        """
+        Checks the stopping criteria of the model at the beginning of an epoch.
+
+        Returns:
+            (bool) True if the model is trained during this epoch.
+        """
+        if self.active and (
+            epoch >= self.options.epochs
+            or self.early_stopping.step(self.mean_loss_valid)
+        ):
+            self.active = False
+            self.logger.info(
+                "Training of %s stopped after %i epochs."
+                % (self.options.output_dir, epoch)
+            )
+        if self.active:
+            self.model.zero_grad()
+            self.stepped = False
+        return self.active
+
+    def fail(self, error):
+        """
+        Stops the training of the model after an exception.
+
+        Args:
+            error: (str) traceback of the exception.
+        """
+        self.active = False
+        self.error = error
+        self.logger.error(
+            "Training of %s failed:\n%s" % (self.options.output_dir, error)
+        )
+
+    def call(self, function, *args, **kwargs):
+        """
+        Calls a function for the member, which fails if an exception is raised.
+
+        Returns:
+            the output of the function, None if it failed.
+        """
+        try:
+            return function(*args, **kwargs)
+        except Exception:
+            self.fail(traceback.format_exc())
+            return None
+
+    def train_step(self, data, imgs, labels, i, dataset):
+        """Computes the gradients of one batch and updates the model if needed."""
+        set_cache_batch(self.model, data, dataset)
+        train_output = self.model(imgs)
+        if "atlas" in data:
+            atlas_data = data["atlas"].to(imgs.device)
+            atlas_output = train_output[:, -atlas_data.size(1) : :]
+            classif_output = train_output[:, : -atlas_data.size(1) :]
+            loss = self.criterion(classif_output, labels)
+            loss += self.options.atlas_weight * torch.nn.MSELoss(reduction="sum")(
+                atlas_output, atlas_data
+            )
+        else:
+            loss = self.criterion(train_output, labels)
+        loss.backward()
+
+        if (i + 1) % self.options.accumulation_steps == 0:
+            self.stepped = True
+            self.optimizer.step()
+            self.optimizer.zero_grad()
+
+    def end_epoch(self):
+        # If no step has been performed, raise Exception
+        if not self.stepped:
+            raise Exception(
+                "The model %s has not been updated once in the epoch. The "
+                "accumulation step may be too large." % self.options.output_dir
+            )
+        self.model.zero_grad()
+
+    def write_evaluation(
+        self, epoch, i, global_step, results_train, results_valid, n_train, n_valid
+    ):
+        """Writes the metrics of an evaluation in tensorboard and training.tsv."""
+        mean_loss_train = results_train["total_loss"] / n_train
+        self.mean_loss_valid = results_valid["total_loss"] / n_valid
+        if not np.isfinite(mean_loss_train):
+            raise ValueError(
+                "The training loss of %s diverged at iteration %i of epoch %i."
+                % (self.options.output_dir, i, epoch)
+            )
+
+        self.writer_train.add_scalar(
+            "balanced_accuracy", results_train["balanced_accuracy"], global_step
+        )
+        self.writer_train.add_scalar("loss", mean_loss_train, global_step)
+        self.writer_valid.add_scalar(
+            "balanced_accuracy", results_valid["balanced_accuracy"], global_step
+        )
+        self.writer_valid.add_scalar("loss", self.mean_loss_valid, global_step)
+
+        row = [
+            epoch,
+            i,
+            time() - self.t_beginning,
+            results_train["balanced_accuracy"],
+            mean_loss_train,
+            results_valid["balanced_accuracy"],
+            self.mean_loss_valid,
+        ]
+        row_df = pd.DataFrame([row], columns=TRAINING_COLUMNS)
+        with open(self.filename, "a") as f:
+            row_df.to_csv(f, header=False, index=False, sep="\t")
+
+    def save(self, epoch, results_valid):
+        """Saves the checkpoints at the end of an epoch."""
+        accuracy_is_best = results_valid["balanced_accuracy"] > self.best_valid_accuracy
+        loss_is_best = self.mean_loss_valid < self.best_valid_loss
+        self.best_valid_accuracy = max(
+            results_valid["balanced_accuracy"], self.best_valid_accuracy
+        )
+        self.best_valid_loss = min(self.mean_loss_valid, self.best_valid_loss)
+
+        save_checkpoint(
+            {
+                "model": self.model.state_dict(),
+                "epoch": epoch,
+                "valid_loss": self.mean_loss_valid,
+                "valid_acc": results_valid["balanced_accuracy"],
+            },
+            accuracy_is_best,
+            loss_is_best,
+            self.model_dir,
+        )
+        # Save optimizer state_dict to be able to reload
+        save_checkpoint(
+            {
+                "optimizer": self.optimizer.state_dict(),
+                "epoch": epoch,
+                "name": self.options.optimizer,
+            },
+            False,
+            False,
+            self.model_dir,
+            filename="optimizer.pth.tar",
+        )
+
+    def close(self):
+        self.writer_train.close()
+        self.writer_valid.close()
+        for filename in ["optimizer.pth.tar", "checkpoint.pth.tar"]:
+            if path.exists(path.join(self.model_dir, filename)):
+                os.remove(path.join(self.model_dir, filename))
+        self.model = disable_activation_cache(self.model)
+
+
+def test_group(models, dataloader, use_cuda, criteria, mode="image"):
+    """
+    Computes the predictions and evaluation metrics of several models with one pass
+    on the data.
+
+    Args:
+        models: (list of Module) CNNs to be tested.
+        dataloader: (DataLoader) wrapper of a dataset.
+        use_cuda: (bool) if True a gpu is used.
+        criteria: (list of loss) function calculating the loss of each model.
+        mode: (str) input used by the networks. Chosen from ['image', 'patch', 'roi',
+            'slice'].
+    Returns
+        (list) for each model, the DataFrame of the results of each input and the
+            dict of the metrics + total loss on mode level, as given by test.
+    """
+    if mode == "image":
+        columns = ["participant_id", "session_id", "true_label", "predicted_label"]
+    elif mode in ["patch", "roi", "slice"]:
+        columns = [
+            "participant_id",
+            "session_id",
+            "%s_id" % mode,
+            "true_label",
+            "predicted_label",
+            "proba0",
+            "proba1",
+        ]
+    else:
+        raise ValueError("The mode %s is invalid." % mode)
+
+    for model in models:
+        model.eval()
+    dataloader.dataset.eval()
+
+    softmax = torch.nn.Softmax(dim=1)
+    rows = [list() for _ in models]
+    total_losses = [0] * len(models)
+    total_atlas_losses = [0] * len(models)
+    with torch.no_grad():
+        for data in dataloader:
+            if use_cuda:
+                inputs, labels = data["image"].cuda(), data["label"].cuda()
+            else:
+                inputs, labels = data["image"], data["label"]
+
+            for j, (model, criterion) in enumerate(zip(models, criteria)):
+                set_cache_batch(model, data, dataloader.dataset)
+                outputs = model(inputs)
+                if "atlas" in data:
+                    atlas_data = data["atlas"].to(inputs.device)
+                    atlas_output = outputs[:, -atlas_data.size(1) : :]
+                    outputs = outputs[:, : -atlas_data.size(1) :]
+                    total_atlas_losses[j] += torch.nn.MSELoss(reduction="sum")(
+                        atlas_output, atlas_data
+                    ).item()
+                total_losses[j] += criterion(outputs, labels).item()
+                _, predicted = torch.max(outputs.data, 1)
+
+                for idx, sub in enumerate(data["participant_id"]):
+                    if mode == "image":
+                        row = [
+                            sub,
+                            data["session_id"][idx],
+                            labels[idx].item(),
+                            predicted[idx].item(),
+                        ]
+                    else:
+                        normalized_output = softmax(outputs)
+                        row = [
+                            sub,
+                            data["session_id"][idx],
+                            data["%s_id" % mode][idx].item(),
+                            labels[idx].item(),
+                            predicted[idx].item(),
+                            normalized_output[idx, 0].item(),
+                            normalized_output[idx, 1].item(),
+                        ]
+                    rows[j].append(row)
+
+    results = list()
+    for j in range(len(models)):
+        results_df = pd.DataFrame(rows[j], columns=columns)
+        metrics_dict = evaluate_prediction(
+            results_df.true_label.values.astype(int),
+            results_df.predicted_label.values.astype(int),
+        )
+        metrics_dict["total_loss"] = total_losses[j]
+        metrics_dict["total_kl_loss"] = 0
+        metrics_dict["total_atlas_loss"] = total_atlas_losses[j]
+        results.append((results_df, metrics_dict))
+    torch.cuda.empty_cache()
+
+    return results
+
+
+def test_members(members, dataloader, mode="image", models=None):
+    """
+    Tests the members with test_group.
+
+    If the evaluation of the group raises an exception, the members are tested one
+    by one so that only the members raising it fail.
+
+    Args:
+        members: (list of SweepMember) members tested.
+        dataloader: (DataLoader) wrapper of a dataset.
+        mode: (str) input used by the networks.
+        models: (list of Module) models tested for each member. Default uses the
+            models in training.
+    Returns:
+        (list) for each member, the output of test_group, None if it failed.
+    """
+    options = members[0].options
+    if models is None:
+        models = [member.model for member in members]
+    try:
+        return test_group(
+            models,
+            dataloader,
+            options.gpu,
+            [member.criterion for member in members],
+            mode,
+        )
+    except Exception:
+        if len(members) == 1:
+            members[0].fail(traceback.format_exc())
+            return [None]
+
+    results = list()
+    for member, model in zip(members, models):
+        member_results = member.call(
+            test_group, [model], dataloader, options.gpu, [member.criterion], mode
+        )
+        results.append(None if member_results is None else member_results[0])
+    return results
+
+
+def evaluate_members(members, epoch, i, global_step, train_loader, valid_loader):
+    """
+    Evaluates the members in training on both sets and writes their metrics.
+
+    Returns:
+        (list) the validation metrics of each member, None if it failed.
+    """
+    options = members[0].options
+    results_train = test_members(members, train_loader)
+    results_valid = test_members(members, valid_loader)
+
+    metrics_list = list()
+    for member, result_train, result_valid in zip(
+        members, results_train, results_valid
+    ):
+        if result_train is None or result_valid is None or not member.active:
+            metrics_list.append(None)
+            continue
+        metrics_valid = result_valid[1]
+        member.call(
+            member.write_evaluation,
+            epoch,
+            i,
+            global_step,
+            result_train[1],
+            metrics_valid,
+            len(train_loader) * train_loader.batch_size,
+            len(valid_loader) * valid_loader.batch_size,
+        )
+        if not member.active:
+            metrics_list.append(None)
+            continue
+        member.logger.info(
+            "%s: %s level validation accuracy is %f at the end of iteration %d"
+            % (
+                member.options.output_dir,
+                options.mode,
+                metrics_valid["balanced_accuracy"],
+                i,
+            )
+        )
+        member.model.train()
+        metrics_list.append(metrics_valid)
+    train_loader.dataset.train()
+
+    return metrics_list
+
+
+def train_group(members, train_loader, valid_loader, logger):
+    """
+    Trains all the members of a sweep on the same batches until they all stop.
+
+    A member raising an exception is stopped and its traceback is kept in its
+    error attribute, the other members continue their training.
+
+    Args:
+        members: (list of SweepMember) models trained.
+        train_loader: (DataLoader) wrapper of the training dataset.
+        valid_loader: (DataLoader) wrapper of the validation dataset.
+        logger: Logger instance.
+    """
+    options = members[0].options
+    epoch = 0
+
+    while True:
+        training_members = [member for member in members if member.start_epoch(epoch)]
+        if len(training_members) == 0:
+            break
+        logger.info(
+            "Beginning epoch %i with %i models." % (epoch, len(training_members))
+        )
+        train_loader.dataset.train()
+
+        i = 0
+        for i, data in enumerate(train_loader, 0):
+            if options.gpu:
+                imgs, labels = data["image"].cuda(), data["label"].cuda()
+            else:
+                imgs, labels = data["image"], data["label"]
+            for member in training_members:
+                if member.active:
+                    member.call(
+                        member.train_step, data, imgs, labels, i, train_loader.dataset
+                    )
+            del imgs, labels
+            training_members = [member for member in training_members if member.active]
+            if len(training_members) == 0:
+                break
+
+            # evaluation_steps is a multiple of the accumulation steps of all members
+            # (checked by train_sweep)
+            if (
+                options.evaluation_steps != 0
+                and (i + 1) % options.evaluation_steps == 0
+            ):
+                evaluate_members(
+                    training_members,
+                    epoch,
+                    i,
+                    i + epoch * len(train_loader),
+                    train_loader,
+                    valid_loader,
+                )
+
+        # Always test the results and save them once at the end of the epoch
+        for member in training_members:
+            if member.active:
+                member.call(member.end_epoch)
+        training_members = [member for member in training_members if member.active]
+        if len(training_members) > 0:
+            metrics_valid = evaluate_members(
+                training_members,
+                epoch,
+                i,
+                (epoch + 1) * len(train_loader),
+                train_loader,
+                valid_loader,
+            )
+            for member, metrics in zip(training_members, metrics_valid):
+                if metrics is not None:
+                    member.call(member.save, epoch, metrics)
+
+        epoch += 1
+
+    for member in members:
+        member.call(member.close)
+
+
+def test_members_to_tsvs(members, fold, loaders, logger):
+    """
+    Evaluates the best models of the members and writes their predictions.
+
+    Members raising an exception fail, the predictions of the others are written.
+
+    Args:
+        members: (list of SweepMember) trained models.
+        fold: (int) index of the fold.
+        loaders: (dict) DataLoader of each subset ("train", "validation").
+        logger: Logger instance.
+    """
+    options = members[0].options
+    for selection in ["best_balanced_accuracy", "best_loss"]:
+        best_members = list()
+        models = list()
+        for member in members:
+            if member.error is not None:
+                continue
+            model_dir = path.join(
+                member.options.output_dir, "fold-%i" % fold, "models", selection
+            )
+            loaded = member.call(
+                load_model,
+                member.model,
+                model_dir,
+                gpu=options.gpu,
+                filename="model_best.pth.tar",
+            )
+            if loaded is not None:
+                best_members.append(member)
+                models.append(loaded[0])
+        if len(best_members) == 0:
+            continue
+
+        for subset_name, loader in loaders.items():
+            kept = [
+                (member, model)
+                for member, model in zip(best_members, models)
+                if member.error is None
+            ]
+            if len(kept) == 0:
+                break
+            best_members, models = zip(*kept)
+            results = test_members(best_members, loader, options.mode, models=models)
+            for member, result in zip(best_members, results):
+                if result is None:
+                    continue
+                results_df, metrics = result
+                member.call(
+                    results_to_tsvs,
+                    member.options.output_dir,
+                    results_df,
+                    metrics,
+                    subset_name,
+                    fold,
+                    selection,
+                    options.mode,
+                    logger,
+                    member.options.selection_threshold,
+                    elem_per_image=loader.dataset.elem_per_image,
+                    file_format=member.options.prediction_format,
+                )
+
+
+def train_sweep(options_list, erase_existing=True):
+    """
+    Trains several single CNNs with one input pipeline and writes for each of them
+    the same outputs as train_single_cnn.
+
+    A training which fails does not interrupt the others. The outcome of each
+    training is written in <output_dir>/sweep_status.json (see write_status).
+
+    Args:
+        options_list: (list of Namespace) options of the trainings. Their input
+            pipelines must be identical (see SHARED_OPTIONS).
+        erase_existing: (bool) if True the output folders are cleaned first.
+    """
+    main_logger = return_logger(options_list[0].verbose, "main process")
+    train_logger = return_logger(options_list[0].verbose, "train")
+    eval_logger = return_logger(options_list[0].verbose, "final evaluation")
+
+    keys = set(sweep_key(options) for options in options_list)
+    if None in keys or len(keys) > 1:
+        raise ValueError(
+            "Only single CNNs sharing the following options can be trained in the "
+            "same sweep: %s." % ", ".join(SHARED_OPTIONS)
+        )
+
+    translated_list = list()
+    # Traceback of the failure of each training, indexed by output folder
+    errors = dict()
+    for options in options_list:
+        if erase_existing:
+            check_and_clean(options.output_dir)
+        elif path.exists(path.join(options.output_dir, STATUS_FILENAME)):
+            os.remove(path.join(options.output_dir, STATUS_FILENAME))
+        commandline_to_json(options, logger=main_logger)
+        write_requirements_version(options.output_dir)
+        translated_list.append(translate_parameters(options))
+        # Models are evaluated at the same iterations, after an update of all of them
+        if (
+            options.evaluation_steps != 0
+            and options.evaluation_steps % options.accumulation_steps != 0
+        ):
+            errors[options.output_dir] = (
+                "evaluation_steps (%i) must be a multiple of accumulation_steps (%i)."
+                % (options.evaluation_steps, options.accumulation_steps)
+            )
+            main_logger.error(
+                "Training of %s failed: %s"
+                % (options.output_dir, errors[options.output_dir])
+            )
+    params = translated_list[0]
+
+    train_transforms, all_transforms = get_transforms(
+        params.mode,
+        minmaxnormalization=params.minmaxnormalization,
+        data_augmentation=params.data_augmentation,
+    )
+
+    if params.split is None:
+        if params.n_splits is None:
+            fold_iterator = range(1)
+        else:
+            fold_iterator = range(params.n_splits)
+    else:
+        fold_iterator = params.split
+
+    for fi in fold_iterator:
+        main_logger.info("Fold %i" % fi)
+
+        training_df, valid_df = load_data(
+            params.tsv_path,
+            params.diagnoses,
+            fi,
+            n_splits=params.n_splits,
+            baseline=params.baseline,
+            logger=main_logger,
+            multi_cohort=params.multi_cohort,
+        )
+
+        data_train = return_dataset(
+            params.mode,
+            params.input_dir,
+            training_df,
+            params.preprocessing,
+            train_transformations=train_transforms,
+            all_transformations=all_transforms,
+            prepare_dl=params.prepare_dl,
+            multi_cohort=params.multi_cohort,
+            params=params,
+        )
+        data_valid = return_dataset(
+            params.mode,
+            params.input_dir,
+            valid_df,
+            params.preprocessing,
+            train_transformations=train_transforms,
+            all_transformations=all_transforms,
+            prepare_dl=params.prepare_dl,
+            multi_cohort=params.multi_cohort,
+            params=params,
+        )
+
+        train_sampler = generate_sampler(data_train, params.sampler)
+
+        train_loader = DataLoader(
+            data_train,
+            batch_size=params.batch_size,
+            sampler=train_sampler,
+            num_workers=params.num_workers,
+            pin_memory=True,
+        )
+
+        valid_loader = DataLoader(
+            data_valid,
+            batch_size=params.batch_size,
+            shuffle=False,
+            num_workers=params.num_workers,
+            pin_memory=True,
+        )
+
+        members = list()
+        for options in translated_list:
+            if options.output_dir in errors:
+                continue
+            try:
+                members.append(
+                    SweepMember(
+                        options,
+                        fi,
+                        data_train.size,
+                        len_atlas=data_train.len_atlas(),
+                        logger=train_logger,
+                    )
+                )
+            except Exception:
+                errors[options.output_dir] = traceback.format_exc()
+                main_logger.error(
+                    "Initialization of %s failed:\n%s"
+                    % (options.output_dir, errors[options.output_dir])
+                )
+        if len(members) == 0:
+            break
+        main_logger.info("Initialization of %i models" % len(members))
+
+        main_logger.debug("Beginning the training task")
+        train_group(members, train_loader, valid_loader, train_logger)
+
+        test_members_to_tsvs(
+            members,
+            fi,
+            {"train": train_loader, "validation": valid_loader},
+            eval_logger,
+        )
+        for member in members:
+            if member.error is not None:
+                errors[member.options.output_dir] = member.error
+
+    for options in translated_list:
+        write_status(options.output_dir, errors.get(options.output_dir))
+
+
+def write_status(output_dir, error=None):
+    """
+    Writes the outcome of a training of a sweep in <output_dir>/sweep_status.json.
+
+    Args:
+        output_dir: (str) output folder of the training.
+        error: (str) traceback of the failure, None if the training is done.
+    """
+    status = {"status": "done" if error is None else "failed", "error": error}
+    with open(path.join(output_dir, STATUS_FILENAME), "w") as f:
+        json.dump(status, f, indent=4)
+
+
+def read_status(output_dir):
+    """
+    Reads the outcome of a training of a sweep.
+
+    Args:
+        output_dir: (str) output folder of the training.
+    Returns:
+        (dict) status ("done" or "failed") and error of the training, None if the
+            sweep did not write it.
+    """
+    status_path = path.join(output_dir, STATUS_FILENAME)
+    if not path.exists(status_path):
+        return None
+    with open(status_path, "r") as f:
+        return json.load(f)
+
+
+def train_sweep_from_json(json_paths, output_dir, verbose=0):
+    """
+    Trains the CNNs defined in JSON files with one input pipeline.
+
+    Args:
+        json_paths: (list of str) JSON files defining the trainings.
+        output_dir: (str) folder in which the output folder of each training is
+            created, with the name of its JSON file.
+        verbose: (int) level of verbosity.
+    """
+    options_list = list()
+    for json_path in json_paths:
+        options = argparse.Namespace()
+        options = read_json(options, json_path=json_path, read_computational=True)
+        check_and_complete(options)
+        name = path.splitext(path.basename(json_path))[0]
+        options.output_dir = path.join(output_dir, name)
+        options.verbose = verbose
+        options_list.append(options)
+
+    train_sweep(options_list)
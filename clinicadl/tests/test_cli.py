@@ -13,10 +13,19 @@ import clinicadl.cli as cli
         "generate",
         "quality_check",
         "classify",
+        "classify_cache",
+        "classify_merge",
+        "export",
+        "export_quantize",
+        "encode",
+        "random_search_run",
+        "random_search_run_halving",
+        "random_search_run_group",
         "train_subject",
         "train_slice",
         "train_patch",
         "train_multipatch",
+        "train_autoencoder_unpooling",
     ]
 )
 def generate_cli_commands(request):
@@ -93,7 +102,8 @@ def generate_cli_commands(request):
             '/dir/output/',
             '--n_subjects', '10',
             '--mean', '0.5',
-            '--sigma', '0.5']
+            '--sigma', '0.5',
+            '--seed', '42']
         keys_output = [
             'task',
             'mode',
@@ -102,7 +112,8 @@ def generate_cli_commands(request):
             'output_dir',
             'n_subjects',
             'mean',
-            'sigma']
+            'sigma',
+            'seed']
 
     if request.param == 'classify':
         test_input = [
@@ -120,6 +131,132 @@ def generate_cli_commands(request):
             'prefix_output'
         ]
 
+    if request.param == 'classify_cache':
+        test_input = [
+            'classify',
+            '/dir/caps',
+            '/dir/tsv_file',
+            '/dir/model_path/',
+            'DB_XXXXX',
+            '--use_cache',
+            '--cache_fingerprint', 'hash'
+        ]
+        keys_output = [
+            'task',
+            'caps_directory',
+            'tsv_path',
+            'model_path',
+            'prefix_output',
+            'cache_fingerprint'
+        ]
+
+    if request.param == 'classify_merge':
+        test_input = [
+            'classify-merge',
+            '/dir/model_path/',
+            'DB_XXXXX'
+        ]
+        keys_output = [
+            'task',
+            'model_path',
+            'prefix_output'
+        ]
+
+    if request.param == 'export':
+        test_input = [
+            'export',
+            '/dir/model_path/',
+            '--caps_dir', '/dir/caps'
+        ]
+        keys_output = [
+            'task',
+            'model_path',
+            'caps_dir'
+        ]
+
+    if request.param == 'export_quantize':
+        test_input = [
+            'export',
+            '/dir/model_path/',
+            '--quantize', 'int8',
+            '--n_calibration', '16'
+        ]
+        keys_output = [
+            'task',
+            'model_path',
+            'quantize',
+            'n_calibration'
+        ]
+
+    if request.param == 'encode':
+        test_input = [
+            'encode',
+            '/dir/caps',
+            '/dir/tsv_path/',
+            '/dir/model_path/',
+            'latents',
+            '--batch_size', '8'
+        ]
+        keys_output = [
+            'task',
+            'caps_directory',
+            'tsv_path',
+            'model_path',
+            'prefix_output',
+            'batch_size'
+        ]
+
+    if request.param == 'random_search_run':
+        test_input = [
+            'random-search',
+            'run',
+            '/dir/launch_dir/',
+            '--n_jobs', '20',
+            '--workers', '4'
+        ]
+        keys_output = [
+            'task',
+            'random_task',
+            'launch_dir',
+            'n_jobs',
+            'workers'
+        ]
+
+    if request.param == 'random_search_run_halving':
+        test_input = [
+            'random-search',
+            'run',
+            '/dir/launch_dir/',
+            '--halving',
+            '--min_epochs', '2',
+            '--reduction_factor', '3',
+            '--n_replacements', '10'
+        ]
+        keys_output = [
+            'task',
+            'random_task',
+            'launch_dir',
+            'min_epochs',
+            'reduction_factor',
+            'n_replacements'
+        ]
+
+    if request.param == 'random_search_run_group':
+        test_input = [
+            'random-search',
+            'run',
+            '/dir/launch_dir/',
+            '--workers', '2',
+            '--group_size', '4'
+        ]
+        keys_output = [
+            'task',
+            'random_task',
+            'launch_dir',
+            'workers',
+            'group_size'
+        ]
+
     if request.param == 'train_slice':
         test_input = [
             'train',
@@ -197,6 +334,27 @@ def generate_cli_commands(request):
             'tsv_path',
             'output_dir',
             'model']
+    if request.param == 'train_autoencoder_unpooling':
+        test_input = [
+            'train',
+            'image',
+            'autoencoder',
+            '/dir/caps',
+            't1-linear',
+            '/dir/tsv_path/',
+            '/dir/output/',
+            'Conv5_FC3',
+            '--unpooling', 'compact']
+        keys_output = [
+            'task',
+            'mode',
+            'network_type',
+            'caps_dir',
+            'preprocessing',
+            'tsv_path',
+            'output_dir',
+            'model',
+            'unpooling']
     # fmt: on
 
     return test_input, keys_output
@@ -0,0 +1,129 @@
+# coding: utf8
+
+from argparse import Namespace
+
+import pytest
+import torch
+from torch import nn
+
+from clinicadl.tools.deep_learning.models.complexity import (
+    build_on_meta,
+    estimate_complexity,
+    estimate_random_complexity,
+    fits_budget,
+    meta_available,
+)
+from clinicadl.tools.deep_learning.models.image_level import Conv5_FC3
+from clinicadl.tools.deep_learning.models.modules import (
+    PadMaxPool3d,
+    compress_indices,
+    expand_offsets,
+)
+from clinicadl.tools.deep_learning.models.random import RandomArchitecture
+
+
+@pytest.mark.parametrize("shape", [(7, 9, 11), (8, 5, 13), (1, 3, 2)])
+def test_offsets_round_trip_padded(shape):
+    torch.manual_seed(0)
+    x = torch.randn(2, 3, *shape)
+    pool = PadMaxPool3d(2, 2, return_indices=True, return_pad=True)
+
+    _, indices, pad = pool(x)
+    input_shape = tuple(size + coord for size, coord in zip(shape, pad[-2::-2]))
+    offsets = compress_indices(indices, input_shape, pool.kernel_size, pool.stride)
+
+    assert offsets.dtype == torch.uint8
+    assert torch.equal(
+        expand_offsets(offsets, input_shape, pool.kernel_size, pool.stride), indices
+    )
+
+
+@pytest.mark.parametrize(
+    "pool, shape",
+    [
+        (nn.MaxPool3d(3, 2, return_indices=True), (9, 7, 11)),
+        (nn.MaxPool3d((3, 1, 2), (2, 1, 2), return_indices=True), (5, 3, 8)),
+        (nn.MaxPool2d(3, 3, return_indices=True), (11, 13)),
+    ],
+)
+def test_offsets_round_trip(pool, shape):
+    torch.manual_seed(0)
+    x = torch.randn(2, 3, *shape)
+
+    _, indices = pool(x)
+    offsets = compress_indices(indices, shape, pool.kernel_size, pool.stride)
+
+    assert torch.equal(
+        expand_offsets(offsets, shape, pool.kernel_size, pool.stride), indices
+    )
+
+
+def test_complexity_conv5_fc3():
+    initial_shape = (1, 169, 208, 179)
+    model = build_on_meta(Conv5_FC3)
+    if meta_available():
+        assert all(parameter.is_meta for parameter in model.parameters())
+    complexity = estimate_complexity(model, initial_shape)
+
+    # Convolutions and batch normalizations, then the three linear layers
+    n_features = 240 + 3504 + 13920 + 55488 + 221568
+    n_classifier = (128 * 6 * 7 * 6 + 1) * 1300 + (1300 + 1) * 50 + (50 + 1) * 2
+    assert complexity["n_parameters"] == n_features + n_classifier == 42293972
+    assert complexity["n_trainable_parameters"] == complexity["n_parameters"]
+    assert complexity["parameters_memory"] == 4 * complexity["n_parameters"]
+    assert complexity["backward_flops"] == 2 * complexity["forward_flops"]
+
+
+def test_complexity_linear():
+    model = nn.Linear(10, 5)
+
+    complexity = estimate_complexity(model, (10,), batch_size=4, optimizer="Adam")
+
+    assert complexity["forward_flops"] == 2 * 4 * 5 * 10
+    assert complexity["activations_memory"] == 4 * 5 * 4
+    # Parameters, gradients and two Adam states, then the input and activations
+    assert complexity["peak_training_memory"] == 4 * 55 * 4 + 4 * 10 * 4 + 4 * 5 * 4
+    assert fits_budget(complexity, memory_budget=1.2e-6, flops_budget=1.3e-6)
+    assert not fits_budget(complexity, memory_budget=1.1e-6)
+    assert not fits_budget(complexity, flops_budget=1.1e-6)
+
+
+@pytest.mark.parametrize("normalization", ["BatchNorm", "InstanceNorm", None])
+@pytest.mark.parametrize("initial_shape", [(1, 13, 9, 11), (2, 13, 10)])
+def test_random_complexity(normalization, initial_shape):
+    convolutions = {
+        "conv0": {
+            "in_channels": None,
+            "out_channels": 4,
+            "n_conv": 2,
+            "d_reduction": "MaxPooling",
+        },
+        "conv1": {
+            "in_channels": 4,
+            "out_channels": 8,
+            "n_conv": 1,
+            "d_reduction": "stride",
+        },
+        "conv2": {
+            "in_channels": 8,
+            "out_channels": 16,
+            "n_conv": 3,
+            "d_reduction": "MaxPooling",
+        },
+    }
+    options = Namespace(
+        convolutions=convolutions,
+        n_fcblocks=2,
+        network_normalization=normalization,
+        batch_size=3,
+        optimizer="SGD",
+    )
+    model = RandomArchitecture(
+        convolutions, 2, initial_shape, network_normalization=normalization
+    )
+
+    complexity = estimate_complexity(
+        model, initial_shape, batch_size=3, optimizer="SGD"
+    )
+
+    assert estimate_random_complexity(options, initial_shape) == complexity
@@ -0,0 +1,247 @@
+# coding: utf8
+
+import logging
+import os
+from argparse import Namespace
+
+import pandas as pd
+import pytest
+
+import clinicadl.classify.inference as inference
+from clinicadl.classify.prediction_cache import (
+    CACHE_FILENAME,
+    PredictionCache,
+    merge_cached_predictions,
+)
+from clinicadl.interpret.predictions import find_image_predictions
+
+selection = "best_balanced_accuracy"
+
+
+class ImageDataset:
+    """Minimal image-level dataset locating one file per session in a folder."""
+
+    mode = "image"
+    diagnosis_code = {"CN": 0, "AD": 1}
+
+    def __init__(self, image_dir):
+        self.image_dir = image_dir
+
+    def _get_path(self, participant, session, cohort, mode="image"):
+        return os.path.join(self.image_dir, "%s_%s.pt" % (participant, session))
+
+    def __len__(self):
+        return 0
+
+
+def write_sessions(tmp_path, sessions):
+    image_dir = tmp_path / "images"
+    image_dir.mkdir(exist_ok=True)
+    for participant, session, _ in sessions:
+        (image_dir / ("%s_%s.pt" % (participant, session))).write_bytes(
+            participant.encode()
+        )
+    data_df = pd.DataFrame(
+        sessions, columns=["participant_id", "session_id", "diagnosis"]
+    )
+    data_df["cohort"] = "single"
+    return data_df, ImageDataset(str(image_dir))
+
+
+def write_model(tmp_path):
+    model_dir = tmp_path / "model" / "fold-0" / "models" / selection
+    model_dir.mkdir(parents=True)
+    (model_dir / "model_best.pth.tar").write_bytes(b"checkpoint")
+    return str(tmp_path / "model"), str(model_dir)
+
+
+def test_classify_cache_read_by_interpret(tmp_path, monkeypatch):
+    data_df, dataset = write_sessions(
+        tmp_path, [("sub-01", "ses-M00", "AD"), ("sub-02", "ses-M00", "CN")]
+    )
+    model_path, model_dir = write_model(tmp_path)
+    results_df = pd.DataFrame(
+        {
+            "participant_id": ["sub-01", "sub-02"],
+            "session_id": ["ses-M00", "ses-M00"],
+            "true_label": [1, 0],
+            "predicted_label": [1, 1],
+        }
+    )
+    calls = list()
+
+    def load_best_model(model_dir, model_options, input_size, logger):
+        return None, os.path.join(model_dir, "model_best.pth.tar"), "float32"
+
+    def test(model, dataloader, use_cuda, criterion, mode="image", use_labels=True):
+        calls.append(mode)
+        return results_df, {"total_loss": 0, "total_kl_loss": 0, "total_atlas_loss": 0}
+
+    monkeypatch.setattr(inference, "_load_best_model", load_best_model)
+    monkeypatch.setattr(inference, "test", test)
+    dataset.size = (1, 2, 2, 2)
+    model_options = Namespace(use_cpu=True, mode="image", batch_size=1, nproc=0)
+
+    cache = inference.PredictionCache(os.path.join(model_path, CACHE_FILENAME), "hash")
+    try:
+        for _ in range(2):
+            inference._predict(
+                lambda df: dataset, data_df, model_dir, model_options, None, cache=cache
+            )
+    finally:
+        cache.close()
+    # The second classification only reads the cache
+    assert calls == ["image"]
+
+    predictions_df = find_image_predictions(
+        model_path, "fold-0", selection, data_df, dataset, logging
+    )
+    assert predictions_df is not None
+    assert list(predictions_df.predicted_label) == [1, 1]
+    assert list(predictions_df.true_label) == [1, 0]
+
+
+def test_store_split_round_trip(tmp_path):
+    data_df, dataset = write_sessions(
+        tmp_path,
+        [
+            ("sub-01", "ses-M00", "AD"),
+            ("sub-02", "ses-M00", "CN"),
+            ("sub-03", "ses-M00", "CN"),
+        ],
+    )
+    results_df = pd.DataFrame(
+        {
+            "participant_id": ["sub-01", "sub-01", "sub-02", "sub-02"],
+            "session_id": ["ses-M00"] * 4,
+            "roi_id": [0, 1, 0, 1],
+            "true_label": [1, 1, 0, 0],
+            "predicted_label": [1, 0, 0, 0],
+            "proba0": [0.2, 0.6, 0.9, 0.7],
+            "proba1": [0.8, 0.4, 0.1, 0.3],
+        }
+    )
+
+    cache = PredictionCache(str(tmp_path / CACHE_FILENAME))
+    try:
+        image_keys = cache.image_keys(dataset, data_df)
+        cache.store(results_df, data_df[:2], image_keys[:2], "model:float32", "roi")
+        cached_df, missing_df, missing_keys = cache.split(
+            data_df, image_keys, "model:float32", "roi"
+        )
+    finally:
+        cache.close()
+
+    pd.testing.assert_frame_equal(cached_df[results_df.columns], results_df)
+    assert list(missing_df.participant_id) == ["sub-03"]
+    assert missing_keys == image_keys[2:]
+
+
+@pytest.mark.parametrize("fingerprint", ["mtime", "hash"])
+def test_fingerprint_invalidation(tmp_path, fingerprint):
+    data_df, dataset = write_sessions(
+        tmp_path, [("sub-01", "ses-M00", "AD"), ("sub-02", "ses-M00", "CN")]
+    )
+    image_path = dataset._get_path("sub-01", "ses-M00", "single")
+    results_df = pd.DataFrame(
+        {
+            "participant_id": ["sub-01", "sub-02"],
+            "session_id": ["ses-M00", "ses-M00"],
+            "true_label": [1, 0],
+            "predicted_label": [1, 0],
+        }
+    )
+    cache_path = str(tmp_path / CACHE_FILENAME)
+
+    cache = PredictionCache(cache_path, fingerprint)
+    try:
+        cache.store(
+            results_df,
+            data_df,
+            cache.image_keys(dataset, data_df),
+            "model:float32",
+            "image",
+        )
+
+        def missing_participants(model_key="model:float32"):
+            image_keys = cache.image_keys(dataset, data_df)
+            _, missing_df, _ = cache.split(data_df, image_keys, model_key, "image")
+            return list(missing_df.participant_id)
+
+        assert missing_participants() == []
+        # Same content, new modification time
+        mtime = os.stat(image_path).st_mtime_ns
+        os.utime(image_path, ns=(mtime + 10 ** 9, mtime + 10 ** 9))
+        assert missing_participants() == (["sub-01"] if fingerprint == "mtime" else [])
+        # New content
+        with open(image_path, "ab") as f:
+            f.write(b" modified")
+        assert missing_participants() == ["sub-01"]
+        # Other precision of the same model
+        assert missing_participants("model:int8-dynamic") == ["sub-01", "sub-02"]
+    finally:
+        cache.close()
+
+    # Readers which do not choose a fingerprint use the one of the cache
+    cache = PredictionCache(cache_path)
+    assert cache.fingerprint == fingerprint
+    cache.close()
+
+
+def test_model_key(tmp_path):
+    model_path = str(tmp_path / "model_best.pth.tar")
+    with open(model_path, "wb") as f:
+        f.write(b"checkpoint")
+
+    cache = PredictionCache(str(tmp_path / CACHE_FILENAME))
+    try:
+        key = cache.model_key(model_path)
+        assert key.endswith(":float32")
+        assert cache.model_key(model_path, "int8-dynamic") != key
+        with open(model_path, "ab") as f:
+            f.write(b" retrained")
+        assert cache.model_key(model_path) != key
+    finally:
+        cache.close()
+
+
+def test_merge_cached_predictions():
+    data_df = pd.DataFrame(
+        {
+            "participant_id": ["sub-01", "sub-02", "sub-03"],
+            "session_id": ["ses-M00"] * 3,
+            "diagnosis": ["AD", "CN", "AD"],
+        }
+    )
+    cached_df = pd.DataFrame(
+        {
+            "participant_id": ["sub-02"],
+            "session_id": ["ses-M00"],
+            "true_label": [0],
+            "predicted_label": [0],
+        }
+    )
+    results_df = pd.DataFrame(
+        {
+            "participant_id": ["sub-03", "sub-01"],
+            "session_id": ["ses-M00", "ses-M00"],
+            "true_label": [1, 1],
+            "predicted_label": [0, 1],
+        }
+    )
+    metrics = {"total_loss": 1.5, "total_kl_loss": 0, "total_atlas_loss": 0}
+
+    merged_df, merged_metrics = merge_cached_predictions(
+        data_df, cached_df, results_df, metrics, "image"
+    )
+    assert list(merged_df.participant_id) == ["sub-01", "sub-02", "sub-03"]
+    assert list(merged_df.predicted_label) == [1, 0, 0]
+    assert merged_metrics["balanced_accuracy"] == 0.75
+    # Only the inputs given to the network count in the losses
+    assert merged_metrics["total_loss"] == 1.5
+
+    merged_df, merged_metrics = merge_cached_predictions(
+        data_df, cached_df, None, None, "image", labels=False
+    )
+    assert list(merged_df.participant_id) == ["sub-02"]
+    assert merged_metrics is None
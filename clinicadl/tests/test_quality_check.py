@@ -0,0 +1,159 @@
+# coding: utf8
+
+import os
+
+import nibabel as nib
+import numpy as np
+import pytest
+import torch
+
+from clinicadl.quality_check.t1_linear.utils import QCDataset, transform_batch
+from clinicadl.quality_check.t1_volume.utils import (
+    _init_worker,
+    _mutual_information,
+    _prepare_template,
+    _session_metrics,
+)
+from clinicadl.quality_check.utils import QCStore
+
+
+def reference_transform(image, transform):
+    """Transform of the slices given to the QC model by previous versions of ClinicaDL."""
+    sample = (image - image.min()) * (1.0 / (image.max() - image.min())) - 0.5
+    sz = sample.shape
+    input_images = [
+        sample[:, :, int(sz[2] / 2)],
+        sample[int(sz[0] / 2), :, :],
+        sample[:, int(sz[1] / 2), :],
+    ]
+    output_images = list()
+    for input_image in input_images:
+        _scale = min(256.0 / input_image.shape[0], 256.0 / input_image.shape[1])
+        image_slice = transform.rescale(
+            input_image[::-1, :], _scale, mode="constant", clip=False
+        )
+        sz = image_slice.shape
+        dummy = np.zeros((256, 256))
+        dummy[
+            int((256 - sz[0]) / 2) : int((256 - sz[0]) / 2) + sz[0],
+            int((256 - sz[1]) / 2) : int((256 - sz[1]) / 2) + sz[1],
+        ] = image_slice
+        output_images.append(np.flip(np.rot90(dummy[16:240, 16:240]), axis=1))
+
+    return np.stack(output_images)
+
+
+@pytest.mark.parametrize("shape", [(169, 208, 179), (121, 145, 121)])
+def test_transform_parity(shape):
+    transform = pytest.importorskip("skimage.transform")
+    rng = np.random.default_rng(0)
+    image = rng.random(shape).astype(np.float32)
+
+    sample = QCDataset.extract_slices(torch.from_numpy(image))
+    data = {view: image_slice.unsqueeze(0) for view, image_slice in sample.items()}
+    slices = transform_batch(data)[0].numpy()
+
+    assert slices.shape == (3, 224, 224)
+    reference = reference_transform(image.astype(np.float64), transform)
+    assert np.abs(slices - reference).max() < 1e-5
+
+
+def write_images(tmp_path, n_sessions):
+    sessions = list()
+    for i in range(n_sessions):
+        image_path = str(tmp_path / ("sub-%02i_ses-M00.nii.gz" % i))
+        with open(image_path, "wb") as f:
+            f.write(b"image %i" % i)
+        sessions.append(("sub-%02i" % i, "ses-M00", image_path))
+    return sessions
+
+
+def run_store(store_file, sessions, checksum="model-1"):
+    store = QCStore(store_file, ["score"], checksum)
+    pending = store.pending(sessions)
+    for participant_id, session_id, _ in pending:
+        store.add(participant_id, session_id, [float(participant_id[4:])])
+    return pending, store
+
+
+def test_store_unchanged(tmp_path):
+    store_file = str(tmp_path / "QC_store.tsv")
+    sessions = write_images(tmp_path, 3)
+
+    pending, _ = run_store(store_file, sessions)
+    assert pending == sessions
+    pending, store = run_store(store_file, sessions)
+    assert pending == []
+    assert list(store.results(sessions).score) == [0.0, 1.0, 2.0]
+
+
+def test_store_stamps(tmp_path):
+    store_file = str(tmp_path / "QC_store.tsv")
+    sessions = write_images(tmp_path, 3)
+    run_store(store_file, sessions)
+
+    # Modification time of the first image, size of the second one
+    mtime = os.stat(sessions[0][2]).st_mtime_ns
+    os.utime(sessions[0][2], ns=(mtime + 10 ** 9, mtime + 10 ** 9))
+    with open(sessions[1][2], "ab") as f:
+        f.write(b" modified")
+    pending, _ = run_store(store_file, sessions)
+    assert pending == sessions[:2]
+
+    pending, _ = run_store(store_file, sessions, checksum="model-2")
+    assert pending == sessions
+
+
+def test_store_results_last_row(tmp_path):
+    store_file = str(tmp_path / "QC_store.tsv")
+    sessions = write_images(tmp_path, 2)
+    store = QCStore(store_file, ["score"], "model-1")
+    store.pending(sessions)
+    store.add("sub-00", "ses-M00", [0.1])
+    store.add("sub-01", "ses-M00", [0.2])
+    store.add("sub-00", "ses-M00", [0.3])
+
+    results_df = store.results()
+    assert len(results_df) == 2
+    assert dict(zip(results_df.participant_id, results_df.score)) == {
+        "sub-00": 0.3,
+        "sub-01": 0.2,
+    }
+    # The replaced rows are also removed from the file
+    assert len(QCStore(store_file, ["score"], "model-1").store_df) == 2
+
+
+def reference_nmi(image1, image2):
+    """Normalized mutual information computed by previous versions of ClinicaDL."""
+    hist_inter, _, _ = np.histogram2d(image1.ravel(), image2.ravel())
+    hist1, _, _ = np.histogram2d(image1.ravel(), image1.ravel())
+    hist2, _, _ = np.histogram2d(image2.ravel(), image2.ravel())
+
+    return (
+        2
+        * _mutual_information(hist_inter)
+        / (_mutual_information(hist1) + _mutual_information(hist2))
+    )
+
+
+@pytest.mark.parametrize("seed", [0, 1, 2])
+def test_session_metrics(tmp_path, seed):
+    rng = np.random.default_rng(seed)
+    shape = (12, 14, 10)
+    segmentation = (rng.random(shape) * (rng.random(shape) > 0.7)).astype(np.float32)
+    template = rng.random(shape + (2,)).astype(np.float32).sum(axis=3)
+    image = (rng.random(shape) * (rng.random(shape) > 0.2)).astype(np.float32)
+    image_path = str(tmp_path / "sub-01_ses-M00.nii.gz")
+    nib.save(nib.Nifti1Image(image, np.eye(4)), image_path)
+
+    _init_worker(_prepare_template(segmentation, template))
+    row = _session_metrics(("sub-01", "ses-M00", image_path))
+
+    segmentation = segmentation.astype(np.float64)
+    template_values = template.astype(np.float64) * segmentation
+    image_values = image.astype(np.float64) * segmentation
+    expected_nmi = reference_nmi(template_values, image_values)
+    assert row[:2] == ["sub-01", "ses-M00"]
+    assert row[2] == pytest.approx(np.max(image))
+    assert row[3] == pytest.approx(np.count_nonzero(image) / image.size)
+    assert abs(row[4] - expected_nmi) < 1e-6
@@ -61,8 +61,13 @@ def test_random_search(cli_commands):
         analysis_flag = analysis_flag and os.path.exists(
             os.path.join(launch_dir, f"analysis_{metric}.tsv")
         )
+        analysis_flag = analysis_flag and os.path.exists(
+            os.path.join(launch_dir, f"analysis_best_{metric}.tsv")
+        )
+    index_flag = os.path.exists(os.path.join(launch_dir, "random_search.db"))
     assert flag_error_generate
     assert performances_flag
     assert flag_error_log
     assert analysis_flag
+    assert index_flag
     shutil.rmtree(launch_dir)
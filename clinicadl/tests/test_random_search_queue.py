@@ -0,0 +1,107 @@
+# coding: utf8
+
+import os
+from argparse import Namespace
+
+import pandas as pd
+
+from clinicadl.train.random_search_queue import (
+    QUEUE_DIRNAME,
+    RUNGS_FILENAME,
+    JobQueue,
+    SuccessiveHalving,
+)
+
+
+def job_options(**kwargs):
+    options = {
+        "network_type": "cnn",
+        "mode": "image",
+        "preprocessing": "t1-linear",
+        "tsv_path": "data/labels_list",
+        "batch_size": 2,
+        "learning_rate": 1e-4,
+    }
+    options.update(kwargs)
+    return Namespace(**options)
+
+
+def test_claim_once(tmp_path):
+    queue = JobQueue(str(tmp_path))
+    other_queue = JobQueue(str(tmp_path))
+    queue.submit("job-000", job_options())
+
+    assert queue.claim() == "job-000"
+    assert other_queue.claim() is None
+    assert queue.jobs("running") == ["job-000"]
+
+
+def test_claim_race(tmp_path):
+    queue = JobQueue(str(tmp_path))
+    other_queue = JobQueue(str(tmp_path))
+    queue.submit("job-000", job_options())
+    # Both launchers list the pending job before one of them claims it
+    pending = queue.jobs("pending")
+    other_queue.jobs = lambda state: pending
+
+    assert queue.claim() == "job-000"
+    assert other_queue.claim() is None
+    assert queue.jobs("pending") == []
+
+
+def test_claim_group(tmp_path):
+    queue = JobQueue(str(tmp_path))
+    queue.submit("job-000", job_options())
+    queue.submit("job-001", job_options(batch_size=8))
+    queue.submit("job-002", job_options(learning_rate=1e-3))
+    queue.submit("job-003", job_options(learning_rate=1e-5))
+
+    assert queue.claim_group(2) == ["job-000", "job-002"]
+    assert queue.claim_group(2) == ["job-001"]
+    assert queue.claim_group(2) == ["job-003"]
+    assert queue.claim_group(2) == []
+
+
+def training(losses):
+    return pd.DataFrame({"epoch": range(len(losses)), "loss_valid": losses})
+
+
+def test_halving_promotion(tmp_path):
+    JobQueue(str(tmp_path))
+    rungs_df = pd.DataFrame(
+        {
+            "name": ["job-000", "job-001", "job-002"],
+            "rung": [1, 1, 1],
+            "value": [0.1, 0.5, 0.9],
+        }
+    )
+    rungs_df.to_csv(
+        os.path.join(str(tmp_path), QUEUE_DIRNAME, RUNGS_FILENAME),
+        sep="\t",
+        index=False,
+    )
+    scheduler = SuccessiveHalving(
+        str(tmp_path), min_epochs=1, reduction_factor=3, metric="loss"
+    )
+
+    # Best of the four jobs at the first rung, so it is promoted
+    assert not scheduler.report("job-003", training([0.05]), epochs=9)
+    # Not in the best third of the five jobs
+    assert scheduler.report("job-004", training([0.7]), epochs=9)
+    # A rung is only recorded once for a job
+    assert not scheduler.report("job-003", training([0.05, 0.04]), epochs=9)
+    assert len(scheduler.records) == 5
+
+
+def test_halving_shared_records(tmp_path):
+    JobQueue(str(tmp_path))
+    scheduler = SuccessiveHalving(str(tmp_path), reduction_factor=2, metric="loss")
+    other_scheduler = SuccessiveHalving(
+        str(tmp_path), reduction_factor=2, metric="loss"
+    )
+
+    assert not scheduler.report("job-000", training([0.2]), epochs=4)
+    # The record of the other launcher is read before the decision
+    assert other_scheduler.report("job-001", training([0.3]), epochs=4)
+    assert not scheduler.report("job-002", training([0.1]), epochs=4)
+    assert list(scheduler.records.name) == ["job-000", "job-001", "job-002"]